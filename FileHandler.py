@@ -1,6 +1,15 @@
+import lzma
+import zlib
+
 import zfec
 import os
 import math
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
 
 import config
 
@@ -9,94 +18,417 @@ class FileHandler:
     """
     Handle file division and recombination for any file type (text, binary, images, etc.)
     using Reed-Solomon error correction through the Zfec library.
+
+    Stripes are independent, so they are encoded and decoded on a pool of `workers` threads (zfec
+    releases the GIL while it computes). Results are written in stripe order, so the output is
+    byte-identical to the serial path, and a stripe is split between the workers rather than multiplied
+    by them, so memory use does not grow with the core count.
     """
 
-    def divide(self, file_path, NODE_ID, n=2000, block_size=config.SUBFILE_SIZE):
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+
+    def _stripe_window(self, stripe_size):
+        """
+        Split a stripe for the worker pool. Up to `window` sub-stripes of `sub_stripe` bytes are in flight
+        at once, and together they are no larger than one stripe, so the (k + n) * stripe_size memory
+        budget chosen by the redundancy policy holds whatever the number of workers. Sub-stripes are kept
+        at least `config.BUFFER_SIZE` long when the stripe allows it.
+
+        Returns:
+            Tuple[int, int]: The number of sub-stripes in flight and their size.
+        """
+        window = max(min(2 * self.workers, stripe_size // config.BUFFER_SIZE), 1)
+        return window, max(stripe_size // window, 1)
+
+    def _map_stripes(self, make_coder, function, stripes, window):
+        """
+        Apply `function(coder, stripe)` to every stripe on the worker pool, yielding (stripe, result) in
+        stripe order, with at most `window` stripes in flight. Coders are not shared between threads:
+        every thread builds its own with `make_coder`.
+        """
+        if self.workers <= 1 or window <= 1:
+            coder = make_coder()
+            for stripe in stripes:
+                yield stripe, function(coder, stripe)
+            return
+        local = threading.local()
+
+        def run(stripe):
+            if not hasattr(local, 'coder'):
+                local.coder = make_coder()
+            return function(local.coder, stripe)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, window)) as pool:
+            in_flight = deque()
+            for stripe in stripes:
+                in_flight.append((stripe, pool.submit(run, stripe)))
+                if len(in_flight) >= window:
+                    stripe, future = in_flight.popleft()
+                    yield stripe, future.result()
+            while in_flight:
+                stripe, future = in_flight.popleft()
+                yield stripe, future.result()
+
+    def divide(self, file_path, NODE_ID, n=2000, block_size=config.SUBFILE_SIZE, stripe_size=config.STRIPE_SIZE):
         """
-        Divide any type of file into exactly k parts using Reed-Solomon (RS) error correction.
-        This method works with binary data, so it can handle text files, binary files,
+        Divide any type of file into n parts using Reed-Solomon (RS) error correction, any k of which
+        rebuild the file. This method works with binary data, so it can handle text files, binary files,
         images, and any other type of file.
 
+        The file is encoded stripe by stripe: stripe j holds bytes [j*stripe_size, (j+1)*stripe_size) of
+        each of the k blocks, and the n encoded pieces of every stripe are appended to the part files as
+        they are produced. Only one stripe is held in memory at a time, whatever the file size, and the
+        parts are byte-identical to encoding the k whole blocks at once.
+
         Args:
             file_path (str): Path to the input file to be divided.
             NODE_ID (str): The ID of the node to include in the subfile names.
             n (int): Total number of parts to divide the file into.
             block_size (int): block_size
+            stripe_size (int): Number of bytes of each block encoded at a time.
 
         Returns:
             Tuple[List[str], int, str]: A tuple containing the list of file part filenames,
-            the size of the original file, and the NODE_ID.
+            k, and the NODE_ID.
         """
-        # Read the file in binary mode
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
+        original_size = os.path.getsize(file_path)  # Get the original file size
 
-        original_size = len(file_data)  # Get the original file size
+        # Calculate k, the number of blocks, from the file size and the block size
+        k = max(math.ceil(original_size / block_size), 1)
 
-        # Calculate block size dynamically based on the file size and k (minimum parts)
-        k = math.ceil(original_size / block_size)
-
-        # Split the file into exactly k blocks
-        file_blocks = [file_data[i:i + block_size] for i in range(0, len(file_data), block_size)]
+        file_name = os.path.basename(file_path)
+        # Unique file name based on original file name and part number
+        part_files = [f"{file_name}_part{i}" for i in range(n)]
+        with ExitStack() as stack:
+            source = stack.enter_context(open(file_path, 'rb'))
+            sinks = [stack.enter_context(open(part_file, 'wb')) for part_file in part_files]  # binary mode
+            for part_file, sink in zip(part_files, sinks):
+                sink.write(part_file.encode() + b",")  # peers store each share under its own name
+            self.encode_stripes(source, k, n, block_size, stripe_size, sinks)
 
-        # Pad the last block to make it equal in size if needed
-        if len(file_blocks) < k:
-            file_blocks.append(b'\x00' * block_size)
-        file_blocks[-1] = file_blocks[-1].ljust(block_size, b'\x00')
+        return part_files, k, NODE_ID  # Return the list of file parts, k, and NODE_ID
 
-        # Create an encoder (Reed-Solomon)
-        encoder = zfec.Encoder(k, n)
+    def encode(self, file_path, n, block_size=config.SUBFILE_SIZE, stripe_size=config.STRIPE_SIZE):
+        """
+        Same encoding as `divide`, but the n parts are kept in spooled temporary buffers instead of part
+        files in the working directory. Together the buffers hold at most `config.SPOOL_MEMORY` bytes in
+        memory; beyond that each one rolls over to the system temporary directory.
 
-        # Encode the file blocks into n parts with error correction
-        parts = encoder.encode(file_blocks)
+        Args:
+            file_path (str): Path to the input file to be encoded.
+            n (int): Total number of parts.
+            block_size (int): block_size
+            stripe_size (int): Number of bytes of each block encoded at a time.
 
-        # Save each part to a file with a unique name
-        part_files = []
+        Returns:
+            Tuple[List[SpooledTemporaryFile], int]: The n part buffers, rewound, and k. The caller closes them.
+        """
+        k = max(math.ceil(os.path.getsize(file_path) / block_size), 1)
         file_name = os.path.basename(file_path)
+        parts = [tempfile.SpooledTemporaryFile(max_size=config.SPOOL_MEMORY // n) for _ in range(n)]
         for i, part in enumerate(parts):
-            # Unique file name based on original file name, part number, and NODE_ID
-            part_filename = f"{file_name}_part{i}"
-            with open(part_filename, 'wb') as part_file:  # Write in binary mode
-                part_file.write(file_name.encode()+b","+part)
-            part_files.append(part_filename)
+            part.write(f"{file_name}_part{i},".encode())  # peers store each share under its own name
+        with open(file_path, 'rb') as source:
+            self.encode_stripes(source, k, n, block_size, stripe_size, parts)
+        for part in parts:
+            part.seek(0)
+        return parts, k
+
+    def encode_stripes(self, source, k, n, block_size, stripe_size, sinks):
+        """
+        Encode the k blocks of `source` stripe by stripe and append the n encoded pieces of every stripe
+        to the n sinks. Blocks (and the last one in particular) are padded with zeros to `block_size`.
+
+        Args:
+            source: Seekable binary file object holding the data.
+            k (int): Number of blocks the data is split into.
+            n (int): Number of encoded parts.
+            block_size (int): Size of each block.
+            stripe_size (int): Number of bytes of each block encoded at a time.
+            sinks (List): n writable binary file objects, one per part.
+        """
+        window, stripe_size = self._stripe_window(stripe_size)
+
+        def read_stripes():
+            for offset in range(0, block_size, stripe_size):
+                length = min(stripe_size, block_size - offset)
+                stripe = []
+                for block in range(k):
+                    source.seek(block * block_size + offset)
+                    stripe.append(source.read(length).ljust(length, b'\x00'))
+                yield stripe
+
+        # Encode every stripe into n pieces with error correction (Reed-Solomon)
+        for _, pieces in self._map_stripes(lambda: zfec.Encoder(k, n), lambda encoder, stripe: encoder.encode(stripe),
+                                           read_stripes(), window):
+            for sink, piece in zip(sinks, pieces):
+                sink.write(piece)
+
+    def compress(self, file_path, output_file, method=config.ZLIB, level=config.COMPRESSION_LEVEL):
+        """
+        Compress a file before it is erasure coded, streaming it so memory stays bounded. Data that does
+        not compress (a sample of it, then the whole file) is left as is.
+
+        Args:
+            file_path (str): Path of the file to compress.
+            output_file (str): Path of the compressed file.
+            method (str): config.ZLIB or config.LZMA.
+            level (int): Compression level, 0-9.
+
+        Returns:
+            str: The method used, or None if the data was not worth compressing and nothing was written.
+        """
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as source:
+            sample = source.read(config.COMPRESSION_SAMPLE)
+            compressor = self._compressor(method, level)
+            if len(compressor.compress(sample) + compressor.flush()) > config.COMPRESSION_MAX_RATIO * len(sample):
+                return None  # incompressible, e.g. already compressed or encrypted data
+            source.seek(0)
+            compressor = self._compressor(method, level)
+            with open(output_file, 'wb') as output:
+                while True:
+                    chunk = source.read(config.STRIPE_SIZE)
+                    if not chunk:
+                        break
+                    output.write(compressor.compress(chunk))
+                output.write(compressor.flush())
+        if os.path.getsize(output_file) >= size:
+            os.remove(output_file)
+            return None
+        return method
 
-        return part_files, k, NODE_ID  # Return the list of file parts, the original file size, and NODE_ID
+    def decompress(self, file_path, output_file, method):
+        """
+        Reverse `compress`, streaming the data. Every call to the decompressor is capped at
+        `config.STRIPE_SIZE` bytes of output, so a highly compressed chunk cannot expand all at once.
+        """
+        decompressor = self._decompressor(method)
+        with open(file_path, 'rb') as source, open(output_file, 'wb') as output:
+            while True:
+                chunk = source.read(config.STRIPE_SIZE)
+                if not chunk:
+                    break
+                if method == config.LZMA:
+                    output.write(decompressor.decompress(chunk, config.STRIPE_SIZE))
+                    while not decompressor.needs_input and not decompressor.eof:
+                        output.write(decompressor.decompress(b"", config.STRIPE_SIZE))
+                else:
+                    while chunk:
+                        output.write(decompressor.decompress(chunk, config.STRIPE_SIZE))
+                        chunk = decompressor.unconsumed_tail
+            if method == config.ZLIB:
+                output.write(decompressor.flush())
+
+    @staticmethod
+    def _compressor(method, level):
+        if method == config.ZLIB:
+            return zlib.compressobj(level)
+        if method == config.LZMA:
+            return lzma.LZMACompressor(preset=level)
+        raise ValueError(f"unknown compression method {method}")
 
-    def combine(self, part_files, n, k, output_file):
+    @staticmethod
+    def _decompressor(method):
+        if method == config.ZLIB:
+            return zlib.decompressobj()
+        if method == config.LZMA:
+            return lzma.LZMADecompressor()
+        raise ValueError(f"unknown compression method {method}")
+
+    def combine(self, part_files, n, k, output_file, original_size=None, stripe_size=config.STRIPE_SIZE,
+                compression=None, block_size=None):
         """
         Combine parts into the original file (any file type) using Reed-Solomon error correction.
         This method handles binary data and can combine text, binary, or any type of file.
 
+        Parts are decoded stripe by stripe straight into the output file, so only one stripe of each part
+        is held in memory at a time. Any k distinct shares can rebuild the file, as long as each part is
+        given with its real share number. Data shares (index < k) are preferred: when all k are there the
+        file is just their concatenation, otherwise only the missing blocks are decoded.
+
         Args:
-            part_files (List[str]): List of part file paths.
+            part_files (List[Tuple[int, str]]): (share index, part file path) pairs. Plain paths are
+                accepted too, in which case the share index is their position in the list. Instead of a
+                path, a part can be a seekable binary file object such as an in-memory buffer.
             n (int): Total number of parts.
             k (int): Minimum number of parts required to reconstruct the file.
             output_file (str): Path to the output file.
+            original_size (int): Size of the original file, to strip the padding of the last block.
+                When None, the output keeps the padding (k whole blocks). For a compressed file this is
+                the compressed size.
+            stripe_size (int): Number of bytes of each part decoded at a time.
+            compression (str): Method the file was compressed with before encoding, reversed after
+                decoding. None if it was not compressed.
+            block_size (int): Size of each share. Parts may be longer, e.g. padded by the transfer; only
+                their first `block_size` bytes are used. When None, it is the size of the parts.
+
+        Returns:
+            bool: True once the file was written.
+        """
+        if compression is not None:
+            with tempfile.TemporaryDirectory() as directory:
+                decoded_file = os.path.join(directory, os.path.basename(output_file))
+                self.combine(part_files, n, k, decoded_file, original_size, stripe_size, block_size=block_size)
+                self.decompress(decoded_file, output_file, compression)
+            return True
+
+        parts = {}  # share index -> part file path
+        for position, part_file in enumerate(part_files):
+            index, path = part_file if isinstance(part_file, tuple) else (position, part_file)
+            parts.setdefault(index, path)
+        if len(parts) < k:
+            raise ValueError(f"need {k} distinct shares to reconstruct the file, got {len(parts)}")
+        # Prefer the data shares: zfec is systematic, share i < k is block i of the file as is
+        indexes = sorted(parts, key=lambda index: (index >= k, index))[:k]
+
+        if block_size is None:
+            block_size = self._part_size(parts[indexes[0]])
+        if self.is_direct_copy(indexes, k):
+            self._copy_data_shares([parts[index] for index in indexes], output_file, block_size,
+                                   k * block_size if original_size is None else original_size)
+            return True
+
+        missing = [block for block in range(k) if block not in parts]
+        with ExitStack() as stack:
+            sources = [stack.enter_context(self._open_part(parts[index])) for index in indexes]
+            output = stack.enter_context(open(output_file, 'wb'))  # Write in binary mode
+            window, stripe_size = self._stripe_window(stripe_size)
+
+            def read_stripes():
+                for offset in range(0, block_size, stripe_size):
+                    length = min(stripe_size, block_size - offset)
+                    yield offset, [source.read(length) for source in sources]
+
+            # Decode with one Reed-Solomon decoder per worker thread. zfec reorders the lists it is given,
+            # so it gets copies and the stripe stays in share order for the data shares below
+            for (offset, stripe), decoded in self._map_stripes(
+                    lambda: zfec.Decoder(k, n), lambda decoder, item: decoder.decode(list(item[1]), list(indexes)),
+                    read_stripes(), window):
+                # Data shares are copied as they are, only the missing blocks come out of the decoder
+                for index, piece in zip(indexes, stripe):
+                    if index < k:
+                        output.seek(index * block_size + offset)
+                        output.write(piece)
+                for block in missing:
+                    output.seek(block * block_size + offset)
+                    output.write(decoded[block])
+            # Ensure the file is exactly the original size
+            output.truncate(k * block_size if original_size is None else original_size)
+        return True
+
+    def rebuild_shares(self, part_files, n, k, wanted, file_name, block_size, stripe_size=config.STRIPE_SIZE):
+        """
+        Regenerate lost shares of a file from k surviving ones, stripe by stripe, without rebuilding the
+        file: every stripe of the survivors is decoded back to the k data blocks, which are encoded again
+        into the wanted shares only. The encoding is deterministic, so the shares are identical to the
+        lost ones and still match the file's manifest.
+
+        Args:
+            part_files (List[Tuple[int, object]]): (share index, part path or file object) pairs, at least k.
+            n (int): Total number of parts.
+            k (int): Minimum number of parts required to reconstruct the file.
+            wanted (List[int]): Indexes of the shares to regenerate.
+            file_name (str): Name of the file, peers store each share under `{file_name}_part{i}`.
+            block_size (int): Size of each share; longer parts are read up to it.
+            stripe_size (int): Number of bytes of each part coded at a time.
 
         Returns:
-            None
+            List[SpooledTemporaryFile]: The shares, in the order of `wanted`, rewound. The caller closes them.
         """
-        # Read each part from the part files in binary mode
-        parts_data = []
-        indexes = []  # Track the part indexes used
-        for i, part_file in enumerate(part_files):
-            with open(part_file, 'rb') as f:
-                parts_data.append(f.read())
-                indexes.append(i)  # Record the index of each part
+        parts = {}  # share index -> part
+        for index, part in part_files:
+            parts.setdefault(index, part)
+        if len(parts) < k:
+            raise ValueError(f"need {k} distinct shares to rebuild shares, got {len(parts)}")
+        indexes = sorted(parts, key=lambda index: (index >= k, index))[:k]
+        wanted = list(wanted)
+        shares = [tempfile.SpooledTemporaryFile(max_size=config.SPOOL_MEMORY // n) for _ in wanted]
+        for index, share in zip(wanted, shares):
+            share.write(f"{file_name}_part{index},".encode())
+        with ExitStack() as stack:
+            sources = [stack.enter_context(self._open_part(parts[index])) for index in indexes]
+            window, stripe_size = self._stripe_window(stripe_size)
+
+            def read_stripes():
+                for offset in range(0, block_size, stripe_size):
+                    length = min(stripe_size, block_size - offset)
+                    yield [source.read(length).ljust(length, b'\x00') for source in sources]
 
-        # Create a decoder (Reed-Solomon)
-        decoder = zfec.Decoder(k, n)
+            def recode(coders, stripe):
+                decoder, encoder = coders
+                return encoder.encode(decoder.decode(list(stripe), list(indexes)), wanted)
 
-        # Decode the original file data from the parts using their indexes
-        decoded_blocks = decoder.decode(parts_data, indexes)
+            for _, pieces in self._map_stripes(lambda: (zfec.Decoder(k, n), zfec.Encoder(k, n)), recode,
+                                               read_stripes(), window):
+                for share, piece in zip(shares, pieces):
+                    share.write(piece)
+        for share in shares:
+            share.seek(0)
+        return shares
 
-        # Concatenate all the decoded blocks into a single bytes object
-        original_data = b''.join(decoded_blocks)
+    @staticmethod
+    def decode_range(pieces, n, k):
+        """
+        Decode the same byte range of k shares into that range of every data block. Shares are coded byte
+        position by byte position, so any range decodes on its own, without the rest of the shares.
+
+        Args:
+            pieces (dict): share index -> the bytes of the range in that share, at least k of them.
+            n (int): Total number of parts.
+            k (int): Minimum number of parts required to reconstruct the file.
+
+        Returns:
+            List[bytes]: The range of each of the k data blocks, in block order.
+        """
+        if len(pieces) < k:
+            raise ValueError(f"need {k} distinct shares to decode a range, got {len(pieces)}")
+        indexes = sorted(pieces, key=lambda index: (index >= k, index))[:k]
+        if FileHandler.is_direct_copy(indexes, k):
+            return [pieces[index] for index in indexes]
+        return zfec.Decoder(k, n).decode([pieces[index] for index in indexes], list(indexes))
 
-        # # Ensure the file is exactly the original size
-        # original_data = original_data[:original_size]
+    @staticmethod
+    def is_direct_copy(indexes, k):
+        """
+        Return True if the shares are exactly the k data shares, so the file is their concatenation and
+        no decoding is needed.
+        """
+        return sorted(indexes) == list(range(k))
 
-        # Write the original file to disk in binary mode
+    @staticmethod
+    def _copy_data_shares(data_files, output_file, block_size, size):
+        """
+        Write the file as the concatenation of the first `block_size` bytes of its data shares, in share
+        order, cut to `size` bytes.
+        """
         with open(output_file, 'wb') as output:
-            output.write(original_data)
-        return True
\ No newline at end of file
+            for data_file in data_files:
+                with FileHandler._open_part(data_file) as f:
+                    remaining = block_size
+                    while remaining > 0:
+                        chunk = f.read(min(remaining, config.STRIPE_SIZE))
+                        if not chunk:
+                            break
+                        output.write(chunk)
+                        remaining -= len(chunk)
+                    output.write(bytes(remaining))  # a short share is zero padded like the encoded block
+            output.truncate(size)
+
+    @staticmethod
+    def _open_part(part):
+        """
+        Open a part given as a path, or rewind a part given as a file object (left open for its owner).
+        """
+        if isinstance(part, str):
+            return open(part, 'rb')
+        part.seek(0)
+        return nullcontext(part)
+
+    @staticmethod
+    def _part_size(part):
+        if isinstance(part, str):
+            return os.path.getsize(part)
+        part.seek(0, os.SEEK_END)
+        return part.tell()
@@ -1,4 +1,3 @@
-import pickle
 import tkinter as tk
 from tkinter import filedialog, simpledialog, ttk
 import threading
@@ -123,15 +122,14 @@ class GUI:
         print(f"here is all the nodes:{self.node.DHT.get_dht()}") #todo check that it prints what we want
 
     def add_dht_to_dht(self):
-        """Prompt the user for a port and call the add_DHT method of the DHT class with the specified port."""
-
-        # Ask the user to enter the port for the new DHT
-        dht_path = filedialog.askopenfilename()
-        if dht_path:
-            with open(dht_path, "rb") as file:
-                newDHT = pickle.load(file)
-            # Add the new DHT to the current node's DHT list
-            self.node.add_DHT(newDHT)
+        """Prompt the user for a peer and pull the DHT entries it knows and we do not."""
+
+        # Ask the user to enter the peer to sync the DHT with
+        host = simpledialog.askstring("Add DHT", "Enter the Host:")
+        port = simpledialog.askinteger("Add DHT", "Enter the Port:")
+        if host and port:
+            changed = self.node.sync_with_peer(host, port)
+            print(f"DHT sync with {host}:{port} changed {changed} entries")
 
 
     def display_file_list(self):
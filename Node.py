@@ -1,18 +1,72 @@
 import bisect
+import functools
+import hashlib
+import inspect
+import json
+import math
 import os
 import random
 import secrets
 import socket
+import struct
+import tempfile
 import threading
 import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import List
 
 import config
 from dht import DHT
 from FileHandler import FileHandler
-from Peer import Peer, delete_file
+from Peer import Peer, delete_file, unpack_status
 from encryption import Encryption
-import pickle
+from liveness import FailureDetector
+from locations import ShareLocations
+from manifest import ShareManifest
+from packing import PACK_HEADER, FilePacker
+from peer_stats import PeerStats
+from redundancy import RedundancyPolicy
+from repair import RepairDaemon
+from placement import RendezvousPlacement
+from snapshot import (CHECKPOINT, DHT_SECTION, FILES_SECTION, UPLOADS_SECTION, Snapshot, decode_dht, decode_files,
+                      encode_dht, encode_files, write_snapshot)
+from routing import contact_from_dict, contact_to_dict, make_contact
+from transfer import (ACK, CHUNK_RANGE, TRANSFER_HEADER, SegmentReceiver, payload_size, receive_segments, recv_frame,
+                      send_frame, send_segments, transfer_id, unpack_chunks, unpack_sizes)
+
+
+PreparedUpload = namedtuple('PreparedUpload', ['file_path', 'name', 'subfiles', 'candidates', 'params', 'manifest'])
+UploadSummary = namedtuple('UploadSummary', ['uploaded', 'failed', 'shares', 'bytes_sent'])
+
+
+def foreground(method):
+    """
+    Count a call among the downloads the user is waiting for, which background repair lets go first. A
+    generator counts until it is exhausted or closed.
+    """
+    if inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def generator(self, *args, **kwargs):
+            with self._downloads_lock:
+                self._active_downloads += 1
+            try:
+                yield from method(self, *args, **kwargs)
+            finally:
+                with self._downloads_lock:
+                    self._active_downloads -= 1
+        return generator
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._downloads_lock:
+            self._active_downloads += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            with self._downloads_lock:
+                self._active_downloads -= 1
+    return wrapper
 
 
 def find_index(names, target):
@@ -25,6 +79,24 @@ def find_index(names, target):
     return -1
 
 
+def find_shares(names, file_name):
+    """
+    Find the shares of `file_name` in a peer's list of stored files. Shares are stored as
+    `{file_name}_part{i}`; a share stored by an older client under the bare file name has no known index.
+
+    Returns:
+        List[Tuple[int, int]]: (share index or None, position in `names`) pairs.
+    """
+    prefix = file_name + "_part"
+    shares = []
+    for position, name in enumerate(names):
+        if name == file_name:
+            shares.append((None, position))
+        elif name.startswith(prefix) and name[len(prefix):].isdigit():
+            shares.append((int(name[len(prefix):]), position))
+    return shares
+
+
 class Node(Peer):
     """
     Class that handles a node in the network.
@@ -38,38 +110,130 @@ class Node(Peer):
             self.publicKey, self.privateKey = Encryption.generatePublicPrivateKeys()
         else:
             self.privateKey = private_key
-            self.publicKey = private_key.public_key()
+            self.publicKey = private_key.public_key
         self.DHT = DHT()
         self.fileHandler = FileHandler()
         self.host = host
         self.port = port
         self.path = path
         self.uploaded_files = list() #list of all uploaded files and their corresponding n, k
+        self.manifests = dict()  # file name -> signed ShareManifest of the shares we uploaded
+        self.file_params = dict()  # file name -> parameters needed to rebuild it (size, n, k, block and stripe size)
+        self.redundancyPolicy = RedundancyPolicy()
+        self.filePacker = FilePacker()
+        self.compression = config.DEFAULT_COMPRESSION  # compression applied to uploads by default
+        self.packed_files = dict()  # small file name -> (container name, offset, length)
+        self.shareLocations = ShareLocations()  # which peer accepted each share of our uploads
+        self.peerStats = PeerStats()  # measured RTT, throughput and failure rate of the peers we talk to
+        self.peerStatus = {}  # (host, port) -> (time fetched, status record advertised by the peer)
+        self._peer_status_lock = threading.Lock()
+        self._synced = {}  # (host, port) -> (epoch, version) of the peer's DHT at our last sync with it
+        self.liveness = FailureDetector()  # which peers we currently suspect to be down
+        self.departed = {}  # node id -> node info of the peers removed from the DHT as dead
+        self._active_downloads = 0  # downloads the user is waiting for
+        self._downloads_lock = threading.Lock()
+        self.repairDaemon = RepairDaemon(self)  # regenerates the shares of our uploads lost with their peers
+        self._checkpoint = None  # (snapshot path, DHT epoch, DHT version, checkpoint number, section digests)
 
     def store_Node(self, password, path=""):
         """
-        Store the private key and DHT.
+        Store the private key, the DHT and what we need to download our uploads again.
         """
         Encryption.store(password, self.privateKey, path=path)
-        with open(os.path.join(path, 'dht.pickle'), 'wb') as handle:
-            pickle.dump(self.DHT.get_dht(), handle, protocol=pickle.HIGHEST_PROTOCOL)
-        with open(os.path.join(path, 'listfiles.pickle'), 'wb') as handle:
-            pickle.dump(self.spacePIR.get_file_names(), handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self.checkpoint(path)
+
+    def checkpoint(self, path=""):
+        """
+        Save the node state in a snapshot: the DHT in columns, the manifest of the files we store for
+        others, and our uploads. Once a base snapshot is written, later calls only write a checkpoint of
+        the DHT changes since the previous call and the sections that changed, until
+        `config.SNAPSHOT_CHECKPOINTS` checkpoints have piled up and a new base replaces them.
+        """
+        base_path = os.path.join(path, config.SNAPSHOT_FILE)
+        version = self.DHT.version  # read first: a change made meanwhile is saved again next time
+        sections = {FILES_SECTION: encode_files(self.spacePIR),
+                    UPLOADS_SECTION: json.dumps(self.uploads_state()).encode('utf-8')}
+        digests = {tag: hashlib.sha256(data).digest() for tag, data in sections.items()}
+        last = self._checkpoint
+        if last is None or last[0] != base_path or last[1] != self.DHT.epoch \
+                or last[3] >= config.SNAPSHOT_CHECKPOINTS or not os.path.exists(base_path):
+            # checkpoints of the previous base go first: they must never be applied over the new one
+            sequence = 1
+            while os.path.exists(f"{base_path}.{sequence}"):
+                os.remove(f"{base_path}.{sequence}")
+                sequence += 1
+            sections[DHT_SECTION] = encode_dht(*self.DHT.changes_since(0))
+            write_snapshot(base_path, sections)
+            sequence = 0
+        else:
+            sequence = last[3] + 1
+            sections = {tag: data for tag, data in sections.items() if digests[tag] != last[4].get(tag)}
+            sections[DHT_SECTION] = encode_dht(*self.DHT.changes_since(last[2], last[1]))
+            write_snapshot(f"{base_path}.{sequence}", sections, CHECKPOINT, sequence)
+        self._checkpoint = (base_path, self.DHT.epoch, version, sequence, digests)
+
+    def uploads_state(self):
+        """
+        What we know about our uploads as plain JSON types: without the parameters, a compressed upload
+        would be rebuilt as its compressed bytes. Manifests are stored with their signature, which
+        download checks, so a manifest edited on disk is refused.
+        """
+        return {config.UPLOADED_FILES: self.uploaded_files, config.FILE_PARAMS: self.file_params,
+                config.PACKED_FILES: self.packed_files, config.SHARE_LOCATIONS: self.shareLocations.to_dict(),
+                config.MANIFESTS: {name: manifest.to_dict() for name, manifest in self.manifests.items()}}
+
+    def restore_uploads(self, state):
+        """
+        Reverse `uploads_state`.
+        """
+        self.uploaded_files = [tuple(uploaded) for uploaded in state.get(config.UPLOADED_FILES, [])]
+        self.file_params.update(state.get(config.FILE_PARAMS, {}))
+        self.shareLocations = ShareLocations.from_dict(state.get(config.SHARE_LOCATIONS, {}))
+        self.packed_files.update({name: tuple(member) for name, member in state.get(config.PACKED_FILES, {}).items()})
+        self.manifests.update({name: ShareManifest.from_dict(manifest)
+                               for name, manifest in state.get(config.MANIFESTS, {}).items()})
 
     def get_uploaded_files(self):
         return self.uploaded_files
     def load_node(self, password, path=""):
         """
-        Load the private key and DHT from storage.
+        Load the private key, then the node state from its base snapshot and the checkpoints after it.
+
+        Raises:
+            ValueError: If there is no snapshot, or it is damaged or in an unknown format.
         """
         self.privateKey = Encryption.load(password, path)
-        self.publicKey = self.privateKey.public_key()
-        with open(os.path.join(path, 'dht.pickle'), 'rb') as handle:
-            dht = pickle.load(handle)
-        self.DHT.add_DHT(dht)
-        with open(os.path.join(path, 'listfiles.pickle'), 'rb') as handle:
-            listfiles = pickle.load(handle)
-        self.spacePIR.listfiles = listfiles
+        self.publicKey = self.privateKey.public_key
+        base_path = os.path.join(path, config.SNAPSHOT_FILE)
+        if not os.path.exists(base_path):
+            raise ValueError(f"no node snapshot in {path or os.getcwd()}")
+        digests = {}
+        sequence = 0
+        snapshot_path = base_path
+        while os.path.exists(snapshot_path):
+            with Snapshot(snapshot_path) as snapshot:
+                self._restore_snapshot(snapshot, digests)
+            sequence += 1
+            snapshot_path = f"{base_path}.{sequence}"
+        for node_id, info in self.DHT.nodes():
+            self.routingTable.add(make_contact(node_id, info[config.HOST], info[config.PORT]))
+        self._checkpoint = (base_path, self.DHT.epoch, self.DHT.version, sequence - 1, digests)
+
+    def _restore_snapshot(self, snapshot, digests):
+        """
+        Apply the sections of a snapshot or checkpoint, recording the digests of the ones it holds.
+        """
+        dht = snapshot.get(DHT_SECTION)
+        if dht is not None:
+            self.DHT.merge(*decode_dht(dht))
+        files = snapshot.get(FILES_SECTION)
+        if files is not None:
+            decode_files(files, self.spacePIR)
+            digests[FILES_SECTION] = hashlib.sha256(files).digest()
+        uploads = snapshot.get(UPLOADS_SECTION)
+        if uploads is not None:
+            self.restore_uploads(json.loads(bytes(uploads)))
+            digests[UPLOADS_SECTION] = hashlib.sha256(uploads).digest()
 
     def listfiles(self):
         """
@@ -77,96 +241,626 @@ class Node(Peer):
         """
         return self.spacePIR.listfiles()
 
-    def download(self, name, n, k):
+    @foreground
+    def download(self, name, n=None, k=None):
         """
-        Download and reconstruct a file using subfiles from peers.
+        Download and reconstruct a file using subfiles from peers. For files we uploaded, the n and k we
+        recorded at upload time are used; the given ones are only needed for other files.
         """
-        dht = self.DHT.get_dht()
-        part_files = []
+        params = self.file_params.get(name, {})
+        n = params.get(config.N, n)
+        k = params.get(config.K, k)
+        manifest = self.verified_manifest(name)
         SecurityRandom = 0  # a security random number for us to keep checking after we had already
         # received enough parts to reconstruct the message, in order to make MITM attacks not able to guess our
         # file based on when we stopped asking for new files for people
         if (n-k)//2 > 0:
             SecurityRandom = secrets.randbelow((n-k)//2)
-        for key in dht.keys():
-            try:
-                if len(part_files) >= k + SecurityRandom:
-                    print("downloaded enough, needs to reconstruct the message now")
-                    success = self.fileHandler.combine(part_files, n, k, os.path.join(self.path, name))
-                    if success:
-                        for file in part_files:
-                            delete_file(file)
-                        return True
-                    return False
-                info = dht[key]
-                port = info[config.PORT]
-                host = info[config.HOST]
-                file_name = self.download_from_peer(name, port, len(part_files), host)
-                if file_name is not None:
-                    part_files.append(file_name)
+        encoded_size = params.get(config.ENCODED_SIZE, params.get(config.FILE_SIZE))
+        part_files = self.fetch_shares(name, k + SecurityRandom, params, manifest, n=n)
+
+        try:
+            if len(part_files) < k:
+                return False
+            print("downloaded enough, needs to reconstruct the message now")
+            output_file = os.path.join(self.path, name)
+            self.fileHandler.combine(list(part_files.items()), n, k, output_file, original_size=encoded_size,
+                                     stripe_size=params.get(config.STRIPE, config.STRIPE_SIZE),
+                                     compression=params.get(config.COMPRESSION),
+                                     block_size=params.get(config.BLOCK_SIZE))
+            if manifest is not None and not manifest.verify_file(output_file):
+                print(f"reconstructed {name} does not match its manifest")
+                delete_file(output_file)
+                return False
+            return True
+        except ValueError as e:
+            print(f"error reconstructing {name}: {e}")
+            return False
+        finally:
+            for part in part_files.values():
+                part.close()
+
+    def verified_manifest(self, name):
+        """
+        Return the manifest of one of our uploads, None for other files.
+
+        Raises:
+            ValueError: If the manifest is not signed by this node.
+        """
+        manifest = self.manifests.get(name)
+        if manifest is not None and not manifest.verify_signature(self.manifest_key()):
+            raise ValueError(f"the manifest of {name} is not signed by this node")
+        return manifest
+
+    def fetch_plan(self, name, n, shares_per_peer=None, wanted=None):
+        """
+        The peers to ask for shares of a file, in order, with the share indexes to ask each for. The peers
+        recorded as holding a share at upload time come first. Then peers are asked for the shares
+        rendezvous placement puts on them: the assigned holder of every share, then the next preferred
+        peers, up to `config.PLACEMENT_PROBES` per share. Only then is every peer, fastest first, asked for
+        any share, which finds files placed by other means. Peers suspected to be down are skipped.
+
+        Yields:
+            Tuple[dict, set]: The node info and the share indexes to choose from (None for any).
+        """
+        for location in self.shareLocations.get(name):
+            info = {config.HOST: location.host, config.PORT: location.port}
+            if (wanted is None or location.share_index in wanted) and not self.is_suspected(info):
+                yield info, {location.share_index}
+        dht = self.DHT.get_dht()
+        if n is not None and dht:
+            shares_per_peer = shares_per_peer or math.ceil(n / len(dht))
+            preference = self.placement().preference(name, n, list(dht), shares_per_peer)
+            for depth in range(min(config.PLACEMENT_PROBES, len(dht))):
+                for share_index, node_ids in enumerate(preference):
+                    info = dht[node_ids[depth]]
+                    if (wanted is None or share_index in wanted) and not self.is_suspected(info):
+                        yield info, {share_index}
+        for _, info in self.rank_peers(dht):
+            yield info, wanted
+
+    def fetch_shares(self, name, count, params, manifest=None, wanted=None, n=None, share_range=None):
+        """
+        Fetch `count` distinct shares of a file from several peers in parallel. When we hold the file's
+        manifest, each share is checked against its digest as soon as it arrives; a bad share is dropped and
+        a replacement is fetched from the next peer, so the file is decoded from good shares only.
+
+        Args:
+            name (str): Name of the file.
+            count (int): Number of shares wanted.
+            params (dict): The parameters recorded at upload, empty for other files.
+            manifest (ShareManifest): The file's manifest, if we have it.
+            wanted (set): Share indexes to choose from, any share when None.
+            n (int): Number of shares of the file, when it is not in `params`.
+            share_range (Tuple[int, int]): Fetch only bytes [start, end) of the shares, one piece of the
+                manifest, which it is checked against. Whole shares when None.
+
+        Returns:
+            dict: share index -> downloaded part buffer, fewer than `count` if the peers did not have them.
+            The caller closes the buffers.
+        """
+        part_files = {}  # share index -> downloaded part buffer
+        plan = self.fetch_plan(name, params.get(config.N, n), params.get(config.SHARES_PER_PEER), wanted)
+        pending = {}  # future -> address of the peer
+        verify = None if manifest is None else manifest.verify_share
+        if manifest is not None and share_range is not None:
+            verify = functools.partial(manifest.verify_piece, piece=share_range[0] // manifest.piece_size)
+
+        def fetch_next():
+            for info, indexes in plan:
+                if indexes is not None:
+                    indexes = indexes - set(part_files)
+                    if not indexes:
+                        continue  # we already have the share this peer was asked for
+                future = self.executor.submit(self.download_from_peer, name, info[config.PORT],
+                                              len(part_files) + len(pending), info[config.HOST],
+                                              exclude=set(part_files), wanted=indexes, share_range=share_range)
+                pending[future] = (info[config.HOST], info[config.PORT])
+                return True
+            return False
+
+        while len(pending) < count and fetch_next():
+            pass
+        while pending and len(part_files) < count:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                address = pending.pop(future)
+                part = future.result()
+                if part is not None and config.BLOCK_SIZE in params and share_range is None:
+                    part[1].truncate(params[config.BLOCK_SIZE])  # anything past the share is transfer padding
+                if part is None:
+                    print(f"error downloading {name} from {address[0]}:{address[1]}")
+                elif part[0] in part_files:
+                    part[1].close()  # another peer sent the same share first
+                elif verify is not None and not verify(*part):
+                    print(f"share {part[0]} of {name} from {address[0]}:{address[1]} is corrupted, dropping it")
+                    self.peerStats.record_failure(address)  # it answered: bad, but alive
+                    part[1].close()
                 else:
-                    raise ValueError("error in getting filename and downloading from one of the files")
-            except Exception as e:
-                print(f"error downloading {name} from {host}: {e}")
-        # If failed, delete all partial files
-        for file in part_files:
-            delete_file(file)
-        return False
+                    part_files[part[0]] = part[1]
+                    continue
+                fetch_next()  # replace the share we did not get
+        for future in pending:
+            future.cancel()
+        return part_files
 
-    def upload(self, file_path):
+    def read_data_range(self, name, offset, length, shares):
         """
-        Upload a file to the network.
+        Read bytes [offset, offset + length) of one of our uncompressed uploads from its data shares only.
+        zfec is systematic, so data share i is bytes [i * block_size, (i + 1) * block_size) of the file
+        and no decoding is needed.
+
+        Args:
+            name (str): Name of the file.
+            offset (int): Offset of the first byte.
+            length (int): Number of bytes.
+            shares (dict): share index -> part buffer already fetched, filled with the shares this fetches.
+
+        Returns:
+            bytes: The data, or None if a data share could not be fetched.
         """
-        block_size = int(config.SUBFILE_SIZE)
-        n = max(int((os.path.getsize(file_path) * 2) / block_size), 1)
-        subfiles, k, _ = self.fileHandler.divide(file_path, self.peer_id, n=n, block_size=block_size)
+        params = self.file_params[name]
+        block_size = params[config.BLOCK_SIZE]
+        manifest = self.verified_manifest(name)
+        end = min(offset + length, params[config.ENCODED_SIZE])
+        data = []
+        for block in range(offset // block_size, (end - 1) // block_size + 1 if end > offset else 0):
+            if block not in shares:
+                fetched = self.fetch_shares(name, 1, params, manifest, wanted={block})
+                if block not in fetched:
+                    return None
+                shares[block] = fetched[block]
+            start = max(offset, block * block_size)
+            shares[block].seek(start - block * block_size)
+            data.append(shares[block].read(min(end, (block + 1) * block_size) - start))
+        return b"".join(data)
+
+    @foreground
+    def download_range(self, name, offset, length):
+        """
+        Read bytes [offset, offset + length) of one of our uploads, yielding them piece by piece as each
+        arrives. Only the pieces of the shares covering the range are fetched: the piece of the data share
+        holding the bytes is the file as it is, and when that share cannot be had, the same piece of any k
+        shares is decoded. Every piece is checked against the file's manifest.
+
+        A file uploaded compressed cannot be read in place: it is downloaded whole and the range read from it.
+
+        Args:
+            name (str): Name of the file.
+            offset (int): Offset of the first byte.
+            length (int): Number of bytes.
+
+        Yields:
+            bytes: The data, in order.
+
+        Raises:
+            ValueError: If the file is not one of our uploads, or a piece could not be fetched.
+        """
+        params = self.file_params.get(name)
+        if params is None or config.BLOCK_SIZE not in params:
+            raise ValueError(f"'{name}' is not one of our uploads, its layout is unknown")
+        if params.get(config.COMPRESSION) is not None:
+            if not self.download(name):
+                raise ValueError(f"could not download {name}")
+            with open(os.path.join(self.path, name), 'rb') as f:
+                f.seek(offset)
+                for data in iter(lambda: f.read(min(config.STRIPE_SIZE, offset + length - f.tell())), b""):
+                    yield data
+            return
+        n, k, block_size = params[config.N], params[config.K], params[config.BLOCK_SIZE]
+        manifest = self.verified_manifest(name)
+        piece_size = block_size  # without piece digests, only whole shares can be checked
+        if manifest is not None and manifest.piece_hashes is not None:
+            piece_size = manifest.piece_size
+        end = min(offset + length, params[config.ENCODED_SIZE])
+        decoded = {}  # (block, piece) -> piece of a data block decoded along with the one asked for
+        position = offset
+        while position < end:
+            block, start = divmod(position, block_size)
+            piece = start // piece_size
+            share_range = (piece * piece_size, min((piece + 1) * piece_size, block_size))
+            if (block, piece) not in decoded:
+                decoded.update(self._fetch_piece(name, block, piece, share_range, n, k, params, manifest,
+                                                 range(offset // block_size, (end - 1) // block_size + 1)))
+            data = decoded.pop((block, piece))
+            stop = min(end, block * block_size + share_range[1])
+            yield data[start - share_range[0]:stop - block * block_size - share_range[0]]
+            position = stop
+
+    def _fetch_piece(self, name, block, piece, share_range, n, k, params, manifest, blocks):
+        """
+        Fetch a piece of data block `block`, from its data share, or else by decoding the same piece of k
+        shares, which yields the piece of every block at once.
+
+        Returns:
+            dict: (block, piece) -> data, for `block` and the other blocks in `blocks` that were decoded.
+        """
+        parts = self.fetch_shares(name, 1, params, manifest, wanted={block}, share_range=share_range)
+        try:
+            if block in parts:
+                parts[block].seek(0)
+                return {(block, piece): parts[block].read()}
+        finally:
+            for part in parts.values():
+                part.close()
+        parts = self.fetch_shares(name, k, params, manifest, share_range=share_range)
+        try:
+            if len(parts) < k:
+                raise ValueError(f"could not fetch {k} shares of {name} for bytes {share_range} of its blocks")
+            pieces = {}
+            for index, part in parts.items():
+                part.seek(0)
+                pieces[index] = part.read()
+        finally:
+            for part in parts.values():
+                part.close()
+        data = self.fileHandler.decode_range(pieces, n, k)
+        return {(other, piece): data[other] for other in blocks if other < k}
+
+    def upload(self, file_path, compression=None, level=config.COMPRESSION_LEVEL):
+        """
+        Upload a file to the network. The redundancy policy chooses k, n, the block and stripe sizes and
+        how many shares a peer may hold; the chosen parameters are recorded in `file_params`.
+
+        Args:
+            file_path (str): Path of the file to upload.
+            compression (str): config.ZLIB or config.LZMA to compress the file before it is encoded,
+                defaults to the node's `compression`. Incompressible files are sent as they are.
+            level (int): Compression level, 0-9.
+        """
+        prepared = self.prepare_upload(file_path, compression, level)
+        try:
+            placed = self.place_shares(prepared.name, prepared.subfiles, prepared.candidates,
+                                       prepared.params[config.SHARES_PER_PEER])
+            if placed is None:
+                return 0, 0
+            return self.record_upload(prepared, placed)
+        finally:
+            for subfile in prepared.subfiles:
+                subfile.close()
+
+    def upload_many(self, file_paths, compression=None, level=config.COMPRESSION_LEVEL):
+        """
+        Upload many files, encoding the next file on a background thread while the shares of the current
+        one are sent, so both the CPU and the network stay busy. The shares of a file bound for the same
+        peer are sent over one connection.
+
+        Args:
+            file_paths (List[str]): Paths of the files to upload.
+            compression (str): As in `upload`.
+            level (int): Compression level, 0-9.
+
+        Returns:
+            UploadSummary: (n, k) of every file uploaded, the files that failed, and the number of shares
+            and bytes sent.
+        """
+        uploaded, failed = {}, []
+        shares = sent = 0
+        with ThreadPoolExecutor(max_workers=1) as encoder:
+            upcoming = deque(encoder.submit(self.prepare_upload, file_path, compression, level)
+                             for file_path in file_paths[:1])
+            for i, file_path in enumerate(file_paths):
+                future = upcoming.popleft()
+                if i + 1 < len(file_paths):
+                    upcoming.append(encoder.submit(self.prepare_upload, file_paths[i + 1], compression, level))
+                try:
+                    prepared = future.result()
+                except (OSError, ValueError) as e:
+                    print(f"could not encode {file_path}: {e}")
+                    failed.append(file_path)
+                    continue
+                try:
+                    placed = self.place_shares_batched(prepared.name, prepared.subfiles, prepared.candidates,
+                                                       prepared.params[config.SHARES_PER_PEER])
+                    if placed is None:
+                        failed.append(file_path)
+                        continue
+                    uploaded[file_path] = self.record_upload(prepared, placed)
+                    shares += len(prepared.subfiles)
+                    sent += sum(payload_size(subfile) for subfile in prepared.subfiles)
+                finally:
+                    for subfile in prepared.subfiles:
+                        subfile.close()
+        return UploadSummary(uploaded, failed, shares, sent)
+
+    def prepare_upload(self, file_path, compression=None, level=config.COMPRESSION_LEVEL):
+        """
+        Everything an upload does before sending shares: compress the file, choose its parameters and the
+        peers to place it on, encode it and build its manifest.
+
+        Returns:
+            PreparedUpload: The encoded shares (the caller closes them) and what is recorded once they are placed.
+        """
+        compression = compression or self.compression
+        size = os.path.getsize(file_path)
         dht = self.DHT.get_dht()
-        if len(dht) < n * Node.SAFETY_CONSTANT:
-            raise ValueError(config.DHT_SMALL)
-        i = 0
-        for node in dht.values():
-            if self.upload_to_peer(subfiles[i], node[config.PORT], node[config.HOST]):
-                i += 1
-            if i >= n:
-                self.uploaded_files.append((file_path, n, k))
-                return n, k
-        return 0, 0
+        with tempfile.TemporaryDirectory() as directory:
+            source = file_path
+            if compression is not None:
+                compressed_file = os.path.join(directory, os.path.basename(file_path))
+                compression = self.fileHandler.compress(file_path, compressed_file, compression, level)
+                if compression is not None:
+                    source = compressed_file
+            encoded_size = os.path.getsize(source)
+            params = self.redundancyPolicy.choose(encoded_size, len(dht) // Node.SAFETY_CONSTANT)
+            candidates = self.placement_candidates(dht, math.ceil(params[config.N] / params[config.SHARES_PER_PEER]))
+            if len(candidates) < len(dht):  # some peers refused uploads, fewer peers to spread the shares on
+                params = self.redundancyPolicy.choose(encoded_size, len(candidates) // Node.SAFETY_CONSTANT)
+            subfiles, k = self.fileHandler.encode(source, params[config.N], block_size=params[config.BLOCK_SIZE],
+                                                  stripe_size=params[config.STRIPE])
+        manifest = ShareManifest.build(os.path.basename(file_path), file_path, subfiles, self.manifest_key(),
+                                       piece_size=params[config.STRIPE])
+        params = dict(params, **{config.K: k, config.FILE_SIZE: size, config.ENCODED_SIZE: encoded_size,
+                                 config.COMPRESSION: compression})
+        return PreparedUpload(file_path, os.path.basename(file_path), subfiles, candidates, params, manifest)
+
+    def record_upload(self, prepared, placed):
+        """
+        Record an upload whose shares were all placed, `placed` holding the node id of every share.
+
+        Returns:
+            Tuple[int, int]: n and k.
+        """
+        name = prepared.name
+        self.shareLocations.remove(name)  # an upload under the same name replaces the old one
+        infos = dict(prepared.candidates)
+        for share_index, node_id in enumerate(placed):
+            node = infos[node_id]
+            self.shareLocations.add(name, share_index, node_id, node[config.HOST], node[config.PORT])
+        n, k = prepared.params[config.N], prepared.params[config.K]
+        self.uploaded_files.append((prepared.file_path, n, k))
+        self.manifests[name] = prepared.manifest
+        self.file_params[name] = prepared.params
+        return n, k
+
+    def place_shares(self, name, subfiles, candidates, shares_per_peer):
+        """
+        Upload every share to the peer rendezvous placement assigns it, or when that peer refuses it, to
+        the next peer in the share's preference order, so a downloader finds it by computing the same order.
+
+        Args:
+            name (str): Name of the file.
+            subfiles (List): The encoded shares, in share order.
+            candidates (List[Tuple[str, dict]]): (node id, node info) pairs of the peers to place shares on.
+            shares_per_peer (int): Most shares of the file a peer may hold.
+
+        Returns:
+            List: The node id holding each share, or None if a share could not be placed.
+        """
+        infos = dict(candidates)
+        preference = self.placement().preference(name, len(subfiles), list(infos), shares_per_peer)
+        load = Counter()
+        placed = []
+        for subfile, node_ids in zip(subfiles, preference):
+            for node_id in node_ids:
+                if load[node_id] >= shares_per_peer:
+                    continue
+                node = infos[node_id]
+                if self.upload_to_peer(subfile, node[config.PORT], node[config.HOST]):
+                    self._reserve_capacity((node[config.HOST], node[config.PORT]))
+                    load[node_id] += 1
+                    placed.append(node_id)
+                    break
+            else:
+                return None
+        return placed
+
+    def place_shares_batched(self, name, subfiles, candidates, shares_per_peer):
+        """
+        Place shares as `place_shares` does, but send the shares assigned to the same peer over one
+        connection, to all the peers in parallel. Shares a peer refused then go one by one to the next
+        peers in their preference order.
+
+        Returns:
+            List: The node id holding each share, or None if a share could not be placed.
+        """
+        infos = dict(candidates)
+        preference = self.placement().preference(name, len(subfiles), list(infos), shares_per_peer)
+        load = Counter()
+        batches = {}  # node id -> indexes of the shares assigned to it
+        for share_index, node_ids in enumerate(preference):
+            node_id = next((node_id for node_id in node_ids if load[node_id] < shares_per_peer), None)
+            if node_id is None:
+                return None
+            load[node_id] += 1
+            batches.setdefault(node_id, []).append(share_index)
+        futures = {node_id: self.executor.submit(self.upload_batch_to_peer, [subfiles[i] for i in indexes],
+                                                 infos[node_id][config.PORT], infos[node_id][config.HOST])
+                   for node_id, indexes in batches.items()}
+        placed = [None] * len(subfiles)
+        for node_id, future in futures.items():
+            for share_index, success in zip(batches[node_id], future.result()):
+                if success:
+                    placed[share_index] = node_id
+                    self._reserve_capacity((infos[node_id][config.HOST], infos[node_id][config.PORT]))
+                else:
+                    load[node_id] -= 1
+        for share_index, node_id in enumerate(placed):
+            if node_id is not None:
+                continue
+            for node_id in preference[share_index]:
+                if load[node_id] >= shares_per_peer:
+                    continue
+                node = infos[node_id]
+                if self.upload_to_peer(subfiles[share_index], node[config.PORT], node[config.HOST]):
+                    self._reserve_capacity((node[config.HOST], node[config.PORT]))
+                    load[node_id] += 1
+                    placed[share_index] = node_id
+                    break
+            else:
+                return None
+        return placed
+
+    def placement(self):
+        """
+        Rendezvous placement of our shares, keyed with a key derived from our private key.
+        """
+        return RendezvousPlacement(Encryption.derive_key(self.privateKey, config.PLACEMENT_KEY))
+
+    def manifest_key(self):
+        """
+        Key signing the manifests of our uploads, derived from our private key.
+        """
+        return Encryption.derive_key(self.privateKey, config.MANIFEST_KEY)
+
+    def upload_packed(self, file_paths, container_name=None):
+        """
+        Bundle many small files into one container and upload it as a single file, so they share the
+        erasure coding, the uploads and the PIR passes instead of costing a padded subfile each.
+
+        Returns:
+            Tuple[str, int, int]: The container name and its n, k (0, 0 if the upload failed).
+        """
+        if container_name is None:
+            container_name = f"pack_{self.peer_id}_{secrets.token_hex(8)}"
+        with tempfile.TemporaryDirectory() as directory:
+            container_path = os.path.join(directory, container_name)
+            index = self.filePacker.pack(file_paths, container_path)
+            n, k = self.upload(container_path)
+        if n:
+            for name, (offset, length) in index.items():
+                self.packed_files[name] = (container_name, offset, length)
+        return container_name, n, k
+
+    @foreground
+    def download_packed(self, name, container_name=None):
+        """
+        Download a single file that was uploaded inside a container by `upload_packed`. Only the data
+        shares covering the member are fetched, unless the container was compressed, in which case the
+        whole container is rebuilt. A member missing from `packed_files` is looked up in the index the
+        container carries, in `container_name` or in every container we know of.
+        """
+        if name not in self.packed_files:
+            containers = [container_name] if container_name is not None else sorted(
+                {container for container, _, _ in self.packed_files.values()})
+            for container in containers:
+                index = self.read_container_index(container)
+                for member, (offset, length) in (index or {}).items():
+                    self.packed_files[member] = (container, offset, length)
+                if name in self.packed_files:
+                    break
+            else:
+                raise ValueError(f"'{name}' was not uploaded in a container")
+        container_name, offset, length = self.packed_files[name]
+        params = self.file_params.get(container_name, {})
+        output_file = os.path.join(self.path, name)
+        if config.BLOCK_SIZE in params and params.get(config.COMPRESSION) is None:
+            shares = {}
+            try:
+                data = self.read_data_range(container_name, offset, length, shares)
+            finally:
+                for part in shares.values():
+                    part.close()
+            if data is not None:
+                with open(output_file, 'wb') as f:
+                    f.write(data)
+                return True
+        # Rebuild the whole container, from any k shares
+        if not self.download(container_name):
+            return False
+        container_path = os.path.join(self.path, container_name)
+        try:
+            return self.filePacker.extract(container_path, name, output_file)
+        finally:
+            delete_file(container_path)
+
+    def read_container_index(self, container_name):
+        """
+        Read the member index of one of our containers from the data shares holding its start.
+
+        Returns:
+            dict: member name -> (offset, length), or None if the container cannot be read that way.
+        """
+        params = self.file_params.get(container_name, {})
+        if config.BLOCK_SIZE not in params or params.get(config.COMPRESSION) is not None:
+            return None
+        shares = {}
+        try:
+            header = self.read_data_range(container_name, 0, PACK_HEADER.size, shares)
+            if header is None:
+                return None
+            length = PACK_HEADER.unpack(header)[2]
+            return self.filePacker.parse_index(
+                self.read_data_range(container_name, 0, PACK_HEADER.size + length, shares))
+        finally:
+            for part in shares.values():
+                part.close()
 
     def upload_to_peer(self, file, port, host="127.0.0.1"):
         """
-        Upload the file to a peer using a client socket.
+        Upload the file to a peer as checksummed segments. If the connection drops, reconnect and resume
+        from the last offset the peer acknowledged instead of resending the whole file.
+
+        Args:
+            file: Path of the file, or a seekable binary file object streamed straight to the socket.
+            port (int): Port of the peer.
+            host (str): Host of the peer.
         """
+        if isinstance(file, str):
+            with open(file, 'rb') as f:
+                return self.upload_to_peer(f, port, host)
         print("uploading from ", str(self.peer_id), " to port: ", str(port))
-        try:
-            with socket.create_connection((host, port)) as sock:
-                self.send_message(config.REQUEST_UPLOAD, sock)
-                uploaded = self.is_uploaded_approved(sock)
-                time.sleep(0.1)  # 100 ms to give the peer time to process the request
-
-                i = 0
-                while uploaded == -1 and i < Node.NUMBER_TRIES_UPLOAD:
-                    time.sleep(0.1)  # 100 ms to give the peer time to process the request
-                    uploaded = self.is_uploaded_approved(sock)
-                    i += 1
-
-                if uploaded == 0 or uploaded == -1:
-                    return False
-
-                # Send the file
-                self.send_file(file, sock)
-                print("file has been sent")
-
-                # Wait for success confirmation
-                for i in range(Node.NUMBER_TRIES_UPLOAD):
-                    success = self.is_uploaded_success(sock)
-                    if success == 1:
-                        return True
-                    elif success == 0:
-                        self.send_file(file, sock)
-                return False
-        except Exception as e:
-            print(f"Error uploading to peer: {e}")
+        payload = file
+        if self.liveness.is_suspected((host, port)):
             return False
+        size = payload_size(payload)
+        key = transfer_id(payload)
+        start = time.monotonic()
+        for attempt in range(Node.NUMBER_TRIES_UPLOAD):
+            try:
+                with socket.create_connection((host, port), timeout=config.TRANSFER_TIMEOUT) as sock:
+                    self.send_message(config.REQUEST_UPLOAD_SEGMENTED, sock)
+                    if recv_frame(sock) != config.UPLOAD_APPROVED:
+                        return False
+                    send_frame(sock, TRANSFER_HEADER.pack(size, config.SEGMENT_SIZE) + key.encode())
+                    offset = ACK.unpack(recv_frame(sock))[0]
+                    send_segments(sock, payload, offset)
+                    success = recv_frame(sock) == config.UPLOADED_SUCCESS
+                    if success:
+                        self.peerStats.record_success((host, port), size, time.monotonic() - start)
+                        self.peer_answered((host, port))
+                    return success
+            except (OSError, ValueError, struct.error) as e:
+                self.peer_missed((host, port))
+                print(f"Error uploading to peer (attempt {attempt + 1}): {e}")
+                if self.liveness.is_suspected((host, port)):
+                    break
+        return False
+
+    def upload_batch_to_peer(self, files, port, host="127.0.0.1"):
+        """
+        Upload several files to a peer over one connection, each as checksummed segments. A file whose
+        upload fails, with the ones after it if the connection drops, is left for the caller to retry.
+
+        Returns:
+            List[bool]: Whether each file was stored by the peer.
+        """
+        results = [False] * len(files)
+        if self.liveness.is_suspected((host, port)):
+            return results
+        start = time.monotonic()
+        sent = 0
+        try:
+            with socket.create_connection((host, port), timeout=config.TRANSFER_TIMEOUT) as sock:
+                self.send_message(config.REQUEST_UPLOAD_BATCH, sock)
+                if recv_frame(sock) != config.UPLOAD_APPROVED:
+                    return results
+                for i, payload in enumerate(files):
+                    size = payload_size(payload)
+                    send_frame(sock, TRANSFER_HEADER.pack(size, config.SEGMENT_SIZE) + transfer_id(payload).encode())
+                    offset = ACK.unpack(recv_frame(sock))[0]
+                    send_segments(sock, payload, offset)
+                    results[i] = recv_frame(sock) == config.UPLOADED_SUCCESS
+                    sent += size
+                send_frame(sock, config.BATCH_END)
+        except (OSError, ValueError, struct.error) as e:
+            self.peer_missed((host, port))
+            print(f"Error uploading a batch to peer {host}:{port}: {e}")
+            return results
+        self.peerStats.record_success((host, port), sent, time.monotonic() - start)
+        self.peer_answered((host, port))
+        return results
+
     def vector_to_bytes(self, vector: List[bytes]) -> bytes:
         """
         make a vector into a bytes object.
@@ -175,49 +869,473 @@ class Node(Peer):
         """
 
 
-    def download_from_peer(self, name, port, number, host="127.0.0.1"):
+    def download_from_peer(self, name, port, number, host="127.0.0.1", exclude=(), wanted=None, share_range=None):
         """
-        Download a file part from a peer.
+        Download a share of a file from a peer. The PIR response arrives as checksummed segments; if the
+        connection drops, reconnect and resume it from the last offset we acknowledged.
+
+        Args:
+            name (str): Name of the file.
+            port (int): Port of the peer.
+            number (int): Share index assumed for a share stored without one by an older client.
+            host (str): Host of the peer.
+            exclude (set): Share indexes we already have, that should not be downloaded again.
+            wanted (set): Share indexes to choose from, any share when None.
+            share_range (Tuple[int, int]): Download only bytes [start, end) of the share: the peer answers
+                for the chunks covering them only, so its PIR pass costs in proportion to the range.
+
+        Returns:
+            Tuple[int, SpooledTemporaryFile]: The share index and a buffer holding the downloaded part (to be
+            closed by the caller), or None on failure.
         """
+        if self.liveness.is_suspected((host, port)):
+            return None
+        share_index = number
+        share_size = None
+        header_size = None
+        first = 0  # first chunk of the response
+        token = None
+        receiver = None
+        start = time.monotonic()
+        for attempt in range(Node.NUMBER_TRIES_UPLOAD):
+            try:
+                with socket.create_connection((host, port), timeout=config.TRANSFER_TIMEOUT) as sock:
+                    if token is not None:
+                        self.send_message(config.REQUEST_RESUME_DOWNLOAD, sock)
+                        recv_frame(sock)
+                        send_frame(sock, token)
+                        if recv_frame(sock) == config.RESPONSE_EXPIRED:
+                            token = None  # the peer dropped the response, ask for a new one
+                            continue
+                    else:
+                        self.send_message(config.REQUEST_FILE_SEGMENTED if share_range is None
+                                          else config.REQUEST_FILE_RANGE, sock)
+                        file_list = self.construct_list_from_string(recv_frame(sock))
+                        file_sizes = unpack_sizes(recv_frame(sock))
+                        shares = [(index, i) for index, i in find_shares(file_list, name)
+                                  if index not in exclude and (wanted is None or index in wanted)]
+                        if not shares:
+                            return None
+                        # Prefer the data shares, that rebuild the file without decoding
+                        index, i = min(shares, key=lambda share: (share[0] is None, share[0] or 0))
+                        share_index = number if index is None else index
+                        share_size = file_sizes[i]
+                        header_size = len(file_list[i]) + 1  # the share is stored after its `name,` header
+                        if share_range is not None:
+                            first = (header_size + share_range[0]) // config.BUFFER_SIZE
+                            last = math.ceil(min(header_size + share_range[1], share_size) / config.BUFFER_SIZE)
+                            send_frame(sock, CHUNK_RANGE.pack(first, last - first))
+                        send_frame(sock, self.construct_vector(i, len(file_list)))
+                        sock.settimeout(None)  # the peer runs the whole PIR pass before it answers
+                        header = recv_frame(sock)
+                        sock.settimeout(config.TRANSFER_TIMEOUT)
+                        token = header[:config.TOKEN_SIZE]
+                        total_size, _ = TRANSFER_HEADER.unpack(header[config.TOKEN_SIZE:])
+                        receiver = SegmentReceiver(total_size)
+                    send_frame(sock, ACK.pack(receiver.offset))
+                    receive_segments(sock, receiver)
+                    self.peerStats.record_success((host, port), receiver.total_size, time.monotonic() - start)
+                    self.peer_answered((host, port))
+                    break
+            except (OSError, ValueError, struct.error) as e:
+                self.peer_missed((host, port))
+                print(f"Error downloading from peer (attempt {attempt + 1}): {e}")
+                if self.liveness.is_suspected((host, port)):
+                    return None
+        else:
+            return None
+
         try:
-            with socket.create_connection((host, port)) as sock:
-                self.send_message(config.REQUEST_FILE, sock)
-                file_list = self.receive_obj(sock)
-                file_list = self.construct_list_from_string(file_list)
-                i = find_index(file_list, name)
-                n = len(file_list)
-                v = self.construct_vector(i, n)
-                self.send_message(v, sock)
-                time.sleep(2) #debug wait for 2 seconds to recieve
-                list_chunks = list()
-                for i in range(config.SUBFILE_SIZE//config.BUFFER_SIZE):
-                    obj = self.receive_obj(sock) #Here
-                    list_chunks.append(obj)
-
-
-            if i == -1: #if we failed to send
-                return None
-            data = ""
-            for chunk in list_chunks:
-                decrypted_file = Encryption.decrypt(self.privateKey, obj)
-                file_content_reverted = decrypted_file.decode()
-                data+=file_content_reverted
-            file = data.split(',')[1].encode()
-            filename = os.path.join(self.path, f"{name}_{number}")
-            with open(filename, 'wb') as handle:
-                handle.write(file)
-            print(f"filename has been recieved and it is :{filename}")
-            return filename
+            data = self.decode_response(unpack_chunks(receiver.get_data()), share_size, first)
+            part = tempfile.SpooledTemporaryFile(max_size=config.SUBFILE_SIZE)
+            if share_range is None:
+                part.write(data.split(b',', 1)[1])
+            else:
+                start = header_size - first * config.BUFFER_SIZE
+                part.write(data[start + share_range[0]:start + share_range[1]])
+            print(f"share {share_index} of {name} has been recieved")
+            return share_index, part
         except Exception as e:
             print(f"Error downloading from peer: {e}")
             return None
 
+    def decode_response(self, chunks, size, first=0):
+        """
+        Decrypt the chunks of a PIR response back into the `size` bytes of the stored file. Each chunk holds
+        `config.BUFFER_SIZE` bytes of the file as a big-endian integer, so the leading zeros it lost are put
+        back to the chunk's real length, and the chunks past the end of the file (the padding of the PIR
+        pass) are not decrypted at all. The response of a range starts at chunk `first` of the file.
+        """
+        pieces = []
+        for i, chunk in enumerate(chunks[:max(math.ceil(size / config.BUFFER_SIZE) - first, 0)]):
+            length = min(config.BUFFER_SIZE, size - (first + i) * config.BUFFER_SIZE)
+            pieces.append(Encryption.decrypt(self.privateKey, chunk).rjust(length, b'\x00'))
+        return b"".join(pieces)
+
+    def ping_peer(self, port, host="127.0.0.1"):
+        """
+        Measure the round trip time to a peer with a lightweight ping message.
+
+        Returns:
+            float: The round trip time in seconds, or None if the peer did not answer.
+        """
+        start = time.monotonic()
+        try:
+            with socket.create_connection((host, port), timeout=config.PING_TIMEOUT) as sock:
+                self.send_message(config.REQUEST_PING, sock)
+                if recv_frame(sock) != config.PONG:
+                    raise ValueError("unexpected answer to ping")
+        except (OSError, ValueError, struct.error) as e:
+            print(f"peer {host}:{port} did not answer ping: {e}")
+            self.peer_missed((host, port))
+            return None
+        rtt = time.monotonic() - start
+        self.peerStats.record_rtt((host, port), rtt)
+        self.peer_answered((host, port))
+        return rtt
+
+    def probe_peers(self):
+        """
+        Ping every peer in the DHT concurrently to refresh their statistics.
+
+        Returns:
+            dict: node id -> round trip time in seconds (None for peers that did not answer).
+        """
+        dht = self.DHT.get_dht()
+        futures = {node_id: self.executor.submit(self.ping_peer, info[config.PORT], info[config.HOST])
+                   for node_id, info in dht.items()}
+        return {node_id: future.result() for node_id, future in futures.items()}
+
+    def rank_peers(self, dht):
+        """
+        Order the DHT entries from the peer we expect to be fastest to the slowest, according to the
+        measured RTT, throughput and failure rate. Peers suspected to be down are left out.
+
+        Returns:
+            List[Tuple[str, dict]]: (node id, node info) pairs.
+        """
+        alive = [item for item in dht.items() if not self.is_suspected(item[1])]
+        return sorted(alive, key=lambda item: self.peerStats.score((item[1][config.HOST], item[1][config.PORT])))
+
+    def is_suspected(self, info):
+        return self.liveness.is_suspected((info[config.HOST], info[config.PORT]))
+
+    def peer_answered(self, address):
+        """
+        Record that a peer answered, which clears any suspicion of it.
+        """
+        if self.liveness.heard(address):
+            print(f"peer {address[0]}:{address[1]} answers again")
+
+    def peer_missed(self, address):
+        """
+        Record that a peer did not answer.
+        """
+        self.peerStats.record_failure(address)
+        self.liveness.missed(address)
+
+    def request_status(self, port, host="127.0.0.1"):
+        """
+        Ask a peer for its status record (free capacity, upload queue depth, upload allowed). Records are
+        cached for `config.STATUS_TTL` seconds.
+
+        Returns:
+            dict: The status record, or None if the peer did not answer.
+        """
+        address = (host, port)
+        with self._peer_status_lock:
+            cached = self.peerStatus.get(address)
+        if cached is not None and time.monotonic() - cached[0] < config.STATUS_TTL:
+            return cached[1]
+        start = time.monotonic()
+        try:
+            with socket.create_connection((host, port), timeout=config.PING_TIMEOUT) as sock:
+                self.send_message(config.REQUEST_STATUS, sock)
+                status = unpack_status(recv_frame(sock))
+        except (OSError, ValueError, struct.error) as e:
+            print(f"peer {host}:{port} did not send its status: {e}")
+            self.peer_missed(address)
+            return None
+        self.peerStats.record_rtt(address, time.monotonic() - start)
+        self.peer_answered(address)
+        with self._peer_status_lock:
+            self.peerStatus[address] = (time.monotonic(), status)
+        return status
+
+    def _reserve_capacity(self, address):
+        """
+        Account locally for a share we just placed on a peer, until its next status record.
+        """
+        with self._peer_status_lock:
+            cached = self.peerStatus.get(address)
+            if cached is not None:
+                cached[1][config.FREE_CAPACITY] = max(cached[1][config.FREE_CAPACITY] - 1, 0)
 
+    def placement_candidates(self, dht, needed=None):
+        """
+        Return the DHT entries to place shares on, best first. Peers are asked for their status in rank
+        order, only as many at a time as are still needed to hold `needed` shares, so an upload does not
+        cost a status round trip to every peer. Peers advertising that they are full or have uploads
+        turned off are left out. The others are ordered by their score scaled by their upload queue depth,
+        to spread the load. Next come the peers we did not need to ask, which the upload falls back on
+        when a peer rejects a share, and last the peers that did not answer.
+
+        Args:
+            dht (dict): The DHT entries to choose from.
+            needed (int): Number of peers wanted, all of them when None.
+
+        Returns:
+            List[Tuple[str, dict]]: (node id, node info) pairs.
+        """
+        ranked = self.rank_peers(dht)
+        needed = len(ranked) if needed is None else needed
+        accepting = []
+        unknown = []
+        asked = 0
+        while len(accepting) < needed and asked < len(ranked):
+            batch = ranked[asked:asked + needed - len(accepting)]
+            asked += len(batch)
+            futures = [self.executor.submit(self.request_status, info[config.PORT], info[config.HOST])
+                       for _, info in batch]
+            for (node_id, info), future in zip(batch, futures):
+                status = future.result()
+                if status is None:
+                    unknown.append((node_id, info))
+                elif status[config.UPLOAD_ALLOWED] and status[config.FREE_CAPACITY] > 0:
+                    load = self.peerStats.score((info[config.HOST], info[config.PORT])) * (
+                        1 + status[config.QUEUE_DEPTH])
+                    accepting.append((load, node_id, info))
+        accepting.sort(key=lambda item: item[0])
+        return [(node_id, info) for _, node_id, info in accepting] + ranked[asked:] + unknown
+
+    def find_node_at(self, contact, target):
+        """
+        Send a Kademlia FIND_NODE to one node.
+
+        Returns:
+            List[Contact]: The contacts it knows closest to `target`, or None if it did not answer. A node
+            that does not answer is dropped from our routing table.
+        """
+        address = (contact.host, contact.port)
+        try:
+            with socket.create_connection(address, timeout=config.PING_TIMEOUT) as sock:
+                self.send_message(config.REQUEST_FIND_NODE, sock)
+                recv_frame(sock)
+                send_frame(sock, json.dumps({config.TARGET: format(target, 'x'),
+                                             config.SENDER: contact_to_dict(self.contact)}))
+                contacts = [contact_from_dict(found) for found in json.loads(recv_frame(sock))]
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            print(f"peer {contact.host}:{contact.port} did not answer find node: {e}")
+            self.peer_missed(address)
+            self.routingTable.remove(contact.key)
+            return None
+        self.routingTable.add(contact)
+        self.peer_answered(address)
+        return contacts
+
+    def lookup(self, target, count=config.K_BUCKET_SIZE):
+        """
+        Iterative Kademlia lookup: ask the `config.ALPHA` closest nodes we have not asked yet, in parallel,
+        for the nodes they know closest to `target`, until the `count` closest nodes we heard of have all
+        answered.
+
+        Returns:
+            List[Contact]: The `count` closest live contacts found, closest first.
+        """
+        shortlist = {contact.key: contact for contact in self.routingTable.closest(target, count)}
+        queried = set()
+        failed = set()
+        while True:
+            closest = sorted((contact for key, contact in shortlist.items() if key not in failed),
+                             key=lambda contact: contact.key ^ target)[:count]
+            batch = [contact for contact in closest if contact.key not in queried][:config.ALPHA]
+            if not batch:
+                break
+            queried.update(contact.key for contact in batch)
+            futures = [(contact, self.executor.submit(self.find_node_at, contact, target)) for contact in batch]
+            for contact, future in futures:
+                found = future.result()
+                if found is None:
+                    failed.add(contact.key)
+                    continue
+                for new_contact in found:
+                    if new_contact.key != self.contact.key:
+                        shortlist.setdefault(new_contact.key, new_contact)
+        if target != self.contact.key:
+            self.routingTable.touch(self.routingTable.bucket_index(target))
+        return closest
+
+    def bootstrap(self, port, peer_id, host="127.0.0.1"):
+        """
+        Join the network through a known node: look ourselves up through it, which fills our routing
+        table with the nodes close to us and tells them about us.
+
+        Returns:
+            int: The number of contacts in our routing table.
+        """
+        if self.find_node_at(make_contact(peer_id, host, port), self.contact.key) is None:
+            return len(self.routingTable)
+        self.lookup(self.contact.key)
+        return len(self.routingTable)
+
+    def refresh_buckets(self):
+        """
+        Look up a random key in every bucket no lookup went through for `config.BUCKET_REFRESH` seconds,
+        so contacts at every distance stay fresh.
+        """
+        for index in self.routingTable.stale_buckets():
+            self.lookup(self.routingTable.random_key(index))
+
+    def discover_peers(self, count=config.K_BUCKET_SIZE):
+        """
+        Find live nodes at a random place of the key space and add them to the DHT entries uploads and
+        downloads work with.
+
+        Returns:
+            int: The number of nodes added.
+        """
+        found = self.lookup(random.getrandbits(config.ID_BITS), count)
+        return sum(self.DHT.add_node(contact.port, contact.peer_id, contact.host) for contact in found)
+
+    def start_maintenance(self):
+        """
+        Start the background thread keeping the routing table fresh.
+        """
+        threading.Thread(target=self._maintenance_loop, daemon=True).start()
+
+    def start_repair(self):
+        """
+        Start the background thread regenerating lost shares of our uploads.
+        """
+        self.repairDaemon.start()
+
+    def downloads_active(self):
+        with self._downloads_lock:
+            return self._active_downloads > 0
+
+    def stop(self):
+        self.repairDaemon.stop()
+        super().stop()
+
+    def _maintenance_loop(self):
+        while not self._stop_event.wait(config.MAINTENANCE_INTERVAL):
+            try:
+                self.maintain()
+            except Exception as e:
+                print(f"Error in maintenance of node {self.peer_id}: {e}")
+
+    def maintain(self):
+        """
+        One round of background maintenance.
+        """
+        self.heartbeat()
+        self.refresh_buckets()
+        self.sync_round()
+
+    def heartbeat(self):
+        """
+        Ping the DHT peers we have not heard from lately, in parallel. Peers suspected for
+        `config.DEAD_TIMEOUT` seconds are removed from the DHT and the routing table; a few of the departed
+        are pinged every round, and the ones answering are added back.
+
+        Returns:
+            List: Node ids of the peers removed.
+        """
+        quiet = {node_id: info for node_id, info in self.DHT.nodes()
+                 if node_id != self.peer_id and self.liveness.needs_heartbeat((info[config.HOST], info[config.PORT]))}
+        departed = dict(random.sample(list(self.departed.items()), min(config.READMIT_PROBES, len(self.departed))))
+        futures = {node_id: self.executor.submit(self.ping_peer, info[config.PORT], info[config.HOST])
+                   for node_id, info in list(quiet.items()) + list(departed.items())}
+        removed = []
+        for node_id, future in futures.items():
+            answered = future.result() is not None
+            if node_id in departed:
+                if answered:
+                    self.departed.pop(node_id, None)
+                    info = departed[node_id]
+                    self.add_node_to_DHT(info[config.PORT], node_id, info[config.HOST])
+            elif not answered and self.liveness.is_dead((quiet[node_id][config.HOST], quiet[node_id][config.PORT])):
+                self.remove_dead_peer(node_id, quiet[node_id])
+                removed.append(node_id)
+        return removed
+
+    def remove_dead_peer(self, node_id, info):
+        """
+        Remove a peer we consider dead from the DHT and the routing table, keeping it among the departed
+        in case it comes back.
+        """
+        print(f"peer {info[config.HOST]}:{info[config.PORT]} is down, removing it from the DHT")
+        self.DHT.remove_node(node_id)
+        self.routingTable.remove(make_contact(node_id, info[config.HOST], info[config.PORT]).key)
+        self.liveness.forget((info[config.HOST], info[config.PORT]))
+        self.departed[node_id] = info
+
+    def sync_round(self, fanout=config.SYNC_FANOUT):
+        """
+        Sync the DHT with a few random peers, so membership changes spread through the network.
+        """
+        peers = [info for node_id, info in self.DHT.nodes() if node_id != self.peer_id]
+        for info in random.sample(peers, min(fanout, len(peers))):
+            self.sync_with_peer(info[config.HOST], info[config.PORT])
+
+    def sync_with_peer(self, host, port):
+        """
+        Pull the DHT entries a peer changed since our last sync with it. We send the version of its DHT
+        we last saw and the digest of ours: the peer answers with nothing when the digests match, and
+        otherwise with the entries and removals after that version, so a sync costs what changed rather
+        than the whole table.
+
+        Returns:
+            int: The number of entries added or updated, or None if the peer did not answer.
+        """
+        address = (host, port)
+        epoch, version = self._synced.get(address, (None, 0))
+        try:
+            with socket.create_connection(address, timeout=config.PING_TIMEOUT) as sock:
+                sock.settimeout(config.TRANSFER_TIMEOUT)
+                self.send_message(config.REQUEST_SYNC, sock)
+                recv_frame(sock)
+                send_frame(sock, json.dumps({config.EPOCH: epoch, config.VERSION: version,
+                                             config.DIGEST: self.DHT.digest()}))
+                reply = json.loads(recv_frame(sock))
+            changed = self.DHT.merge(reply[config.ENTRIES], reply[config.REMOVED])
+        except (OSError, ValueError, KeyError, TypeError, struct.error) as e:
+            print(f"peer {host}:{port} did not answer DHT sync: {e}")
+            self.peer_missed(address)
+            return None
+        self.peer_answered(address)
+        dht = self.DHT.get_dht()
+        for node_id in changed:
+            if node_id in dht:
+                self.departed.pop(node_id, None)  # announced again after we removed it
+                self.routingTable.add(make_contact(node_id, dht[node_id][config.HOST], dht[node_id][config.PORT]))
+        self._synced[address] = (reply[config.EPOCH], reply[config.VERSION])
+        return len(changed)
+
+    def handle_sync_request(self, sock):
+        """
+        Answer a DHT sync: the changes after the version the peer last saw, unless its digest shows it
+        already has our entries.
+        """
+        send_frame(sock, config.TRANSFER_READY)
+        request = json.loads(recv_frame(sock))
+        version = self.DHT.version  # read first: a change made meanwhile is sent again next time
+        if request.get(config.DIGEST) == self.DHT.digest():
+            entries, removed = [], []
+        else:
+            entries, removed = self.DHT.changes_since(request.get(config.VERSION, 0), request.get(config.EPOCH))
+        send_frame(sock, json.dumps({config.EPOCH: self.DHT.epoch, config.VERSION: version,
+                                     config.DIGEST: self.DHT.digest(), config.ENTRIES: entries,
+                                     config.REMOVED: removed}))
 
     def add_DHT(self, other_DHT):
+        for node_id, info in other_DHT.items():
+            self.routingTable.add(make_contact(node_id, info[config.HOST], info[config.PORT]))
         return self.DHT.add_DHT(other_DHT)
 
     def add_node_to_DHT(self, port, node_id, host):
+        self.departed.pop(node_id, None)
+        self.routingTable.add(make_contact(node_id, host, port))
         return self.DHT.add_node(port, node_id, host)
 
     def construct_vector(self, i, n):
@@ -1,12 +1,41 @@
+import json
 import os
 import pickle
+import secrets
+import struct
+
 from phe import PaillierPublicKey
 import socket
 import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import config
+from routing import RoutingTable, contact_from_dict, contact_to_dict, make_contact
 from spacePIR import SpacePIR
+from transfer import (ACK, CHUNK_RANGE, TRANSFER_HEADER, PartialTransfers, SegmentReceiver, pack_chunks, pack_sizes,
+                      receive_segments, recv_frame, send_frame, send_segments, transfer_id)
+
+STATUS_RECORD = struct.Struct('!IH?')  # free capacity, upload queue depth, upload allowed
+
+
+def pack_status(status):
+    """
+    Encode a status record into its compact binary form.
+    """
+    return STATUS_RECORD.pack(min(status[config.FREE_CAPACITY], 0xFFFFFFFF),
+                              min(status[config.QUEUE_DEPTH], 0xFFFF), status[config.UPLOAD_ALLOWED])
+
+
+def unpack_status(data):
+    """
+    Decode a status record built by `pack_status`.
+    """
+    free_capacity, queue_depth, upload_allowed = STATUS_RECORD.unpack(data)
+    return {config.FREE_CAPACITY: free_capacity, config.QUEUE_DEPTH: queue_depth,
+            config.UPLOAD_ALLOWED: upload_allowed}
+
+
 def delete_file(file_path):
     """
     Delete the file at the given path.
@@ -32,6 +61,12 @@ class Peer:
         self._listener_thread = None
         self.spacePIR = SpacePIR()
         self._upload_lock = threading.Lock()  # Specific lock for SpacePIR uploads to prevent concurrent uploads
+        self._partial_uploads = PartialTransfers()  # unfinished segmented uploads, by transfer id
+        self._pending_responses = PartialTransfers()  # PIR responses kept for resuming downloads, by token
+        self._active_uploads = 0  # uploads currently being received, advertised as the queue depth
+        self._status_lock = threading.Lock()
+        self.contact = make_contact(peer_id, host, port)
+        self.routingTable = RoutingTable(self.contact.key)  # Kademlia contacts, by XOR distance
 
 
 
@@ -199,10 +234,31 @@ class Peer:
             message_type = sock.recv(1024).strip()
             if message_type == config.REQUEST_UPLOAD or message_type == "request_upload":
                 print("Upload has been requested from node ",str(self.peer_id),"by port ",str(sock.getpeername()[1]))
-                self.handle_upload_request(sock)
+                with self._upload_slot():
+                    self.handle_upload_request(sock)
             elif message_type == config.REQUEST_FILE:
                 print("download has been requested from node ",str(self.peer_id),"by port ",str(sock.getpeername()[1]))
                 self.handle_get_request(sock)
+            elif message_type == config.REQUEST_UPLOAD_SEGMENTED:
+                with self._upload_slot():
+                    self.handle_segmented_upload_request(sock)
+            elif message_type == config.REQUEST_UPLOAD_BATCH:
+                with self._upload_slot():
+                    self.handle_batch_upload_request(sock)
+            elif message_type == config.REQUEST_FILE_SEGMENTED:
+                self.handle_segmented_get_request(sock)
+            elif message_type == config.REQUEST_FILE_RANGE:
+                self.handle_segmented_get_request(sock, ranged=True)
+            elif message_type == config.REQUEST_RESUME_DOWNLOAD:
+                self.handle_resume_download_request(sock)
+            elif message_type == config.REQUEST_PING:
+                send_frame(sock, config.PONG)
+            elif message_type == config.REQUEST_STATUS:
+                send_frame(sock, pack_status(self.get_status()))
+            elif message_type == config.REQUEST_FIND_NODE:
+                self.handle_find_node_request(sock)
+            elif message_type == config.REQUEST_SYNC:
+                self.handle_sync_request(sock)
             elif message_type == "":
                 print(f"Error in handle_peer: for some reason is empty ")
             else:
@@ -216,6 +272,29 @@ class Peer:
             if sock.fileno() != -1:  # Check if socket is still open
                 sock.close()
 
+    @contextmanager
+    def _upload_slot(self):
+        """
+        Count an upload in the advertised queue depth while it is being received.
+        """
+        with self._status_lock:
+            self._active_uploads += 1
+        try:
+            yield
+        finally:
+            with self._status_lock:
+                self._active_uploads -= 1
+
+    def get_status(self):
+        """
+        Return the status record this peer advertises: free capacity, upload queue depth and whether
+        uploads are allowed.
+        """
+        with self._status_lock:
+            queue_depth = self._active_uploads
+        return {config.FREE_CAPACITY: self.spacePIR.free_capacity(), config.QUEUE_DEPTH: queue_depth,
+                config.UPLOAD_ALLOWED: self.spacePIR.is_upload_allowed()}
+
     def handle_upload_request(self, sock):
         print("handle upload request debug")  # This prints, so we know we reach here
 
@@ -245,6 +324,124 @@ class Peer:
             else:
                 print("npooooooooo sdebug")  # This should print if upload is denied
                 self.send_message(config.UPLOAD_DENIED, sock)
+    def handle_segmented_upload_request(self, sock):
+        """
+        Handle an upload sent as checksummed segments. The upload is keyed by the digest of its content,
+        so a sender that reconnects after a drop resumes from the last offset we acknowledged.
+        """
+        if not self.spacePIR.is_upload_allowed():
+            send_frame(sock, config.UPLOAD_DENIED)
+            return
+        sock.settimeout(config.TRANSFER_TIMEOUT)  # a silent sender must not hold its partial upload forever
+        send_frame(sock, config.UPLOAD_APPROVED)
+        self._receive_upload(sock, recv_frame(sock))
+
+    def handle_batch_upload_request(self, sock):
+        """
+        Handle several uploads sent one after the other over one connection, each as in a segmented
+        upload, until the sender ends the batch.
+        """
+        if not self.spacePIR.is_upload_allowed():
+            send_frame(sock, config.UPLOAD_DENIED)
+            return
+        sock.settimeout(config.TRANSFER_TIMEOUT)
+        send_frame(sock, config.UPLOAD_APPROVED)
+        while True:
+            header = recv_frame(sock)
+            if header == config.BATCH_END:
+                return
+            self._receive_upload(sock, header)
+
+    def _receive_upload(self, sock, header):
+        """
+        Receive one segmented upload announced by `header` (its size and digest), store it and send the
+        result.
+        """
+        total_size, _ = TRANSFER_HEADER.unpack(header[:TRANSFER_HEADER.size])
+        key = header[TRANSFER_HEADER.size:].decode('utf-8')
+        # Take the partial upload out of the store, so no other connection appends to it while we do. A
+        # sender reconnecting while a stale connection still holds it starts over from the beginning.
+        receiver = self._partial_uploads.pop(key)
+        if receiver is None or receiver.total_size != total_size:
+            receiver = SegmentReceiver(total_size)
+        send_frame(sock, ACK.pack(receiver.offset))
+        try:
+            receive_segments(sock, receiver)
+        except Exception:
+            self._partial_uploads.put(key, receiver)  # on a drop, keep it for the sender to resume
+            raise
+
+        data = receiver.get_data()
+        if transfer_id(data) != key:
+            print(f"upload {key} does not match its digest")
+            send_frame(sock, config.UPLOADED_FAILED)
+            return
+        try:
+            with self._upload_lock:
+                success = self.spacePIR.add(data)
+        except ValueError as e:
+            print(f"Error uploading file: {e}")
+            success = False
+        send_frame(sock, config.UPLOADED_SUCCESS if success else config.UPLOADED_FAILED)
+
+    def handle_segmented_get_request(self, sock, ranged=False):
+        """
+        Handle a PIR request whose response is sent as checksummed segments. The response is kept under a
+        random token until it was fully acknowledged, so the client can resume it after a drop.
+
+        Args:
+            sock: Connection to the client.
+            ranged (bool): The client asks for a range of chunks only, sent before its query vector.
+        """
+        sock.settimeout(config.TRANSFER_TIMEOUT)
+        send_frame(sock, '\n'.join(self.spacePIR.get_file_names()))
+        send_frame(sock, pack_sizes(self.spacePIR.get_file_sizes()))  # lets the client strip the PIR padding
+        first, count = CHUNK_RANGE.unpack(recv_frame(sock)) if ranged else (0, None)
+        vector, public_key = self.construct_list_from_bytes(recv_frame(sock))
+        response = pack_chunks(self.spacePIR.get(vector, public_key, first, count))
+        token = secrets.token_bytes(config.TOKEN_SIZE)
+        self._pending_responses.put(token, response)
+        send_frame(sock, token + TRANSFER_HEADER.pack(len(response), config.SEGMENT_SIZE))
+        self._send_response(sock, token, response)
+
+    def handle_find_node_request(self, sock):
+        """
+        Answer a Kademlia FIND_NODE: send the contacts we know closest to the target key. The sender is
+        added to our routing table, so the network learns about nodes as they look others up.
+        """
+        send_frame(sock, config.TRANSFER_READY)
+        request = json.loads(recv_frame(sock))
+        if request.get(config.SENDER) is not None:
+            self.routingTable.add(contact_from_dict(request[config.SENDER]))
+        closest = self.routingTable.closest(int(request[config.TARGET], 16), config.K_BUCKET_SIZE)
+        send_frame(sock, json.dumps([contact_to_dict(contact) for contact in closest]))
+
+    def handle_sync_request(self, sock):
+        """
+        Answer a DHT sync. A bare peer keeps no DHT; `Node` answers with its entries.
+        """
+        raise ValueError(f"Peer {self.peer_id} keeps no DHT to sync")
+
+    def handle_resume_download_request(self, sock):
+        """
+        Handle a client resuming a segmented PIR response from the last offset it acknowledged.
+        """
+        sock.settimeout(config.TRANSFER_TIMEOUT)
+        send_frame(sock, config.TRANSFER_READY)
+        token = recv_frame(sock)
+        response = self._pending_responses.get(token)
+        if response is None:
+            send_frame(sock, config.RESPONSE_EXPIRED)
+            return
+        send_frame(sock, TRANSFER_HEADER.pack(len(response), config.SEGMENT_SIZE))
+        self._send_response(sock, token, response)
+
+    def _send_response(self, sock, token, response):
+        offset = ACK.unpack(recv_frame(sock))[0]
+        if send_segments(sock, response, offset) >= len(response):
+            self._pending_responses.pop(token)
+            print(f'response for download has been sent from node {self.peer_id}')
+
     def construct_list_from_string(self, list_bin):
         """
         Converts a byte stream representing a list of file names (separated by newlines) into a Python list.
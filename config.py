@@ -16,3 +16,94 @@ FILE_NAME_SIZE = 256
 SUBFILE_SIZE = 1024*1024
 KEY_SIZE = 786
 PAILIER_KEY_SIZE = 3072
+REQUEST_UPLOAD_SEGMENTED = b"request_upload_segmented"
+REQUEST_FILE_SEGMENTED = b"request_file_segmented"
+REQUEST_RESUME_DOWNLOAD = b"request_resume_download"
+RESPONSE_EXPIRED = b"RESPONSE_EXPIRED"
+TRANSFER_READY = b"transfer_ready"
+SEGMENT_SIZE = 64*1024
+TRANSFER_WINDOW = 8
+MAX_FRAME_SIZE = 16*1024*1024
+MAX_PARTIAL_TRANSFERS = 32
+TRANSFER_TIMEOUT = 10
+TOKEN_SIZE = 16
+REQUEST_PING = b"request_ping"
+PONG = b"pong"
+RTT = 'rtt'
+THROUGHPUT = 'throughput'
+FAILURE_RATE = 'failure_rate'
+DEFAULT_RTT = 0.05
+DEFAULT_THROUGHPUT = 10*1024*1024
+PING_TIMEOUT = 2
+REQUEST_STATUS = b"request_status"
+FREE_CAPACITY = 'free_capacity'
+QUEUE_DEPTH = 'queue_depth'
+UPLOAD_ALLOWED = 'upload_allowed'
+STATUS_TTL = 30
+STRIPE_SIZE = 64*1024
+FILE_SIZE = 'file_size'
+N = 'n'
+K = 'k'
+BLOCK_SIZE = 'block_size'
+STRIPE = 'stripe_size'
+SHARES_PER_PEER = 'shares_per_peer'
+MAX_SHARES = 256
+MAX_BLOCK_SIZE = SUBFILE_SIZE - FILE_NAME_SIZE
+TARGET_DURABILITY = 0.9999
+PEER_AVAILABILITY = 0.9
+MAX_EXPANSION = 3
+MAX_SHARES_PER_PEER = 1
+STRIPE_MEMORY = 16*1024*1024
+ENCODED_SIZE = 'encoded_size'
+COMPRESSION = 'compression'
+ZLIB = 'zlib'
+LZMA = 'lzma'
+DEFAULT_COMPRESSION = None
+COMPRESSION_LEVEL = 6
+COMPRESSION_SAMPLE = 256*1024
+COMPRESSION_MAX_RATIO = 0.9
+SPOOL_MEMORY = 64*1024*1024
+MANIFEST_KEY = b"share manifest"
+FILE_NAME = 'file_name'
+FILE_HASH = 'file_hash'
+SHARE_HASHES = 'share_hashes'
+SIGNATURE = 'signature'
+UPLOADED_FILES = 'uploaded_files'
+FILE_PARAMS = 'file_params'
+MANIFESTS = 'manifests'
+PACKED_FILES = 'packed_files'
+REQUEST_FIND_NODE = b"request_find_node"
+PEER_ID = 'peer_id'
+TARGET = 'target'
+SENDER = 'sender'
+ID_BITS = 160
+K_BUCKET_SIZE = 20
+ALPHA = 3
+BUCKET_REFRESH = 3600
+MAINTENANCE_INTERVAL = 60
+PLACEMENT_KEY = b"share placement"
+PLACEMENT_PROBES = 3
+SHARE_LOCATIONS = 'share_locations'
+REQUEST_SYNC = b"request_sync"
+EPOCH = 'epoch'
+VERSION = 'version'
+DIGEST = 'digest'
+ENTRIES = 'entries'
+REMOVED = 'removed'
+SYNC_FANOUT = 2
+HEARTBEAT_INTERVAL = 60
+SUSPECT_FAILURES = 2
+DEAD_TIMEOUT = 600
+READMIT_PROBES = 3
+REPAIR_INTERVAL = 600
+REPAIR_BANDWIDTH = 1024 * 1024  # bytes a second of repair traffic
+REPAIR_FILES_PER_CYCLE = 4
+REPAIR_THRESHOLD = 0.5  # fraction of the parity shares that must stay live
+REPAIR_BACKOFF = 5
+SNAPSHOT_FILE = 'node.snapshot'
+SNAPSHOT_CHECKPOINTS = 16  # checkpoints written after a base snapshot before a new base
+REQUEST_UPLOAD_BATCH = b"request_upload_batch"
+BATCH_END = b"batch_end"
+REQUEST_FILE_RANGE = b"request_file_range"
+PIECE_SIZE = 'piece_size'
+PIECE_HASHES = 'piece_hashes'
@@ -1,8 +1,24 @@
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
+from types import MappingProxyType
 
 import config
 
 
+def entry_hash(node_id, port, host):
+    """
+    Hash of one DHT entry. The digest of a table is the XOR of the hashes of its entries, so it does not
+    depend on the order entries arrived in and is updated in O(1) per change.
+    """
+    message = json.dumps([node_id, port, host]).encode('utf-8')
+    return int.from_bytes(hashlib.sha256(message).digest(), byteorder='big')
+
+
 class DHT:
     def __init__(self):
         """
@@ -25,7 +41,17 @@ class DHT:
         # else:
         #     self.loop.run_until_complete(self.server.listen(port))  # Block and start listening on the port
 
-        self._dht = {}  # Dictionary to keep track of local node information
+        # Dictionary to keep track of local node information. It is never modified once published: writers
+        # build the next version and swap it in, so readers share it without copies or locks.
+        self._dht = {}
+        self._view = MappingProxyType(self._dht)
+        self._stamps = {}  # node id -> time of the last change to its entry, removals included
+        self._changes = OrderedDict()  # node id -> local version of its last change, oldest change first
+        self._removed = set()  # node ids whose last change is a removal
+        self.version = 0  # local version, incremented on every change
+        self.epoch = secrets.token_hex(8)  # versions are only comparable within an epoch
+        self._digest = 0
+        self._lock = threading.Lock()
 
     async def get_and_add_node(self, port, node_id, host):
         """
@@ -54,19 +80,129 @@ class DHT:
         :param host: The host/IP address of the new node.
         :return: True if added successfully, False if node already exists.
         """
-        if node_id not in self._dht:
-            self._dht[node_id] = {config.PORT: port, config.HOST: host}
+        with self._lock:
+            if node_id in self._dht:
+                return False  # Node already exists
+            table = dict(self._dht)
+            self._apply(table, node_id, {config.PORT: port, config.HOST: host}, time.time())
+            self._publish(table)
+            return True
+
+    def remove_node(self, node_id):
+        """
+        Remove a node from the DHT, remembering the removal so it reaches the nodes syncing with us.
+
+        Returns:
+            bool: True if the node was in the DHT.
+        """
+        with self._lock:
+            if node_id not in self._dht:
+                return False
+            table = dict(self._dht)
+            self._apply(table, node_id, None, time.time())
+            self._publish(table)
             return True
-        return False  # Node already exists
+
+    def _apply(self, table, node_id, info, stamp):
+        """
+        Record a change to an entry in `table`, the next version of the DHT being built: `info` is the new
+        node information, or None for a removal. The lock must be held.
+        """
+        old = table.pop(node_id, None)
+        if old is not None:
+            self._digest ^= entry_hash(node_id, old[config.PORT], old[config.HOST])
+        if info is None:
+            self._removed.add(node_id)
+        else:
+            table[node_id] = info
+            self._removed.discard(node_id)
+            self._digest ^= entry_hash(node_id, info[config.PORT], info[config.HOST])
+        self._stamps[node_id] = stamp
+        self.version += 1
+        self._changes.pop(node_id, None)
+        self._changes[node_id] = self.version
+
+    def _publish(self, table):
+        """
+        Make `table` the current version of the DHT. Readers holding the previous one keep a consistent,
+        unchanging view of it. The lock must be held.
+        """
+        self._dht = table
+        self._view = MappingProxyType(table)
+
+    def digest(self):
+        """
+        Summary of the entries of the DHT: two DHTs with the same entries have the same digest.
+        """
+        return format(self._digest, '064x')
+
+    def changes_since(self, version, epoch=None):
+        """
+        The entries changed after local version `version`, walking the change log from the newest change,
+        so the cost follows the churn since then rather than the size of the DHT. A version from another
+        epoch means nothing here, and every entry is returned.
+
+        Returns:
+            Tuple[List, List]: [node id, port, host, stamp] of the changed entries, and [node id, stamp] of
+            the removed ones.
+        """
+        if epoch is not None and epoch != self.epoch:
+            version = 0
+        entries, removed = [], []
+        with self._lock:
+            for node_id in reversed(self._changes):
+                if self._changes[node_id] <= version:
+                    break
+                if node_id in self._removed:
+                    removed.append([node_id, self._stamps[node_id]])
+                else:
+                    info = self._dht[node_id]
+                    entries.append([node_id, info[config.PORT], info[config.HOST], self._stamps[node_id]])
+        return entries, removed
+
+    def merge(self, entries, removed):
+        """
+        Apply changes received from another node. An entry or removal only replaces what we know when it
+        is newer, so stale changes cannot bring back a node that left.
+
+        Returns:
+            List: Node ids of the entries added or updated.
+        """
+        changed = []
+        with self._lock:
+            table = dict(self._dht)  # one copy for the whole batch
+            for node_id, port, host, stamp in entries:
+                if stamp > self._stamps.get(node_id, -1):
+                    self._apply(table, node_id, {config.PORT: port, config.HOST: host}, stamp)
+                    changed.append(node_id)
+            for node_id, stamp in removed:
+                if stamp > self._stamps.get(node_id, -1):
+                    self._apply(table, node_id, None, stamp)
+            self._publish(table)
+        return changed
 
     def get_dht(self):
         """
-        Return a copy of the current DHT, ensuring that the original DHT remains immutable.
+        Return the current DHT, in O(1). It is a read-only view of a version no writer modifies, so it stays
+        consistent while the caller uses it, however the DHT changes meanwhile. The node information
+        dictionaries are shared too and must not be modified.
 
         Returns:
-            dict: A copy of the current DHT.
+            Mapping: node id -> node information.
+        """
+        return self._view
+
+    def nodes(self):
+        """
+        Iterate over the (node id, node information) pairs of the current DHT without copying it.
         """
-        return self._dht.copy()  # Return a shallow copy of the DHT to prevent external modifications
+        return iter(self._view.items())
+
+    def __len__(self):
+        return len(self._view)
+
+    def __contains__(self, node_id):
+        return node_id in self._view
 
     async def get_node_data(self, node_id):
         """
@@ -79,18 +215,23 @@ class DHT:
             dict: The node data, or None if the node does not exist.
         """
         # serialized_data = await self.server.get(node_id)  # Retrieve the serialized node data from Kademlia
-        return self._dht[node_id]
+        return self._view[node_id]
 
     def add_DHT(self, other_dht):
         """
         Add all nodes from another DHT instance to this DHT. This is useful for merging DHTs
         from multiple sources without overwriting existing nodes in the current DHT.
         """
-        for node_id, node_data in other_dht.items():
-            if node_id not in self._dht:
-                self._dht[node_id] = node_data  # Add the node if it doesn't already exist in the current DHT
-            else:  # todo if we have more time we will override by signature of the node (public key) and timestamp.
-                print(f"Node with ID {node_id} already in dht")
+        with self._lock:
+            table = dict(self._dht)
+            stamp = time.time()
+            for node_id, node_data in other_dht.items():
+                if node_id not in table:  # Add the node if it doesn't already exist in the current DHT
+                    info = {config.PORT: node_data[config.PORT], config.HOST: node_data[config.HOST]}
+                    self._apply(table, node_id, info, stamp)
+                else:
+                    print(f"Node with ID {node_id} already in dht")
+            self._publish(table)
 
     async def _remove_node(self, node_id):
         """
@@ -100,9 +241,8 @@ class DHT:
         Args:
             node_id (str): The unique identifier of the node to be removed.
         """
-        if node_id in self._dht:
-            del self._dht[node_id]  # Remove the node from the local DHT
-            # await self.server.set(node_id, None)  # Remove the node from the Kademlia DHT
+        self.remove_node(node_id)  # Remove the node from the local DHT
+        # await self.server.set(node_id, None)  # Remove the node from the Kademlia DHT
 
     # def shutdown(self):
     #     """
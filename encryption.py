@@ -1,13 +1,18 @@
 import os
-import pickle
+import struct
 
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import Cipher, modes, algorithms
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from phe import paillier
 import base64
 
+KEY_MAGIC = b"PAILKEY\0"
+KEY_FORMAT = 1
+KEY_HEADER = struct.Struct('!8sHII')  # magic, format version, bytes of p, bytes of q
+
 import config
 
 
@@ -64,6 +69,20 @@ class Encryption:
         # return decrypted_data
 
 
+    @staticmethod
+    def derive_key(private_key, purpose):
+        """
+        Derive a 32-byte symmetric key from the Paillier private key, so secrets such as the manifest
+        signing key need no storage of their own.
+
+        :param private_key: Paillier private key.
+        :param purpose: Bytes naming what the key is for; different purposes give unrelated keys.
+        :return: The derived key.
+        """
+        secret = b"".join(prime.to_bytes((prime.bit_length() + 7) // 8, byteorder='big')
+                          for prime in (private_key.p, private_key.q))
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=purpose).derive(secret)
+
     # Store Paillier Private Key with Password-Based Encryption
     @staticmethod
     def store(password, private_key, path=""):
@@ -79,8 +98,7 @@ class Encryption:
         kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=100000)
         aes_key = kdf.derive(password.encode())
 
-        # Serialize the Paillier private key with pickle
-        private_key_bytes = pickle.dumps(private_key)
+        private_key_bytes = Encryption.key_to_bytes(private_key)
 
         # Encrypt the serialized private key with AES in GCM mode
         iv = os.urandom(12)  # GCM requires a 12-byte nonce
@@ -116,6 +134,31 @@ class Encryption:
         decryptor = Cipher(algorithms.AES(aes_key), modes.GCM(iv, tag), backend=default_backend()).decryptor()
         private_key_bytes = decryptor.update(encrypted_key) + decryptor.finalize()
 
-        # Deserialize the Paillier private key
-        private_key = pickle.loads(private_key_bytes)
-        return private_key
\ No newline at end of file
+        return Encryption.key_from_bytes(private_key_bytes)
+
+    @staticmethod
+    def key_to_bytes(private_key):
+        """
+        Binary encoding of a Paillier private key: a versioned header and its two primes, big-endian. The
+        public key is their product.
+        """
+        p, q = (prime.to_bytes((prime.bit_length() + 7) // 8, byteorder='big')
+                for prime in (private_key.p, private_key.q))
+        return KEY_HEADER.pack(KEY_MAGIC, KEY_FORMAT, len(p), len(q)) + p + q
+
+    @staticmethod
+    def key_from_bytes(data):
+        """
+        Reverse `key_to_bytes`.
+
+        :raises ValueError: If the data is not a key in a format this version reads.
+        """
+        try:
+            magic, version, p_size, q_size = KEY_HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError("the stored private key is truncated")
+        if magic != KEY_MAGIC or version != KEY_FORMAT:
+            raise ValueError("the stored private key is not in a format this node reads; store it again")
+        p = int.from_bytes(data[KEY_HEADER.size:KEY_HEADER.size + p_size], byteorder='big')
+        q = int.from_bytes(data[KEY_HEADER.size + p_size:KEY_HEADER.size + p_size + q_size], byteorder='big')
+        return paillier.PaillierPrivateKey(paillier.PaillierPublicKey(p * q), p, q)
\ No newline at end of file
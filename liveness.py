@@ -0,0 +1,71 @@
+import threading
+import time
+
+import config
+
+
+class FailureDetector:
+    """
+    Decide which peers are alive from what we hear of them. Every successful exchange with a peer counts
+    as a heartbeat, so busy peers are never pinged; quiet ones are pinged once they have not been heard
+    from for `heartbeat_interval` seconds. A peer failing `suspect_failures` times in a row is suspected,
+    and uploads and downloads skip it without waiting on its socket. A peer suspected for `dead_timeout`
+    seconds is dead. Any answer clears a suspicion. Peers are keyed by their (host, port) address.
+    """
+
+    def __init__(self, heartbeat_interval=config.HEARTBEAT_INTERVAL, suspect_failures=config.SUSPECT_FAILURES,
+                 dead_timeout=config.DEAD_TIMEOUT):
+        self.heartbeat_interval = heartbeat_interval
+        self.suspect_failures = suspect_failures
+        self.dead_timeout = dead_timeout
+        self._peers = {}  # address -> [time last heard, failures in a row, time suspected or None]
+        self._lock = threading.Lock()
+
+    def heard(self, address):
+        """
+        Record that a peer answered.
+
+        Returns:
+            bool: True if the peer was suspected.
+        """
+        with self._lock:
+            entry = self._peers.setdefault(address, [None, 0, None])
+            was_suspected = entry[2] is not None
+            entry[:] = [time.monotonic(), 0, None]
+            return was_suspected
+
+    def missed(self, address):
+        """
+        Record that a peer did not answer.
+        """
+        with self._lock:
+            entry = self._peers.setdefault(address, [None, 0, None])
+            entry[1] += 1
+            if entry[1] >= self.suspect_failures and entry[2] is None:
+                entry[2] = time.monotonic()
+
+    def is_suspected(self, address):
+        with self._lock:
+            entry = self._peers.get(address)
+            return entry is not None and entry[2] is not None
+
+    def needs_heartbeat(self, address):
+        """
+        True if we did not hear from the peer for `heartbeat_interval` seconds, or it is suspected.
+        """
+        with self._lock:
+            entry = self._peers.get(address)
+            return entry is None or entry[2] is not None or entry[0] is None \
+                or time.monotonic() - entry[0] >= self.heartbeat_interval
+
+    def is_dead(self, address):
+        """
+        True if the peer has been suspected for `dead_timeout` seconds.
+        """
+        with self._lock:
+            entry = self._peers.get(address)
+            return entry is not None and entry[2] is not None and time.monotonic() - entry[2] >= self.dead_timeout
+
+    def forget(self, address):
+        with self._lock:
+            self._peers.pop(address, None)
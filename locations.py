@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import namedtuple
+
+ShareLocation = namedtuple('ShareLocation', ['share_index', 'peer_id', 'host', 'port', 'upload_time'])
+
+
+class ShareLocations:
+    """
+    Where the shares of our uploads went: file name -> the share index, peer id, address and upload time
+    of every share a peer accepted. A download goes straight to these peers, asking each for the share
+    it holds.
+    """
+
+    def __init__(self):
+        self._locations = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, share_index, peer_id, host, port, upload_time=None):
+        location = ShareLocation(share_index, peer_id, host, port,
+                                 time.time() if upload_time is None else upload_time)
+        with self._lock:
+            self._locations.setdefault(name, []).append(location)
+
+    def get(self, name):
+        """
+        Return the locations of the shares of a file, data shares first.
+        """
+        with self._lock:
+            return sorted(self._locations.get(name, []))
+
+    def remove(self, name, share_index=None, peer_id=None):
+        """
+        Forget the locations of a file, or only those matching a share index and/or a peer id.
+        """
+        with self._lock:
+            kept = [location for location in self._locations.get(name, [])
+                    if (share_index is not None and location.share_index != share_index)
+                    or (peer_id is not None and location.peer_id != peer_id)]
+            if kept:
+                self._locations[name] = kept
+            else:
+                self._locations.pop(name, None)
+
+    def files(self):
+        with self._lock:
+            return list(self._locations)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: [list(location) for location in locations] for name, locations in self._locations.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        locations = cls()
+        for name, entries in data.items():
+            for entry in entries:
+                locations.add(name, *entry)
+        return locations
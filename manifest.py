@@ -0,0 +1,122 @@
+import hashlib
+import hmac
+import json
+
+import config
+
+
+class ShareManifest:
+    """
+    Digests of every share of an uploaded file and of the whole file, signed with a key only the
+    uploading node has. A downloader checks each share against it as soon as the share arrives, so a
+    corrupted or truncated share is dropped before decoding instead of producing a garbage file.
+
+    Shares may also be digested piece by piece, so a range read checks the pieces it fetched without
+    fetching whole shares.
+    """
+
+    def __init__(self, file_name, file_hash, share_hashes, signature=None, piece_size=None, piece_hashes=None):
+        self.file_name = file_name
+        self.file_hash = file_hash
+        self.share_hashes = share_hashes  # share index -> hex digest of the share content
+        self.signature = signature
+        self.piece_size = piece_size
+        self.piece_hashes = piece_hashes  # share index -> hex digests of its pieces of `piece_size` bytes
+
+    @staticmethod
+    def hash_stream(stream, skip_header=False):
+        """
+        Hex digest of a binary file object from its start, optionally skipping the `name,` header a share
+        carries while it is uploaded.
+        """
+        stream.seek(0)
+        if skip_header:
+            header = stream.read(config.FILE_NAME_SIZE + 1)
+            stream.seek(header.index(b",") + 1)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: stream.read(config.STRIPE_SIZE), b""):
+            digest.update(chunk)
+        stream.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_pieces(stream, piece_size):
+        """
+        Hex digests of the pieces of `piece_size` bytes of a share, skipping its `name,` header.
+        """
+        stream.seek(0)
+        header = stream.read(config.FILE_NAME_SIZE + 1)
+        stream.seek(header.index(b",") + 1)
+        digests = [hashlib.sha256(piece).hexdigest() for piece in iter(lambda: stream.read(piece_size), b"")]
+        stream.seek(0)
+        return digests
+
+    @classmethod
+    def build(cls, file_name, file_path, parts, key, piece_size=None):
+        """
+        Build and sign the manifest of a file.
+
+        Args:
+            file_name (str): Name the file is downloaded by.
+            file_path (str): Path of the original file, for the whole-file digest.
+            parts (List): The encoded shares as binary file objects, in share order, with their headers.
+            key (bytes): Signing key.
+            piece_size (int): Also digest the shares piece by piece, for range reads.
+        """
+        with open(file_path, 'rb') as f:
+            file_hash = cls.hash_stream(f)
+        share_hashes = {index: cls.hash_stream(part, skip_header=True) for index, part in enumerate(parts)}
+        piece_hashes = None
+        if piece_size is not None:
+            piece_hashes = {index: cls.hash_pieces(part, piece_size) for index, part in enumerate(parts)}
+        manifest = cls(file_name, file_hash, share_hashes, piece_size=piece_size, piece_hashes=piece_hashes)
+        manifest.signature = manifest._sign(key)
+        return manifest
+
+    def _payload(self):
+        payload = [self.file_name, self.file_hash, sorted(self.share_hashes.items())]
+        if self.piece_hashes is not None:
+            payload += [self.piece_size, sorted(self.piece_hashes.items())]
+        return json.dumps(payload).encode()
+
+    def _sign(self, key):
+        return hmac.new(key, self._payload(), hashlib.sha256).hexdigest()
+
+    def verify_signature(self, key):
+        return self.signature is not None and hmac.compare_digest(self.signature, self._sign(key))
+
+    def verify_share(self, index, part):
+        """
+        Check a downloaded share (a binary file object without header) against its digest.
+        """
+        expected = self.share_hashes.get(index)
+        return expected is not None and hmac.compare_digest(expected, self.hash_stream(part))
+
+    def verify_piece(self, index, part, piece):
+        """
+        Check piece `piece` of a downloaded share (a binary file object holding the piece) against its digest.
+        """
+        digests = (self.piece_hashes or {}).get(index, [])
+        return piece < len(digests) and hmac.compare_digest(digests[piece], self.hash_stream(part))
+
+    def verify_file(self, file_path):
+        with open(file_path, 'rb') as f:
+            return hmac.compare_digest(self.file_hash, self.hash_stream(f))
+
+    def to_dict(self):
+        data = {config.FILE_NAME: self.file_name, config.FILE_HASH: self.file_hash,
+                config.SHARE_HASHES: {str(index): digest for index, digest in self.share_hashes.items()},
+                config.SIGNATURE: self.signature}
+        if self.piece_hashes is not None:
+            data[config.PIECE_SIZE] = self.piece_size
+            data[config.PIECE_HASHES] = {str(index): digests for index, digests in self.piece_hashes.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        piece_hashes = data.get(config.PIECE_HASHES)
+        if piece_hashes is not None:
+            piece_hashes = {int(index): digests for index, digests in piece_hashes.items()}
+        return cls(data[config.FILE_NAME], data[config.FILE_HASH],
+                   {int(index): digest for index, digest in data[config.SHARE_HASHES].items()},
+                   data[config.SIGNATURE], data.get(config.PIECE_SIZE), piece_hashes)
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import struct
+
+import config
+
+PACK_MAGIC = b"SP2PPACK"
+PACK_HEADER = struct.Struct('!8sBI')  # magic, format version, length of the index
+PACK_VERSION = 1
+
+
+class FilePacker:
+    """
+    Bundle many small files into a single container file, so they are erasure coded, uploaded and served
+    by PIR as one file instead of one padded subfile each.
+
+    A container is a header, a JSON index mapping every member name to its (offset, length) in the
+    container, and the members' contents one after the other.
+    """
+
+    def pack(self, file_paths, container_path):
+        """
+        Write the files into a container.
+
+        Args:
+            file_paths (List[str]): Paths of the files to bundle. Members are named by their base name.
+            container_path (str): Path of the container to write.
+
+        Returns:
+            dict: member name -> (offset, length) in the container.
+        """
+        names = [os.path.basename(file_path) for file_path in file_paths]
+        if len(set(names)) != len(names):
+            raise ValueError("files packed together must have distinct names")
+        sizes = [os.path.getsize(file_path) for file_path in file_paths]
+
+        # Offsets are written with a fixed width, so the index length is known before the offsets are
+        index = {name: (0, size) for name, size in zip(names, sizes)}
+        offset = PACK_HEADER.size + len(self._encode_index(index))
+        for name, size in zip(names, sizes):
+            index[name] = (offset, size)
+            offset += size
+        encoded = self._encode_index(index)
+
+        with open(container_path, 'wb') as container:
+            container.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(encoded)) + encoded)
+            for file_path in file_paths:
+                with open(file_path, 'rb') as f:
+                    shutil.copyfileobj(f, container, config.STRIPE_SIZE)
+        return index
+
+    @staticmethod
+    def _encode_index(index):
+        # fixed width offsets keep the index length independent of the offset values
+        return json.dumps({name: [f"{offset:016d}", size] for name, (offset, size) in index.items()}).encode()
+
+    @staticmethod
+    def parse_index(data):
+        """
+        Parse the index at the start of a container.
+
+        Args:
+            data (bytes): The first bytes of the container, at least up to the end of the index.
+
+        Returns:
+            dict: member name -> (offset, length) in the container.
+        """
+        magic, version, length = PACK_HEADER.unpack(data[:PACK_HEADER.size])
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError("not a packed container")
+        index = json.loads(data[PACK_HEADER.size:PACK_HEADER.size + length])
+        return {name: (int(offset), size) for name, (offset, size) in index.items()}
+
+    def read_index(self, container_path):
+        """
+        Read the index of a container file.
+        """
+        with open(container_path, 'rb') as container:
+            header = container.read(PACK_HEADER.size)
+            length = PACK_HEADER.unpack(header)[2]
+            return self.parse_index(header + container.read(length))
+
+    def extract(self, container_path, name, output_path):
+        """
+        Copy a single member out of a container.
+        """
+        index = self.read_index(container_path)
+        if name not in index:
+            raise ValueError(f"'{name}' is not in the container")
+        offset, size = index[name]
+        with open(container_path, 'rb') as container, open(output_path, 'wb') as output:
+            container.seek(offset)
+            while size > 0:
+                chunk = container.read(min(size, config.STRIPE_SIZE))
+                if not chunk:
+                    raise ValueError(f"container is truncated inside '{name}'")
+                output.write(chunk)
+                size -= len(chunk)
+        return True
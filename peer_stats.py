@@ -0,0 +1,80 @@
+import threading
+
+import config
+
+
+class PeerStats:
+    """
+    Keep per-peer estimates of round trip time, throughput and recent failure rate, as exponentially
+    weighted moving averages, and score peers by the time we expect a share transfer with them to take.
+    Peers are keyed by their (host, port) address.
+    """
+    ALPHA = 0.3  # weight of the newest observation in the moving averages
+    FAILURE_PENALTY = 10  # how many times slower a peer that always fails is considered
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, address):
+        if address not in self._stats:
+            self._stats[address] = {config.RTT: None, config.THROUGHPUT: None, config.FAILURE_RATE: 0.0}
+        return self._stats[address]
+
+    @staticmethod
+    def _average(old, new, alpha):
+        return new if old is None else (1 - alpha) * old + alpha * new
+
+    def record_rtt(self, address, rtt):
+        """
+        Record a round trip time measured by a ping or a protocol handshake.
+        """
+        with self._lock:
+            entry = self._entry(address)
+            entry[config.RTT] = self._average(entry[config.RTT], rtt, PeerStats.ALPHA)
+
+    def record_success(self, address, num_bytes, duration):
+        """
+        Record a completed transfer of `num_bytes` that took `duration` seconds.
+        """
+        with self._lock:
+            entry = self._entry(address)
+            if num_bytes > 0 and duration > 0:
+                entry[config.THROUGHPUT] = self._average(entry[config.THROUGHPUT], num_bytes / duration,
+                                                         PeerStats.ALPHA)
+            entry[config.FAILURE_RATE] = self._average(entry[config.FAILURE_RATE], 0.0, PeerStats.ALPHA)
+
+    def record_failure(self, address):
+        """
+        Record a failed connection or transfer.
+        """
+        with self._lock:
+            entry = self._entry(address)
+            entry[config.FAILURE_RATE] = self._average(entry[config.FAILURE_RATE], 1.0, PeerStats.ALPHA)
+
+    def get(self, address):
+        """
+        Return a copy of the statistics of a peer, or None if we never observed it.
+        """
+        with self._lock:
+            entry = self._stats.get(address)
+            return dict(entry) if entry is not None else None
+
+    def score(self, address, num_bytes=config.SUBFILE_SIZE):
+        """
+        Estimate the seconds a transfer of `num_bytes` with the peer takes, inflated by its failure rate.
+        Peers we know nothing about get the default estimates, so they are tried before known slow peers.
+        Lower is better.
+        """
+        with self._lock:
+            entry = self._stats.get(address, {})
+            rtt = entry.get(config.RTT) or config.DEFAULT_RTT
+            throughput = entry.get(config.THROUGHPUT) or config.DEFAULT_THROUGHPUT
+            failure_rate = entry.get(config.FAILURE_RATE, 0.0)
+        return (rtt + num_bytes / throughput) * (1 + PeerStats.FAILURE_PENALTY * failure_rate)
+
+    def rank(self, addresses, num_bytes=config.SUBFILE_SIZE):
+        """
+        Return the addresses sorted from the best scored peer to the worst.
+        """
+        return sorted(addresses, key=lambda address: self.score(address, num_bytes))
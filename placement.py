@@ -0,0 +1,55 @@
+import hashlib
+import hmac
+from collections import Counter
+
+
+class RendezvousPlacement:
+    """
+    Rendezvous (highest random weight) hashing of shares onto peers. Every peer gets a weight for share i
+    of a file from a keyed hash of (file, i, peer id), and the share goes to the heaviest peer. The
+    uploader and the downloader compute the same placement from the DHT membership alone, and when a peer
+    joins or leaves only the shares whose heaviest peer changed move. The key keeps the placement of our
+    files unpredictable to other nodes.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def weight(self, file_name, share_index, node_id):
+        message = f"{file_name}\0{share_index}\0{node_id}".encode('utf-8')
+        return int.from_bytes(hmac.new(self.key, message, hashlib.sha256).digest()[:8], byteorder='big')
+
+    def rank(self, file_name, share_index, node_ids):
+        """
+        Order the peers from the preferred holder of the share to the least preferred.
+        """
+        return sorted(node_ids, key=lambda node_id: self.weight(file_name, share_index, node_id), reverse=True)
+
+    def assign(self, file_name, n, node_ids, shares_per_peer=1):
+        """
+        Place the n shares of a file, in share order, each on the heaviest peer that holds fewer than
+        `shares_per_peer` shares of the file.
+
+        Returns:
+            List: The node id holding each share.
+        """
+        load = Counter()
+        assignment = []
+        for share_index in range(n):
+            ranked = self.rank(file_name, share_index, node_ids)
+            node_id = next((node_id for node_id in ranked if load[node_id] < shares_per_peer), ranked[0])
+            load[node_id] += 1
+            assignment.append(node_id)
+        return assignment
+
+    def preference(self, file_name, n, node_ids, shares_per_peer=1):
+        """
+        For every share, the peers to look for it on: its assigned peer first, then the others by weight,
+        where the share lands when the assigned peer refused it at upload time.
+
+        Returns:
+            List[List]: Node ids, per share.
+        """
+        assignment = self.assign(file_name, n, node_ids, shares_per_peer)
+        return [[node_id] + [other for other in self.rank(file_name, share_index, node_ids) if other != node_id]
+                for share_index, node_id in enumerate(assignment)]
@@ -0,0 +1,76 @@
+import math
+
+import config
+
+
+def durability(n, k, availability):
+    """
+    Probability that at least k of n independent shares are reachable, when each is reachable with
+    probability `availability`.
+    """
+    return sum(math.comb(n, i) * availability ** i * (1 - availability) ** (n - i) for i in range(k, n + 1))
+
+
+class RedundancyPolicy:
+    """
+    Choose the erasure coding parameters of an upload from the file size, the number of peers that can
+    take shares, the target durability and the bandwidth budget.
+
+    k is the smallest number of blocks the file fits in (every share costs a full PIR pass to fetch), and
+    n is the smallest number of shares reaching the target durability without uploading more than
+    `max_expansion` times the file. When there are fewer peers than shares, several shares may share a
+    peer, up to `max_shares_per_peer`; durability is then computed over peers rather than shares.
+    """
+
+    def __init__(self, target_durability=config.TARGET_DURABILITY, peer_availability=config.PEER_AVAILABILITY,
+                 max_expansion=config.MAX_EXPANSION, max_shares_per_peer=config.MAX_SHARES_PER_PEER,
+                 max_block_size=config.MAX_BLOCK_SIZE, stripe_memory=config.STRIPE_MEMORY):
+        self.target_durability = target_durability
+        self.peer_availability = peer_availability
+        self.max_expansion = max_expansion
+        self.max_shares_per_peer = max_shares_per_peer
+        self.max_block_size = max_block_size
+        self.stripe_memory = stripe_memory
+
+    def choose(self, file_size, num_peers):
+        """
+        Choose the parameters of an upload.
+
+        Args:
+            file_size (int): Size of the file to upload.
+            num_peers (int): Number of peers that can accept shares.
+
+        Returns:
+            dict: config.K, config.N, config.BLOCK_SIZE, config.STRIPE and config.SHARES_PER_PEER.
+
+        Raises:
+            ValueError: If the file needs more shares than zfec supports, or there are not enough peers to
+                hold even k shares.
+        """
+        k = max(math.ceil(file_size / self.max_block_size), 1)
+        if k > config.MAX_SHARES:
+            raise ValueError(f"file of {file_size} bytes needs {k} shares, more than {config.MAX_SHARES}")
+        if num_peers * self.max_shares_per_peer < k:
+            raise ValueError(config.DHT_SMALL)
+        block_size = max(math.ceil(file_size / k), 1)
+
+        max_n = min(math.floor(k * self.max_expansion), config.MAX_SHARES, num_peers * self.max_shares_per_peer)
+        n = max(k, 1)
+        while n < max_n and self.durability(n, k, num_peers) < self.target_durability:
+            n += 1
+        if self.durability(n, k, num_peers) < self.target_durability:
+            print(f"durability target {self.target_durability} not reachable, using n={n} for k={k}")
+
+        stripe_size = self.stripe_memory // (k + n)
+        stripe_size = max(stripe_size - stripe_size % config.BUFFER_SIZE, config.BUFFER_SIZE)
+        return {config.K: k, config.N: n, config.BLOCK_SIZE: block_size,
+                config.STRIPE: min(stripe_size, config.STRIPE_SIZE, block_size),
+                config.SHARES_PER_PEER: math.ceil(n / num_peers)}
+
+    def durability(self, n, k, num_peers):
+        """
+        Durability of n shares of which k are needed, spread over `num_peers` peers. Shares on the same peer
+        are lost together, so with s shares per peer we need ceil(k / s) of the ceil(n / s) peers.
+        """
+        shares_per_peer = math.ceil(n / num_peers)
+        return durability(math.ceil(n / shares_per_peer), math.ceil(k / shares_per_peer), self.peer_availability)
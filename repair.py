@@ -0,0 +1,204 @@
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+import config
+
+
+class TokenBucket:
+    """
+    Rate limit: `rate` tokens a second, at most `burst` saved up. `take` blocks until enough tokens are
+    available, or the stop event is set.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, amount, stop_event=None):
+        """
+        Returns:
+            bool: True once the tokens were taken, False if the stop event was set first.
+        """
+        amount = min(amount, self.burst)  # a request larger than the burst waits for a full bucket
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return True
+                wait = (amount - self._tokens) / self.rate
+            if stop_event is not None and stop_event.wait(wait):
+                return False
+            if stop_event is None:
+                time.sleep(wait)
+
+
+class RepairDaemon:
+    """
+    Keep our uploads durable: every `interval` seconds, check which shares of every uploaded file are
+    still on live peers, and when fewer than the threshold are, regenerate the lost shares from k
+    survivors and place them on other peers.
+
+    Checking is cheap: the holders recorded in the node's share locations are only pinged when the
+    failure detector has not heard from them lately. Repair traffic is limited to `bandwidth` bytes a
+    second and `max_repairs` files a cycle, and waits while the node is downloading for the user.
+    """
+
+    def __init__(self, node, interval=config.REPAIR_INTERVAL, bandwidth=config.REPAIR_BANDWIDTH,
+                 max_repairs=config.REPAIR_FILES_PER_CYCLE, threshold=config.REPAIR_THRESHOLD):
+        self.node = node
+        self.interval = interval
+        self.max_repairs = max_repairs
+        self.threshold = threshold
+        self.bucket = TokenBucket(bandwidth, max(bandwidth, config.SUBFILE_SIZE))
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error in share repair of node {self.node.peer_id}: {e}")
+
+    def run_once(self):
+        """
+        One repair cycle over our uploads.
+
+        Returns:
+            dict: file name -> number of shares regenerated, for the files repaired.
+        """
+        repaired = {}
+        for file_path, _, _ in list(self.node.uploaded_files):
+            if len(repaired) >= self.max_repairs or self._stop_event.is_set():
+                break
+            name = os.path.basename(file_path)
+            if self.needs_repair(name):
+                self._wait_for_foreground()
+                repaired[name] = self.repair(name)
+        return repaired
+
+    def minimum_shares(self, n, k):
+        """
+        Fewer live shares than this triggers a repair: k plus `threshold` of the parity shares.
+        """
+        return k + math.ceil(self.threshold * (n - k))
+
+    def live_shares(self, name):
+        """
+        Split the recorded shares of a file by whether their holder is alive. A holder the failure
+        detector heard from lately counts as alive; the others are pinged, once per peer.
+
+        Returns:
+            Tuple[set, set]: The indexes of the live shares and of the lost ones.
+        """
+        status = {}  # (host, port) -> alive
+        live, lost = set(), set()
+        for location in self.node.shareLocations.get(name):
+            address = (location.host, location.port)
+            if address not in status:
+                if location.peer_id in self.node.departed or self.node.liveness.is_suspected(address):
+                    status[address] = False
+                elif self.node.liveness.needs_heartbeat(address):
+                    status[address] = self.node.ping_peer(location.port, location.host) is not None
+                else:
+                    status[address] = True
+            (live if status[address] else lost).add(location.share_index)
+        return live, lost - live
+
+    def needs_repair(self, name):
+        params = self.node.file_params.get(name)
+        if params is None or not self.node.shareLocations.get(name):
+            return False  # uploaded before share locations were recorded, nothing to check against
+        live, _ = self.live_shares(name)
+        return len(live) < self.minimum_shares(params[config.N], params[config.K])
+
+    def repair(self, name):
+        """
+        Regenerate the lost shares of a file from k live ones and place them on live peers that do not
+        hold a share of it yet, in rendezvous order.
+
+        Returns:
+            int: The number of shares regenerated and placed.
+        """
+        params = self.node.file_params[name]
+        n, k, block_size = params[config.N], params[config.K], params[config.BLOCK_SIZE]
+        live, _ = self.live_shares(name)
+        lost = sorted(set(range(n)) - live)
+        if len(live) < k:
+            print(f"only {len(live)} shares of {name} are left, it cannot be repaired")
+            return 0
+        if not self.bucket.take(k * block_size, self._stop_event):
+            return 0
+        manifest = self.node.verified_manifest(name)
+        parts = self.node.fetch_shares(name, k, params, manifest, wanted=live)
+        try:
+            if len(parts) < k:
+                print(f"could not fetch {k} shares of {name} to repair it")
+                return 0
+            shares = self.node.fileHandler.rebuild_shares(list(parts.items()), n, k, lost, name, block_size,
+                                                          params.get(config.STRIPE, config.STRIPE_SIZE))
+        finally:
+            for part in parts.values():
+                part.close()
+        try:
+            return self.place(name, n, dict(zip(lost, shares)), params[config.SHARES_PER_PEER])
+        finally:
+            for share in shares:
+                share.close()
+
+    def place(self, name, n, shares, shares_per_peer):
+        """
+        Upload regenerated shares, each to the first live peer in its rendezvous preference order that
+        holds fewer than `shares_per_peer` shares of the file, and record their new locations.
+
+        Returns:
+            int: The number of shares placed.
+        """
+        dht = self.node.DHT.get_dht()
+        holders = {location.share_index: location.peer_id for location in self.node.shareLocations.get(name)}
+        live, _ = self.live_shares(name)
+        load = Counter(holders[index] for index in live)
+        preference = self.node.placement().preference(name, n, list(dht), shares_per_peer)
+        placed = 0
+        for share_index, share in shares.items():
+            for node_id in preference[share_index]:
+                info = dht[node_id]
+                if load[node_id] >= shares_per_peer or node_id == self.node.peer_id or self.node.is_suspected(info):
+                    continue
+                if not self.bucket.take(config.SUBFILE_SIZE, self._stop_event):
+                    return placed
+                if self.node.upload_to_peer(share, info[config.PORT], info[config.HOST]):
+                    load[node_id] += 1
+                    self.node.shareLocations.remove(name, share_index=share_index)
+                    self.node.shareLocations.add(name, share_index, node_id, info[config.HOST], info[config.PORT])
+                    placed += 1
+                    break
+            else:
+                print(f"no peer accepted share {share_index} of {name}")
+        return placed
+
+    def _wait_for_foreground(self):
+        """
+        Let the downloads the user asked for go first.
+        """
+        while self.node.downloads_active() and not self._stop_event.wait(config.REPAIR_BACKOFF):
+            pass
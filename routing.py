@@ -0,0 +1,148 @@
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import config
+
+Contact = namedtuple('Contact', ['key', 'peer_id', 'host', 'port'])
+
+
+def node_key(peer_id):
+    """
+    Position of a node in the XOR metric space: the SHA-1 of its peer id, as an integer.
+    """
+    return int.from_bytes(hashlib.sha1(str(peer_id).encode('utf-8')).digest(), byteorder='big')
+
+
+def make_contact(peer_id, host, port):
+    return Contact(node_key(peer_id), peer_id, host, port)
+
+
+def contact_to_dict(contact):
+    return {config.PEER_ID: contact.peer_id, config.HOST: contact.host, config.PORT: contact.port}
+
+
+def contact_from_dict(data):
+    """
+    Build a contact received from another node. Its key is derived again from the peer id rather than
+    trusted, so a node cannot place itself anywhere it likes in the key space.
+    """
+    return make_contact(data[config.PEER_ID], data[config.HOST], int(data[config.PORT]))
+
+
+class KBucket:
+    """
+    The contacts whose distance to us has a given bit length, least recently seen first, and the contacts
+    waiting for a place when the bucket is full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.contacts = OrderedDict()  # key -> Contact
+        self.replacements = OrderedDict()  # key -> Contact, most recently seen last
+        self.last_updated = time.monotonic()
+
+    def add(self, contact):
+        """
+        Add or refresh a contact. A full bucket keeps its contacts, long-lived nodes being the likeliest to
+        stay, and remembers the new one as a replacement.
+
+        Returns:
+            bool: True if the contact is in the bucket.
+        """
+        self.last_updated = time.monotonic()
+        if contact.key in self.contacts:
+            self.contacts.move_to_end(contact.key)
+            self.contacts[contact.key] = contact
+            return True
+        if len(self.contacts) < self.size:
+            self.contacts[contact.key] = contact
+            return True
+        self.replacements.pop(contact.key, None)
+        self.replacements[contact.key] = contact
+        while len(self.replacements) > self.size:
+            self.replacements.popitem(last=False)
+        return False
+
+    def remove(self, key):
+        """
+        Drop a contact that stopped answering, promoting the most recently seen replacement.
+        """
+        self.replacements.pop(key, None)
+        if self.contacts.pop(key, None) is not None and self.replacements:
+            replacement_key, replacement = self.replacements.popitem()
+            self.contacts[replacement_key] = replacement
+
+
+class RoutingTable:
+    """
+    Kademlia routing table: one k-bucket per distance bit length, so a node keeps at most
+    `bucket_size` contacts per bucket, O(log N) buckets holding contacts in a network of N nodes, and
+    still knows nodes at every distance from itself. It is shared by the connection handler threads,
+    so every access holds a lock.
+    """
+
+    def __init__(self, own_key, bucket_size=config.K_BUCKET_SIZE, bits=config.ID_BITS):
+        self.own_key = own_key
+        self.bucket_size = bucket_size
+        self.bits = bits
+        self.buckets = [KBucket(bucket_size) for _ in range(bits)]
+        self._lock = threading.Lock()
+
+    def bucket_index(self, key):
+        return (key ^ self.own_key).bit_length() - 1
+
+    def add(self, contact):
+        """
+        Record that we heard from a contact.
+
+        Returns:
+            bool: True if the contact is in the table.
+        """
+        if contact.key == self.own_key:
+            return False
+        with self._lock:
+            return self.buckets[self.bucket_index(contact.key)].add(contact)
+
+    def remove(self, key):
+        if key == self.own_key:
+            return
+        with self._lock:
+            self.buckets[self.bucket_index(key)].remove(key)
+
+    def contacts(self):
+        with self._lock:
+            return [contact for bucket in self.buckets for contact in bucket.contacts.values()]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(bucket.contacts) for bucket in self.buckets)
+
+    def closest(self, target, count=config.K_BUCKET_SIZE, exclude=()):
+        """
+        Return the `count` contacts closest to `target` in the XOR metric, closest first.
+        """
+        contacts = [contact for contact in self.contacts() if contact.key not in exclude]
+        contacts.sort(key=lambda contact: contact.key ^ target)
+        return contacts[:count]
+
+    def stale_buckets(self, interval=config.BUCKET_REFRESH):
+        """
+        Indexes of the buckets no lookup went through for `interval` seconds.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [i for i, bucket in enumerate(self.buckets) if now - bucket.last_updated >= interval]
+
+    def random_key(self, index):
+        """
+        A random key falling in bucket `index`, to refresh it with a lookup.
+        """
+        distance = (1 << index) | random.getrandbits(index) if index > 0 else 1
+        return self.own_key ^ distance
+
+    def touch(self, index):
+        with self._lock:
+            self.buckets[index].last_updated = time.monotonic()
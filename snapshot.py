@@ -0,0 +1,207 @@
+import mmap
+import os
+import struct
+import zlib
+
+MAGIC = b"PIRSNAP\0"
+FORMAT_VERSION = 1
+BASE = 0  # a full snapshot
+CHECKPOINT = 1  # the sections changed since the previous snapshot or checkpoint
+
+HEADER = struct.Struct('!8sHBxIH')  # magic, format version, kind, sequence number, number of sections
+SECTION = struct.Struct('!4sQQI')  # tag, offset, length, CRC-32 of the section
+COUNT = struct.Struct('<I')
+
+DHT_SECTION = b"DHT "
+FILES_SECTION = b"PIR "
+UPLOADS_SECTION = b"UPLD"
+
+REMOVED = 1  # flag of a DHT entry that is a removal
+INT_ID = 2  # flag of a DHT entry whose node id is an integer
+
+
+def write_snapshot(path, sections, kind=BASE, sequence=0):
+    """
+    Write a snapshot file: a header, a table of sections and the sections, each checked by a CRC-32. It
+    is written to a temporary file first and moved in place, so a crash leaves the previous file intact.
+
+    Args:
+        path (str): Path of the snapshot.
+        sections (dict): tag -> section bytes.
+        kind (int): BASE or CHECKPOINT.
+        sequence (int): Number of the checkpoint, 0 for a base snapshot.
+    """
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for tag, data in sections.items():
+        table.append(SECTION.pack(tag, offset, len(data), zlib.crc32(data)))
+        offset += len(data)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, kind, sequence, len(sections)))
+        handle.writelines(table)
+        handle.writelines(sections.values())
+    os.replace(temporary, path)
+
+
+class Snapshot:
+    """
+    A snapshot file mapped in memory. Sections are memoryviews of the map, decoded in place without
+    reading the file into Python objects first. Release the views before closing.
+
+    Raises:
+        ValueError: If the file is not a snapshot, has an unknown format version or a damaged section.
+    """
+
+    def __init__(self, path):
+        self._sections = {}
+        self._view = None
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.kind, self.sequence, count = HEADER.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a node snapshot")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"{path} has snapshot format {version}, this node reads {FORMAT_VERSION}")
+            self._view = view = memoryview(self._map)
+            for i in range(count):
+                tag, offset, length, crc = SECTION.unpack_from(self._map, HEADER.size + i * SECTION.size)
+                section = view[offset:offset + length]
+                if len(section) != length or zlib.crc32(section) != crc:
+                    section.release()
+                    raise ValueError(f"section {tag!r} of {path} is damaged")
+                self._sections[tag] = section
+        except ValueError:
+            self.close()
+            raise
+        except struct.error:
+            self.close()
+            raise ValueError(f"{path} is truncated")
+
+    def get(self, tag):
+        return self._sections.get(tag)
+
+    def close(self):
+        for section in self._sections.values():
+            section.release()
+        self._sections = {}
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def pack_strings(strings):
+    """
+    Column of strings: their number, the end offset of every string and the UTF-8 bytes.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets, end = [], 0
+    for data in encoded:
+        end += len(data)
+        offsets.append(end)
+    return COUNT.pack(len(encoded)) + struct.pack(f'<{len(offsets)}I', *offsets) + b"".join(encoded)
+
+
+def unpack_strings(view, position):
+    """
+    Reverse `pack_strings`.
+
+    Returns:
+        Tuple[List[str], int]: The strings and the position after the column.
+    """
+    count = COUNT.unpack_from(view, position)[0]
+    position += COUNT.size
+    offsets = struct.unpack_from(f'<{count}I', view, position)
+    position += 4 * count
+    blob = bytes(view[position:position + (offsets[-1] if count else 0)])
+    strings, start = [], 0
+    for end in offsets:
+        strings.append(blob[start:end].decode('utf-8'))
+        start = end
+    return strings, position + len(blob)
+
+
+def encode_dht(entries, removed):
+    """
+    Encode DHT entries column by column: flags, stamps, ports, host indexes into a table of the distinct
+    hosts, and node ids. Columns of numbers are decoded with one struct call each.
+
+    Args:
+        entries (List): [node id, port, host, stamp] of the entries.
+        removed (List): [node id, stamp] of the removals.
+    """
+    rows = [(node_id, port, host, stamp, 0) for node_id, port, host, stamp in entries]
+    rows += [(node_id, 0, "", stamp, REMOVED) for node_id, stamp in removed]
+    hosts = sorted({row[2] for row in rows})
+    host_index = {host: i for i, host in enumerate(hosts)}
+    count = len(rows)
+    return b"".join([
+        COUNT.pack(count),
+        bytes(flags | (INT_ID if isinstance(node_id, int) else 0) for node_id, _, _, _, flags in rows),
+        struct.pack(f'<{count}d', *(row[3] for row in rows)),
+        struct.pack(f'<{count}H', *(row[1] for row in rows)),
+        struct.pack(f'<{count}I', *(host_index[row[2]] for row in rows)),
+        pack_strings(hosts),
+        pack_strings([str(row[0]) for row in rows]),
+    ])
+
+
+def decode_dht(view):
+    """
+    Reverse `encode_dht`.
+
+    Returns:
+        Tuple[List, List]: The entries and the removals, as given to `encode_dht`.
+    """
+    count = COUNT.unpack_from(view)[0]
+    position = COUNT.size
+    flags = bytes(view[position:position + count])
+    position += count
+    stamps = struct.unpack_from(f'<{count}d', view, position)
+    position += 8 * count
+    ports = struct.unpack_from(f'<{count}H', view, position)
+    position += 2 * count
+    host_indexes = struct.unpack_from(f'<{count}I', view, position)
+    position += 4 * count
+    hosts, position = unpack_strings(view, position)
+    node_ids, _ = unpack_strings(view, position)
+    entries, removed = [], []
+    for i in range(count):
+        node_id = int(node_ids[i]) if flags[i] & INT_ID else node_ids[i]
+        if flags[i] & REMOVED:
+            removed.append([node_id, stamps[i]])
+        else:
+            entries.append([node_id, ports[i], hosts[host_indexes[i]], stamps[i]])
+    return entries, removed
+
+
+FILES_HEADER = struct.Struct('<IIB')  # capacity, number of files uploaded, uploads allowed
+
+
+def encode_files(space_pir):
+    """
+    Encode the manifest of the files a SpacePIR stores: its settings, the file names and their paths.
+    """
+    names = [name for name, _ in space_pir.space]
+    paths = [path for _, path in space_pir.space]
+    return FILES_HEADER.pack(space_pir.max_capacity, space_pir.number_file_uploaded, space_pir.is_allow_upload) \
+        + pack_strings(names) + pack_strings(paths)
+
+
+def decode_files(view, space_pir):
+    """
+    Restore a SpacePIR from a section written by `encode_files`.
+    """
+    space_pir.max_capacity, space_pir.number_file_uploaded, allowed = FILES_HEADER.unpack_from(view)
+    space_pir.is_allow_upload = bool(allowed)
+    names, position = unpack_strings(view, FILES_HEADER.size)
+    paths, _ = unpack_strings(view, position)
+    space_pir.space = list(zip(names, paths))
@@ -25,6 +25,12 @@ class SpacePIR:
         """
         return [file_name for file_name, _ in self.space]
 
+    def get_file_sizes(self):
+        """
+        Return the size in bytes of every stored file, in the same order as `get_file_names`.
+        """
+        return [os.path.getsize(file_path) for _, file_path in self.space]
+
     def turn_off_upload(self):
         self.is_allow_upload = False
 
@@ -34,6 +40,12 @@ class SpacePIR:
     def is_upload_allowed(self):
         return self.is_allow_upload
 
+    def free_capacity(self):
+        """
+        Return how many more files can be stored before reaching `max_capacity`.
+        """
+        return max(self.max_capacity - self.number_file_uploaded, 0)
+
     def add(self, data):
         """
         Add a file to the space and store it only if it is not already stored.
@@ -83,12 +95,15 @@ class SpacePIR:
         """
         return self.space
 
-    def get(self, A,public_key)->List[bytes]:
+    def get(self, A,public_key, first=0, count=None)->List[bytes]:
         """
         Multiplies each file in B by the corresponding encrypted element in A without decryption.
 
         Args:
             A (list): Vector A containing encrypted values.
+            first (int): First chunk of the files to answer for.
+            count (int): Number of chunks to answer for, up to the end of the subfile when None. Only
+                these chunks are read and multiplied, so a range costs in proportion to its length.
 
         Returns:
             int: The cumulative result of element-wise file multiplications with A.
@@ -97,22 +112,27 @@ class SpacePIR:
         if len(A) != len(self.space):
             raise ValueError(
                 f"Size of vector A ({len(A)}) does not match the number of stored files ({len(self.space)}).")
+        total_chunks = config.SUBFILE_SIZE//config.BUFFER_SIZE
+        if count is None:
+            count = total_chunks - first
+        if first < 0 or count < 0 or first + count > total_chunks:
+            raise ValueError(f"chunks [{first}, {first + count}) are outside the {total_chunks} chunks of a subfile")
 
         # Initialize cumulative result
-        chunks_len = config.SUBFILE_SIZE//config.BUFFER_SIZE
+        chunks_len = count
         cumulative_result_vector = [0 for i in range(chunks_len)]
 
         # Step 2: Process each encrypted element in A and corresponding file in B
         for encrypted_value, (_, file_path) in zip(A, self.space):
             # Read the binary file content and interpret it as a large integer
             with open(file_path, 'rb') as file:
-                file_content = file.read()
+                file.seek(first * config.BUFFER_SIZE)
+                file_content = file.read(count * config.BUFFER_SIZE)
                 # print(f"file_content)
                 file_ints = [int.from_bytes(file_content[i:i+config.BUFFER_SIZE], byteorder='big') for i in range
-                (0, config.SUBFILE_SIZE,config.BUFFER_SIZE)]
+                (0, count * config.BUFFER_SIZE,config.BUFFER_SIZE)]
                 # file_int = int.from_bytes(file_content, byteorder='big')  # Convert entire binary to a large integer
 
-
             # Multiply the encrypted value directly by the file's integer content
             # Here, we assume that the multiplication operation is valid in the encrypted domain
             encrypted_value = int.from_bytes(encrypted_value, byteorder='big')
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import zfec
+
+import config
+from FileHandler import FileHandler
+
+BLOCK_SIZE = 64 * 1024
+STRIPE_SIZE = 4096
+
+
+class TestFileHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.fileHandler = FileHandler()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_file(self, name, size):
+        data = os.urandom(size)
+        with open(name, 'wb') as f:
+            f.write(data)
+        return data
+
+    def read_part(self, part_file):
+        with open(part_file, 'rb') as f:
+            content = f.read()
+        header = part_file.encode() + b","
+        self.assertTrue(content.startswith(header))
+        return content[len(header):]
+
+    def strip_parts(self, part_files, indexes):
+        stripped = []
+        for index in indexes:
+            stripped_file = f"stripped_{index}"
+            with open(stripped_file, 'wb') as f:
+                f.write(self.read_part(part_files[index]))
+            stripped.append((index, stripped_file))
+        return stripped
+
+    def test_divide_matches_whole_file_encoding(self):
+        data = self.write_file("data.bin", 3 * BLOCK_SIZE + 1000)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=6, block_size=BLOCK_SIZE,
+                                                   stripe_size=STRIPE_SIZE)
+        self.assertEqual(k, 4)
+        blocks = [data[i:i + BLOCK_SIZE].ljust(BLOCK_SIZE, b'\x00') for i in range(0, len(data), BLOCK_SIZE)]
+        expected = zfec.Encoder(k, 6).encode(blocks)
+        for part_file, part in zip(part_files, expected):
+            self.assertEqual(self.read_part(part_file), part)
+
+    def test_stripe_size_not_dividing_block(self):
+        self.write_file("odd.bin", 2 * BLOCK_SIZE)
+        part_files, _, _ = self.fileHandler.divide("odd.bin", 1, n=3, block_size=BLOCK_SIZE, stripe_size=5000)
+        parts = [self.read_part(part_file) for part_file in part_files]
+        part_files, _, _ = self.fileHandler.divide("odd.bin", 1, n=3, block_size=BLOCK_SIZE,
+                                                   stripe_size=BLOCK_SIZE)
+        self.assertEqual([self.read_part(part_file) for part_file in part_files], parts)
+
+    def test_combine_any_k_shares(self):
+        data = self.write_file("data.bin", 3 * BLOCK_SIZE + 1000)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=7, block_size=BLOCK_SIZE,
+                                                   stripe_size=STRIPE_SIZE)
+        for indexes in ([0, 1, 2, 3], [6, 2, 5, 0], [3, 4, 5, 6]):
+            parts = self.strip_parts(part_files, indexes)
+            self.fileHandler.combine(parts, 7, k, "out.bin", original_size=len(data), stripe_size=STRIPE_SIZE)
+            with open("out.bin", 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_combine_prefers_data_shares(self):
+        data = self.write_file("data.bin", 2 * BLOCK_SIZE + 10)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=5, block_size=BLOCK_SIZE)
+        self.assertTrue(FileHandler.is_direct_copy([2, 0, 1], k))
+        self.assertFalse(FileHandler.is_direct_copy([0, 1, 4], k))
+        parts = self.strip_parts(part_files, [4, 2, 3, 1, 0])
+        self.fileHandler.combine(parts, 5, k, "out.bin", original_size=len(data))
+        with open("out.bin", 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_combine_needs_k_distinct_shares(self):
+        self.write_file("data.bin", 2 * BLOCK_SIZE)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=4, block_size=BLOCK_SIZE)
+        parts = self.strip_parts(part_files, [1, 1])
+        with self.assertRaises(ValueError):
+            self.fileHandler.combine(parts, 4, k, "out.bin")
+
+    def test_parallel_matches_serial(self):
+        data = self.write_file("data.bin", 5 * BLOCK_SIZE + 300)
+        serial, parallel = FileHandler(workers=1), FileHandler(workers=4)
+        part_files, k, _ = serial.divide("data.bin", 1, n=8, block_size=BLOCK_SIZE, stripe_size=BLOCK_SIZE)
+        expected = [self.read_part(part_file) for part_file in part_files]
+        part_files, _, _ = parallel.divide("data.bin", 1, n=8, block_size=BLOCK_SIZE, stripe_size=BLOCK_SIZE)
+        self.assertEqual([self.read_part(part_file) for part_file in part_files], expected)
+
+        parts = self.strip_parts(part_files, [7, 1, 6, 3, 5, 0])
+        parallel.combine(parts, 8, k, "out.bin", original_size=len(data), stripe_size=BLOCK_SIZE)
+        with open("out.bin", 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_rebuild_lost_shares(self):
+        self.write_file("data.bin", 3 * BLOCK_SIZE + 10)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=7, block_size=BLOCK_SIZE,
+                                                   stripe_size=STRIPE_SIZE)
+        parts = self.strip_parts(part_files, [6, 4, 2, 5])
+        shares = self.fileHandler.rebuild_shares(parts, 7, k, [0, 3, 1], "data.bin", BLOCK_SIZE, STRIPE_SIZE)
+        for index, share in zip([0, 3, 1], shares):
+            with open(part_files[index], 'rb') as f:
+                self.assertEqual(share.read(), f.read())
+            share.close()
+
+    def test_parallel_memory_budget(self):
+        for workers in (1, 4, 64):
+            window, sub_stripe = FileHandler(workers=workers)._stripe_window(STRIPE_SIZE * 16)
+            self.assertLessEqual(window * sub_stripe, STRIPE_SIZE * 16)
+        self.assertEqual(FileHandler(workers=4)._stripe_window(BLOCK_SIZE), (8, BLOCK_SIZE // 8))
+
+    def test_encode_in_memory(self):
+        data = self.write_file("data.bin", 2 * BLOCK_SIZE + 77)
+        part_files, k, _ = self.fileHandler.divide("data.bin", 1, n=4, block_size=BLOCK_SIZE)
+        os.mkdir("empty")
+        os.chdir("empty")
+        parts, encoded_k = self.fileHandler.encode(os.path.join("..", "data.bin"), 4, block_size=BLOCK_SIZE)
+        self.assertEqual(os.listdir("."), [])  # nothing written to the working directory
+        os.chdir("..")
+        self.assertEqual(encoded_k, k)
+        for part_file, part in zip(part_files, parts):
+            with open(part_file, 'rb') as f:
+                self.assertEqual(part.read(), f.read())
+
+        # Strip the headers and rebuild from the buffers
+        for i, part in enumerate(parts):
+            part.seek(0)
+            content = part.read().split(b",", 1)[1]
+            part.seek(0)
+            part.truncate()
+            part.write(content)
+        self.fileHandler.combine([(3, parts[3]), (1, parts[1]), (2, parts[2])], 4, k, "out.bin",
+                                 original_size=len(data))
+        with open("out.bin", 'rb') as f:
+            self.assertEqual(f.read(), data)
+        for part in parts:
+            part.close()
+
+    def test_compressed_round_trip(self):
+        data = b"compressible document line\n" * 20000
+        with open("doc.txt", 'wb') as f:
+            f.write(data)
+        for method in (config.ZLIB, config.LZMA):
+            self.assertEqual(self.fileHandler.compress("doc.txt", "doc.z", method), method)
+            compressed_size = os.path.getsize("doc.z")
+            self.assertLess(compressed_size, len(data) // 10)
+            part_files, k, _ = self.fileHandler.divide("doc.z", 1, n=3, block_size=BLOCK_SIZE)
+            parts = self.strip_parts(part_files, [2, 0])[:k]
+            self.fileHandler.combine(parts, 3, k, "out.txt", original_size=compressed_size, compression=method)
+            with open("out.txt", 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_incompressible_data_skipped(self):
+        self.write_file("random.bin", 300 * 1024)
+        self.assertIsNone(self.fileHandler.compress("random.bin", "random.z"))
+        self.assertFalse(os.path.exists("random.z"))
+
+
+if __name__ == '__main__':
+    unittest.main()
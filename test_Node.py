@@ -1,8 +1,20 @@
+import shutil
+import socket
+import tempfile
 import unittest
 import threading
 import os
+from collections import Counter
+from unittest import mock
+
+from phe import paillier
+
 import config
-from Node import Node
+from encryption import Encryption
+from Node import Node, find_shares
+from Peer import Peer
+from redundancy import RedundancyPolicy
+from repair import TokenBucket
 from time import sleep
 
 
@@ -218,5 +230,294 @@ class TestNodeMessaging(unittest.TestCase):
             os.remove(file_path)
 
 
+class TestNodeShares(unittest.TestCase):
+    """
+    Share handling of a node, without a network: a small key keeps the Paillier operations fast.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.public_key, cls.private_key = paillier.generate_paillier_keypair(n_length=512)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.node = Node(5101, peer_id=1, private_key=self.private_key, path=self.directory)
+        self.stored = {}  # port -> {share name: content}, what the peers hold
+        self.served = []  # names of the shares the peers sent
+        self.requests = []  # ports of the peers asked for a share
+        self.down = set()  # ports of the peers not answering pings
+        self.ranges = []  # byte ranges of the shares asked for
+        for i in range(12):
+            self.node.add_node_to_DHT(6000 + i, 100 + i, '127.0.0.1')
+            self.stored[6000 + i] = {}
+
+    def tearDown(self):
+        self.node.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def fake_status(self, port, host="127.0.0.1"):
+        return {config.FREE_CAPACITY: 10, config.QUEUE_DEPTH: 0, config.UPLOAD_ALLOWED: True}
+
+    def fake_upload(self, file, port, host="127.0.0.1"):
+        file.seek(0)
+        name, content = file.read().split(b",", 1)
+        self.stored[port][name.decode()] = content
+        return True
+
+    def fake_download(self, name, port, number, host="127.0.0.1", exclude=(), wanted=None, share_range=None):
+        # a share as the PIR download returns it: zero padded up to the subfile size
+        self.requests.append(port)
+        names = sorted(self.stored[port])
+        shares = [(index, names[i]) for index, i in find_shares(names, name)
+                  if index not in exclude and (wanted is None or index in wanted)]
+        if not shares:
+            return None
+        index, share_name = min(shares)
+        self.served.append(share_name)
+        part = tempfile.SpooledTemporaryFile()
+        content = self.stored[port][share_name].ljust(config.SUBFILE_SIZE - len(share_name) - 1, b"\x00")
+        if share_range is not None:
+            self.ranges.append(share_range)
+            content = content[share_range[0]:share_range[1]]
+        part.write(content)
+        return index, part
+
+    def fake_ping(self, port, host="127.0.0.1"):
+        if port in self.down:
+            self.node.peer_missed((host, port))
+            return None
+        self.node.peer_answered((host, port))
+        return 0.001
+
+    def offline(self):
+        return mock.patch.multiple(self.node, request_status=self.fake_status, upload_to_peer=self.fake_upload,
+                                   download_from_peer=self.fake_download, ping_peer=self.fake_ping)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_download_padded_shares(self):
+        data = os.urandom(3 * 1024 * 1024)
+        path = self.write_file("big.bin", data)
+        with self.offline():
+            n, k = self.node.upload(path)
+            self.assertGreater(k, 1)
+            os.remove(path)
+            for port in list(self.stored)[:n - k]:  # lose some data shares, so decoding is needed
+                self.stored[port].clear()
+            self.assertTrue(self.node.download("big.bin"))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_decode_response(self):
+        data = b"\x00\x00share_part0," + os.urandom(2 * config.BUFFER_SIZE) + b"\x00\x01" + bytes(5)
+        # every BUFFER_SIZE chunk of the subfile decrypts to a big-endian integer without its leading zeros,
+        # and the pass goes on over the whole SUBFILE_SIZE with empty chunks
+        chunks = [data[i:i + config.BUFFER_SIZE].lstrip(b"\x00") for i in range(0, config.SUBFILE_SIZE, config.BUFFER_SIZE)]
+        with mock.patch.object(Encryption, 'decrypt', side_effect=lambda key, chunk: chunk):
+            self.assertEqual(self.node.decode_response(chunks, len(data)), data)
+
+    def test_placement_asks_only_needed_peers(self):
+        dht = {i: {config.PORT: 6000 + i, config.HOST: '127.0.0.1'} for i in range(10)}
+        full = {config.FREE_CAPACITY: 0, config.QUEUE_DEPTH: 0, config.UPLOAD_ALLOWED: True}
+        free = dict(full, **{config.FREE_CAPACITY: 5})
+        asked = []
+
+        def request_status(port, host):
+            asked.append(port)
+            return full if port == asked[0] else free
+
+        with mock.patch.object(self.node, 'request_status', side_effect=request_status):
+            candidates = self.node.placement_candidates(dht, 3)
+        self.assertEqual(len(asked), 4)  # the full peer is replaced by the next one
+        self.assertEqual(len(candidates), 9)
+        self.assertNotIn(asked[0], [info[config.PORT] for _, info in candidates[:3]])
+
+    def test_compressed_upload_survives_restart(self):
+        data = b"a line of a compressible document\n" * 50000
+        path = self.write_file("doc.txt", data)
+        with self.offline():
+            n, k = self.node.upload(path, compression=config.ZLIB)
+        self.node.store_Node("password", path=self.directory + os.sep)
+        os.remove(path)
+
+        restarted = Node(5102, peer_id=1, private_key=self.private_key, path=self.directory)
+        restarted.load_node("password", path=self.directory + os.sep)
+        with mock.patch.multiple(restarted, download_from_peer=self.fake_download):
+            self.assertTrue(restarted.download("doc.txt", n, k))
+        self.assertIn("doc.txt", restarted.manifests)  # the shares were checked against the stored manifest
+
+        restarted.manifests["doc.txt"].file_hash = "0" * 64
+        with self.assertRaises(ValueError):
+            restarted.download("doc.txt", n, k)
+        restarted.stop()
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_packed_member_from_data_shares(self):
+        self.node.redundancyPolicy = RedundancyPolicy(max_block_size=4096)
+        members = {f"doc{i}.txt": os.urandom(3000) for i in range(4)}
+        paths = [self.write_file(name, data) for name, data in members.items()]
+        with self.offline():
+            container, n, k = self.node.upload_packed(paths)
+            self.assertGreater(k, 2)
+            for path in paths:
+                os.remove(path)
+
+            self.assertTrue(self.node.download_packed("doc2.txt"))
+            self.assertLess(len(self.served), k)  # only the data shares holding the member
+            self.assertTrue(all(int(name.rsplit("_part", 1)[1]) < k for name in self.served))
+
+            self.node.packed_files.clear()  # lost: the container's own index is read instead
+            self.assertTrue(self.node.download_packed("doc3.txt", container))
+        for name in ("doc2.txt", "doc3.txt"):
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                self.assertEqual(f.read(), members[name])
+
+    def test_download_asks_only_holders(self):
+        path = self.write_file("placed.bin", os.urandom(3 * 1024 * 1024))
+        with self.offline():
+            n, k = self.node.upload(path)
+            self.assertTrue(self.node.download("placed.bin"))
+        self.assertGreaterEqual(len(self.served), k)
+        self.assertEqual(len(self.requests), len(self.served))  # every peer asked held the share
+
+    def test_share_locations_survive_restart(self):
+        data = os.urandom(3 * 1024 * 1024)
+        path = self.write_file("located.bin", data)
+        with self.offline():
+            n, k = self.node.upload(path)
+        locations = self.node.shareLocations.get("located.bin")
+        self.assertEqual([location.share_index for location in locations], list(range(n)))
+        for location in locations:
+            self.assertIn(f"located.bin_part{location.share_index}", self.stored[location.port])
+        self.node.store_Node("password", path=self.directory + os.sep)
+        os.remove(path)
+
+        restarted = Node(5102, peer_id=1, private_key=self.private_key, path=self.directory)
+        restarted.load_node("password", path=self.directory + os.sep)
+        self.assertEqual(restarted.shareLocations.get("located.bin"), locations)
+        # without any DHT membership the recorded holders are still found
+        with mock.patch.multiple(restarted, download_from_peer=self.fake_download), \
+                mock.patch.object(restarted.DHT, 'get_dht', return_value={}):
+            self.assertTrue(restarted.download("located.bin"))
+        restarted.stop()
+        self.assertGreaterEqual(len(self.served), k)
+        self.assertEqual(len(self.requests), len(self.served))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_repair_regenerates_lost_shares(self):
+        self.node.redundancyPolicy = RedundancyPolicy(max_block_size=256 * 1024)
+        self.node.repairDaemon.bucket = TokenBucket(10 ** 9, 10 ** 9)
+        self.node.liveness.heartbeat_interval = 0  # holders are pinged at every check
+        data = os.urandom(1024 * 1024)
+        path = self.write_file("durable.bin", data)
+        with self.offline():
+            n, k = self.node.upload(path)
+            os.remove(path)
+            self.assertEqual(self.node.repairDaemon.run_once(), {})  # every share is live
+
+            lost = {location.share_index: location.port for location in self.node.shareLocations.get("durable.bin")
+                    if location.share_index >= n - 3}
+            removed = {}
+            for index, port in lost.items():
+                removed[index] = self.stored[port].pop(f"durable.bin_part{index}")
+                self.down.add(port)
+            repaired = self.node.repairDaemon.run_once()
+            self.assertEqual(repaired, {"durable.bin": len(lost)})
+            for index, location in ((location.share_index, location)
+                                    for location in self.node.shareLocations.get("durable.bin")):
+                self.assertNotIn(location.port, self.down)
+                if index in lost:
+                    self.assertEqual(self.stored[location.port][f"durable.bin_part{index}"], removed[index])
+            self.assertTrue(self.node.download("durable.bin"))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+
+    def test_upload_many_batches_shares_per_peer(self):
+        self.node.redundancyPolicy = RedundancyPolicy(max_block_size=256 * 1024)
+        connections = Counter()  # port -> number of batch connections
+
+        def fake_batch(files, port, host="127.0.0.1"):
+            connections[port] += 1
+            return [self.fake_upload(file, port, host) for file in files]
+
+        files = {f"many{i}.bin": os.urandom(300 * 1024 * (i + 1)) for i in range(3)}
+        paths = [self.write_file(name, data) for name, data in files.items()]
+        with self.offline(), mock.patch.object(self.node, 'upload_batch_to_peer', side_effect=fake_batch):
+            summary = self.node.upload_many(paths + [os.path.join(self.directory, "missing.bin")])
+            self.assertEqual(sorted(summary.uploaded), sorted(paths))
+            self.assertEqual(summary.failed, [os.path.join(self.directory, "missing.bin")])
+            self.assertEqual(summary.shares, sum(n for n, _ in summary.uploaded.values()))
+            self.assertLessEqual(max(connections.values()), len(files))  # one connection per peer and file
+            for path in paths:
+                os.remove(path)
+                self.assertTrue(self.node.download(os.path.basename(path)))
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), files[os.path.basename(path)])
+
+
+    def test_range_read_fetches_only_covering_pieces(self):
+        self.node.redundancyPolicy = RedundancyPolicy(max_block_size=256 * 1024)
+        data = os.urandom(1024 * 1024 - 100)
+        path = self.write_file("ranged.bin", data)
+        with self.offline():
+            n, k = self.node.upload(path)
+            piece_size = self.node.manifests["ranged.bin"].piece_size
+            self.assertLess(piece_size, self.node.file_params["ranged.bin"][config.BLOCK_SIZE])
+            self.assertEqual(b"".join(self.node.download_range("ranged.bin", 0, 100)), data[:100])
+            self.assertEqual(self.ranges, [(0, piece_size)])  # one piece of the first data share
+
+            # lose the data share of the second block and corrupt the first piece of the third
+            location = next(location for location in self.node.shareLocations.get("ranged.bin")
+                            if location.share_index == 1)
+            self.stored[location.port].pop("ranged.bin_part1")
+            location = next(location for location in self.node.shareLocations.get("ranged.bin")
+                            if location.share_index == 2)
+            share = bytearray(self.stored[location.port]["ranged.bin_part2"])
+            share[10] ^= 0xFF
+            self.stored[location.port]["ranged.bin_part2"] = bytes(share)
+            self.ranges.clear()
+            offset = 256 * 1024 - 1000
+            chunks = list(self.node.download_range("ranged.bin", offset, 2 * 256 * 1024))
+            self.assertEqual(b"".join(chunks), data[offset:offset + 2 * 256 * 1024])
+            self.assertGreater(len(chunks), 2)  # yielded piece by piece
+            self.assertTrue(all(end - start <= piece_size for start, end in self.ranges))
+            self.assertEqual(b"".join(self.node.download_range("ranged.bin", len(data) - 10, 100)), data[-10:])
+
+    def test_ranged_pir_download(self):
+        server = Peer(peer_id=2)
+        server.spacePIR.base_directory = self.directory
+        share = os.urandom(3 * config.BUFFER_SIZE)
+        server.spacePIR.add(b"other_part0," + os.urandom(100))
+        server.spacePIR.add(b"file_part1," + share)
+
+        def connect(address, timeout=None):
+            client, server_sock = socket.socketpair()
+
+            def serve():
+                server_sock.recv(1024)
+                server.handle_segmented_get_request(server_sock, ranged=True)
+                server_sock.close()
+            threading.Thread(target=serve, daemon=True).start()
+            return client
+
+        share_range = (config.BUFFER_SIZE - 5, config.BUFFER_SIZE + 7)
+        with mock.patch('socket.create_connection', side_effect=connect), \
+                mock.patch.object(server.spacePIR, 'get', wraps=server.spacePIR.get) as get:
+            index, part = self.node.download_from_peer("file", 6000, 0, share_range=share_range)
+        part.seek(0)
+        self.assertEqual((index, part.read()), (1, share[share_range[0]:share_range[1]]))
+        self.assertEqual(get.call_args[0][2:], (1, 2))  # the two chunks holding the range
+        part.close()
+        server.stop()
+
+
 if __name__ == '__main__':
     unittest.main()
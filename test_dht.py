@@ -0,0 +1,117 @@
+import socket
+import threading
+import unittest
+from unittest import mock
+
+from phe import paillier
+
+import config
+from dht import DHT
+from Node import Node
+from transfer import recv_frame
+
+
+class TestDHT(unittest.TestCase):
+
+    def test_changes_since_follow_churn(self):
+        dht = DHT()
+        for i in range(100):
+            dht.add_node(6000 + i, i, '127.0.0.1')
+        version = dht.version
+        dht.add_node(7000, "new", '127.0.0.1')
+        dht.remove_node(5)
+        entries, removed = dht.changes_since(version, dht.epoch)
+        self.assertEqual([entry[:3] for entry in entries], [["new", 7000, '127.0.0.1']])
+        self.assertEqual([node_id for node_id, _ in removed], [5])
+        self.assertEqual(len(dht.changes_since(version, "another epoch")[0]), 100)
+
+    def test_merge_keeps_newest_change(self):
+        dht, other = DHT(), DHT()
+        dht.add_node(6000, 1, '127.0.0.1')
+        other.merge(*dht.changes_since(0))
+        self.assertEqual(other.digest(), dht.digest())
+        stale = dht.changes_since(0)
+        dht.remove_node(1)
+        other.merge(*dht.changes_since(0))
+        self.assertNotIn(1, other.get_dht())
+        other.merge(*stale)  # an old copy of the entry does not bring the node back
+        self.assertNotIn(1, other.get_dht())
+        self.assertEqual(other.digest(), dht.digest())
+
+    def test_snapshots_are_immutable(self):
+        dht = DHT()
+        dht.add_node(6000, 0, '127.0.0.1')
+        snapshot = dht.get_dht()
+        self.assertIs(dht.get_dht(), snapshot)  # no copy while nothing changes
+        with self.assertRaises(TypeError):
+            snapshot[1] = {}
+
+        def add(first):
+            for i in range(first, first + 200):
+                dht.add_node(6000 + i, i, '127.0.0.1')
+
+        threads = [threading.Thread(target=add, args=(first,)) for first in range(1, 801, 200)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(snapshot), [0])  # a reader's view does not change under it
+        self.assertEqual(len(dht), 801)
+        self.assertEqual(sorted(node_id for node_id, _ in dht.nodes()), list(range(801)))
+
+
+class TestSync(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        _, cls.private_key = paillier.generate_paillier_keypair(n_length=512)
+
+    def setUp(self):
+        self.server = Node(7200, peer_id="server", private_key=self.private_key)
+        self.client = Node(7201, peer_id="client", private_key=self.private_key)
+        self.frames = []  # frames read by either side, in order: ready, request and reply, per sync
+
+    def tearDown(self):
+        self.server.stop()
+        self.client.stop()
+
+    def connect(self, address, timeout=None):
+        client, server = socket.socketpair()
+
+        def serve():
+            server.recv(len(config.REQUEST_SYNC))
+            self.server.handle_sync_request(server)
+            server.close()
+
+        threading.Thread(target=serve, daemon=True).start()
+        return client
+
+    def sync(self):
+        with mock.patch('socket.create_connection', side_effect=self.connect), \
+                mock.patch('Node.recv_frame', side_effect=self.record_frame):
+            return self.client.sync_with_peer('127.0.0.1', 7200)
+
+    def record_frame(self, sock):
+        frame = recv_frame(sock)
+        self.frames.append(frame)
+        return frame
+
+    def test_second_sync_sends_only_changes(self):
+        for i in range(50):
+            self.server.add_node_to_DHT(6000 + i, i, '127.0.0.1')
+        self.assertEqual(self.sync(), 50)
+        self.assertEqual(self.client.DHT.get_dht(), self.server.DHT.get_dht())
+        self.assertEqual(len(self.client.routingTable), 50)
+
+        self.server.add_node_to_DHT(7000, "joined", '127.0.0.1')
+        self.server.DHT.remove_node(7)
+        self.assertEqual(self.sync(), 1)
+        self.assertNotIn(7, self.client.DHT.get_dht())
+        self.assertIn("joined", self.client.DHT.get_dht())
+        self.assertLess(len(self.frames[5]), len(self.frames[2]) / 10)
+
+        self.assertEqual(self.sync(), 0)  # already in sync: the digests match
+
+
+if __name__ == '__main__':
+    unittest.main()
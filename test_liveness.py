@@ -0,0 +1,78 @@
+import unittest
+from unittest import mock
+
+from phe import paillier
+
+import config
+from liveness import FailureDetector
+from Node import Node
+
+
+class TestFailureDetector(unittest.TestCase):
+
+    def test_suspicion_and_recovery(self):
+        detector = FailureDetector(heartbeat_interval=60, suspect_failures=2, dead_timeout=0)
+        address = ('127.0.0.1', 6000)
+        self.assertTrue(detector.needs_heartbeat(address))
+        detector.heard(address)
+        self.assertFalse(detector.needs_heartbeat(address))
+        detector.missed(address)
+        self.assertFalse(detector.is_suspected(address))  # one failure may be transient
+        detector.missed(address)
+        self.assertTrue(detector.is_suspected(address))
+        self.assertTrue(detector.is_dead(address))
+        self.assertTrue(detector.heard(address))
+        self.assertFalse(detector.is_suspected(address))
+
+
+class TestHeartbeat(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        _, cls.private_key = paillier.generate_paillier_keypair(n_length=512)
+
+    def setUp(self):
+        self.node = Node(7300, peer_id="me", private_key=self.private_key)
+        for i in range(6):
+            self.node.add_node_to_DHT(6000 + i, i, '127.0.0.1')
+        self.down = {6001, 6004}
+        self.pinged = []
+
+    def tearDown(self):
+        self.node.stop()
+
+    def ping_peer(self, port, host="127.0.0.1"):
+        self.pinged.append(port)
+        if port in self.down:
+            self.node.peer_missed((host, port))
+            return None
+        self.node.peer_answered((host, port))
+        return 0.001
+
+    def test_dead_peers_are_skipped_removed_and_readmitted(self):
+        with mock.patch.object(self.node, 'ping_peer', side_effect=self.ping_peer):
+            self.assertEqual(self.node.heartbeat(), [])
+            self.assertEqual(len(self.pinged), 6)
+            self.pinged.clear()
+            self.assertEqual(self.node.heartbeat(), [])  # only the failing peers are pinged again
+            self.assertEqual(sorted(self.pinged), sorted(self.down))
+
+            ranked = [info[config.PORT] for _, info in self.node.rank_peers(self.node.DHT.get_dht())]
+            self.assertEqual(sorted(ranked), [6000, 6002, 6003, 6005])
+            with mock.patch('socket.create_connection') as connect:
+                self.assertIsNone(self.node.download_from_peer("file", 6001, 0))
+                connect.assert_not_called()
+
+            self.node.liveness.dead_timeout = 0  # suspected for long enough
+            self.assertEqual(sorted(self.node.heartbeat()), [1, 4])
+            self.assertEqual(sorted(self.node.DHT.get_dht()), [0, 2, 3, 5])
+            self.assertEqual(len(self.node.routingTable), 4)
+
+            self.down.clear()  # they come back
+            self.node.heartbeat()
+        self.assertEqual(sorted(self.node.DHT.get_dht()), list(range(6)))
+        self.assertEqual(self.node.departed, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
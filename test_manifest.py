@@ -0,0 +1,73 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+from FileHandler import FileHandler
+from manifest import ShareManifest
+
+KEY = b"k" * 32
+
+
+class TestShareManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "data.bin")
+        with open(self.file_path, 'wb') as f:
+            f.write(os.urandom(100 * 1024))
+        self.parts, self.k = FileHandler().encode(self.file_path, 4, block_size=32 * 1024)
+        self.manifest = ShareManifest.build("data.bin", self.file_path, self.parts, KEY)
+
+    def tearDown(self):
+        for part in self.parts:
+            part.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def downloaded(self, index):
+        # what a downloader holds: the share without its header, zero padded up to the subfile size
+        self.parts[index].seek(0)
+        share = self.parts[index].read().split(b",", 1)[1]
+        return io.BytesIO(share.ljust(config.SUBFILE_SIZE - config.FILE_NAME_SIZE, b"\x00"))
+
+    def trimmed(self, index):
+        part = self.downloaded(index)
+        part.truncate(32 * 1024)  # what download keeps: the recorded block size
+        return part
+
+    def test_verify_shares(self):
+        self.assertFalse(self.manifest.verify_share(0, self.downloaded(0)))
+        for index in range(4):
+            self.assertTrue(self.manifest.verify_share(index, self.trimmed(index)))
+        self.assertFalse(self.manifest.verify_share(0, self.trimmed(1)))
+        truncated = io.BytesIO(self.trimmed(2).read()[:-1])
+        self.assertFalse(self.manifest.verify_share(2, truncated))
+        self.assertFalse(self.manifest.verify_share(7, self.trimmed(0)))
+        self.assertTrue(self.manifest.verify_file(self.file_path))
+
+    def test_signature(self):
+        self.assertTrue(self.manifest.verify_signature(KEY))
+        self.assertFalse(self.manifest.verify_signature(b"x" * 32))
+        copy = ShareManifest.from_dict(self.manifest.to_dict())
+        self.assertTrue(copy.verify_signature(KEY))
+        copy.share_hashes[0] = copy.share_hashes[1]
+        self.assertFalse(copy.verify_signature(KEY))
+
+
+    def test_verify_pieces(self):
+        manifest = ShareManifest.build("data.bin", self.file_path, self.parts, KEY, piece_size=8 * 1024)
+        share = self.trimmed(3).read()
+        self.assertTrue(manifest.verify_piece(3, io.BytesIO(share[8 * 1024:16 * 1024]), 1))
+        self.assertFalse(manifest.verify_piece(3, io.BytesIO(share[:8 * 1024]), 1))
+        self.assertFalse(manifest.verify_piece(3, io.BytesIO(share[:8 * 1024]), 4))  # past the share
+        self.assertFalse(self.manifest.verify_piece(3, io.BytesIO(share[:8 * 1024]), 0))  # no piece digests
+        copy = ShareManifest.from_dict(manifest.to_dict())
+        self.assertTrue(copy.verify_signature(KEY))
+        copy.piece_hashes[0][0] = copy.piece_hashes[1][0]
+        self.assertFalse(copy.verify_signature(KEY))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from packing import FilePacker
+
+
+class TestFilePacker(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.packer = FilePacker()
+        self.files = {}
+        for i, size in enumerate([0, 10, 10 * 1024, 100 * 1024]):
+            path = os.path.join(self.directory, f"doc{i}.txt")
+            self.files[path] = os.urandom(size)
+            with open(path, 'wb') as f:
+                f.write(self.files[path])
+        self.container = os.path.join(self.directory, "container")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_pack_and_extract(self):
+        index = self.packer.pack(list(self.files), self.container)
+        self.assertEqual(self.packer.read_index(self.container), index)
+        for path, data in self.files.items():
+            output = os.path.join(self.directory, "out")
+            self.packer.extract(self.container, os.path.basename(path), output)
+            with open(output, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_offsets_point_into_container(self):
+        index = self.packer.pack(list(self.files), self.container)
+        with open(self.container, 'rb') as f:
+            content = f.read()
+        self.assertEqual(FilePacker.parse_index(content[:min(offset for offset, _ in index.values())]), index)
+        for path, data in self.files.items():
+            offset, length = index[os.path.basename(path)]
+            self.assertEqual(content[offset:offset + length], data)
+
+    def test_duplicate_names_rejected(self):
+        path = next(iter(self.files))
+        with self.assertRaises(ValueError):
+            self.packer.pack([path, path], self.container)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,8 @@ import os
 import time
 import threading
 import socket
-from Peer import Peer, delete_file
+import config
+from Peer import Peer, delete_file, pack_status, unpack_status
 
 BUFFER_SIZE = 528
 
@@ -189,5 +190,20 @@ class TestPeerFileTransfer(unittest.TestCase):
             self.peer2.stop()
 
 
+class TestPeerStatus(unittest.TestCase):
+    def test_status_record(self):
+        peer = Peer(peer_id=1)
+        peer.spacePIR.change_capacity(10)
+        status = unpack_status(pack_status(peer.get_status()))
+        self.assertEqual(status, {config.FREE_CAPACITY: 10, config.QUEUE_DEPTH: 0, config.UPLOAD_ALLOWED: True})
+
+        peer.spacePIR.turn_off_upload()
+        with peer._upload_slot():
+            status = unpack_status(pack_status(peer.get_status()))
+        self.assertEqual(status[config.QUEUE_DEPTH], 1)
+        self.assertFalse(status[config.UPLOAD_ALLOWED])
+        peer.stop()
+
+
 if __name__ == "__main__":
     unittest.main()
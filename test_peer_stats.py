@@ -0,0 +1,37 @@
+import unittest
+
+import config
+from peer_stats import PeerStats
+
+
+class TestPeerStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = PeerStats()
+        self.fast = ('127.0.0.1', 5001)
+        self.slow = ('127.0.0.1', 5002)
+        self.flaky = ('127.0.0.1', 5003)
+
+    def test_rank_by_latency_and_throughput(self):
+        self.stats.record_rtt(self.fast, 0.001)
+        self.stats.record_success(self.fast, config.SUBFILE_SIZE, 0.01)
+        self.stats.record_rtt(self.slow, 0.2)
+        self.stats.record_success(self.slow, config.SUBFILE_SIZE, 2)
+        self.assertEqual(self.stats.rank([self.slow, self.fast]), [self.fast, self.slow])
+
+    def test_failures_push_peer_down(self):
+        self.stats.record_success(self.fast, config.SUBFILE_SIZE, 0.1)
+        self.stats.record_success(self.flaky, config.SUBFILE_SIZE, 0.1)
+        for _ in range(3):
+            self.stats.record_failure(self.flaky)
+        self.assertEqual(self.stats.rank([self.flaky, self.fast]), [self.fast, self.flaky])
+        self.assertGreater(self.stats.get(self.flaky)[config.FAILURE_RATE], 0.5)
+
+    def test_unknown_peer_uses_defaults(self):
+        self.assertIsNone(self.stats.get(self.fast))
+        expected = config.DEFAULT_RTT + config.SUBFILE_SIZE / config.DEFAULT_THROUGHPUT
+        self.assertAlmostEqual(self.stats.score(self.fast), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from placement import RendezvousPlacement
+
+
+class TestRendezvousPlacement(unittest.TestCase):
+
+    def setUp(self):
+        self.placement = RendezvousPlacement(b"k" * 32)
+        self.peers = list(range(20))
+
+    def test_deterministic_and_keyed(self):
+        assignment = self.placement.assign("file", 10, self.peers)
+        self.assertEqual(assignment, self.placement.assign("file", 10, list(reversed(self.peers))))
+        self.assertEqual(len(set(assignment)), 10)  # one share per peer
+        other = RendezvousPlacement(b"x" * 32).assign("file", 10, self.peers)
+        self.assertNotEqual(assignment, other)
+
+    def test_membership_change_moves_few_shares(self):
+        before = [self.placement.rank("file", i, self.peers)[0] for i in range(200)]
+        after = [self.placement.rank("file", i, self.peers[1:])[0] for i in range(200)]
+        moved = [i for i in range(200) if before[i] != after[i]]
+        self.assertEqual(moved, [i for i in range(200) if before[i] == self.peers[0]])  # only the leaver's
+        joined = [self.placement.rank("file", i, self.peers + [99])[0] for i in range(200)]
+        self.assertTrue(all(new in (old, 99) for old, new in zip(before, joined)))
+
+    def test_preference_starts_with_assignment(self):
+        preference = self.placement.preference("file", 30, self.peers, shares_per_peer=2)
+        self.assertEqual([node_ids[0] for node_ids in preference],
+                         self.placement.assign("file", 30, self.peers, shares_per_peer=2))
+        self.assertTrue(all(sorted(node_ids) == self.peers for node_ids in preference))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+import config
+from redundancy import RedundancyPolicy, durability
+
+
+class TestRedundancyPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = RedundancyPolicy(target_durability=0.9999, peer_availability=0.9, max_expansion=3)
+
+    def test_small_file_gets_redundancy(self):
+        params = self.policy.choose(10 * 1024, 12)
+        self.assertEqual(params[config.K], 1)
+        self.assertGreater(params[config.N], 1)
+        self.assertEqual(params[config.BLOCK_SIZE], 10 * 1024)
+
+    def test_reaches_target_with_fewest_shares(self):
+        params = self.policy.choose(3 * config.SUBFILE_SIZE, 50)
+        k, n = params[config.K], params[config.N]
+        self.assertEqual(k, 4)
+        self.assertGreaterEqual(durability(n, k, 0.9), 0.9999)
+        self.assertLess(durability(n - 1, k, 0.9), 0.9999)
+        self.assertLessEqual(params[config.BLOCK_SIZE], config.MAX_BLOCK_SIZE)
+
+    def test_shares_per_peer(self):
+        with self.assertRaises(ValueError):
+            self.policy.choose(3 * config.SUBFILE_SIZE, 3)
+        policy = RedundancyPolicy(max_shares_per_peer=4)
+        params = policy.choose(3 * config.SUBFILE_SIZE, 3)
+        self.assertLessEqual(params[config.N], 12)
+        self.assertEqual(params[config.SHARES_PER_PEER], -(-params[config.N] // 3))
+
+    def test_stripe_fits_memory(self):
+        params = self.policy.choose(100 * config.SUBFILE_SIZE, 300)
+        self.assertLessEqual((params[config.K] + params[config.N]) * params[config.STRIPE], config.STRIPE_MEMORY)
+        self.assertEqual(params[config.STRIPE] % config.BUFFER_SIZE, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
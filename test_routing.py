@@ -0,0 +1,105 @@
+import json
+import socket
+import threading
+import unittest
+from unittest import mock
+
+from phe import paillier
+
+import config
+from Node import Node
+from Peer import Peer
+from routing import RoutingTable, contact_to_dict, make_contact, node_key
+from transfer import recv_frame, send_frame
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def setUp(self):
+        self.own = make_contact("me", '127.0.0.1', 7000)
+        self.contacts = [make_contact(i, '127.0.0.1', 7001 + i) for i in range(200)]
+
+    def test_closest_in_xor_order(self):
+        table = RoutingTable(self.own.key)
+        for contact in self.contacts:
+            table.add(contact)
+        self.assertFalse(table.add(self.own))
+        target = node_key("some file")
+        closest = table.closest(target, 5)
+        expected = sorted(table.contacts(), key=lambda contact: contact.key ^ target)[:5]
+        self.assertEqual(closest, expected)
+        # far buckets are full, so the table holds far fewer contacts than it heard of
+        small = RoutingTable(self.own.key, bucket_size=4)
+        for contact in self.contacts:
+            small.add(contact)
+        self.assertLess(len(small), 40)
+
+    def test_full_bucket_keeps_replacements(self):
+        table = RoutingTable(self.own.key, bucket_size=2)
+        far = [contact for contact in self.contacts if table.bucket_index(contact.key) == config.ID_BITS - 1]
+        self.assertTrue(table.add(far[0]))
+        self.assertTrue(table.add(far[1]))
+        self.assertFalse(table.add(far[2]))
+        table.remove(far[0].key)
+        self.assertEqual({contact.key for contact in table.contacts()}, {far[1].key, far[2].key})
+
+    def test_random_key_falls_in_bucket(self):
+        table = RoutingTable(self.own.key)
+        for index in (0, 1, 17, config.ID_BITS - 1):
+            self.assertEqual(table.bucket_index(table.random_key(index)), index)
+
+
+class TestLookup(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        _, cls.private_key = paillier.generate_paillier_keypair(n_length=512)
+
+    def setUp(self):
+        self.node = Node(7100, peer_id="me", private_key=self.private_key)
+
+    def tearDown(self):
+        self.node.stop()
+
+    def test_iterative_lookup_finds_closest(self):
+        # a network of 150 nodes, each keeping at most 4 contacts per bucket
+        contacts = [make_contact(i, '127.0.0.1', 8000 + i) for i in range(150)]
+        tables = {}
+        for contact in contacts:
+            tables[contact.key] = RoutingTable(contact.key, bucket_size=4)
+            for other in contacts:
+                tables[contact.key].add(other)
+        self.node.routingTable.add(contacts[0])  # we only know one node
+
+        def find_node_at(contact, target):
+            self.node.routingTable.add(contact)
+            return tables[contact.key].closest(target, 4)
+
+        target = node_key("wanted")
+        with mock.patch.object(self.node, 'find_node_at', side_effect=find_node_at):
+            found = self.node.lookup(target, 4)
+        expected = sorted(contacts, key=lambda contact: contact.key ^ target)[:4]
+        self.assertEqual(found, expected)
+
+    def test_find_node_request(self):
+        peer = Peer(peer_id="server")
+        for i in range(30):
+            peer.routingTable.add(make_contact(i, '127.0.0.1', 9000 + i))
+        client, server = socket.socketpair()
+        thread = threading.Thread(target=peer.handle_find_node_request, args=(server,))
+        thread.start()
+        self.assertEqual(recv_frame(client), config.TRANSFER_READY)
+        target = node_key(3)
+        send_frame(client, json.dumps({config.TARGET: format(target, 'x'),
+                                       config.SENDER: contact_to_dict(self.node.contact)}))
+        found = json.loads(recv_frame(client))
+        thread.join()
+        self.assertEqual(found[0][config.PEER_ID], 3)
+        self.assertIn(self.node.contact, peer.routingTable.contacts())  # the sender was learned
+        client.close()
+        server.close()
+        peer.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from phe import paillier
+
+import config
+from dht import DHT
+from encryption import Encryption
+from Node import Node
+from snapshot import (DHT_SECTION, FILES_SECTION, Snapshot, decode_dht, decode_files, encode_dht, encode_files,
+                      write_snapshot)
+from spacePIR import SpacePIR
+
+
+class TestSnapshot(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        _, cls.private_key = paillier.generate_paillier_keypair(n_length=512)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_sections_round_trip(self):
+        dht = DHT()
+        for i in range(50):
+            dht.add_node(6000 + i, i if i % 2 else f"node-{i}", f"10.0.0.{i % 3}")
+        dht.remove_node(3)
+        space = SpacePIR(max_capacity=7, base_directory=self.directory)
+        space.add(b"a_part0,data")
+        space.add(b"b_part1,more")
+        path = os.path.join(self.directory, "state")
+        write_snapshot(path, {DHT_SECTION: encode_dht(*dht.changes_since(0)), FILES_SECTION: encode_files(space)})
+
+        restored, restored_space = DHT(), SpacePIR()
+        with Snapshot(path) as snapshot:
+            restored.merge(*decode_dht(snapshot.get(DHT_SECTION)))
+            decode_files(snapshot.get(FILES_SECTION), restored_space)
+        self.assertEqual(dict(restored.get_dht()), dict(dht.get_dht()))
+        self.assertEqual(restored.changes_since(0)[1], dht.changes_since(0)[1])  # the removal is kept
+        self.assertEqual(restored_space.space, space.space)
+        self.assertEqual((restored_space.max_capacity, restored_space.number_file_uploaded), (7, 2))
+
+    def test_damaged_snapshot_refused(self):
+        path = os.path.join(self.directory, "state")
+        write_snapshot(path, {DHT_SECTION: encode_dht([[1, 6000, '127.0.0.1', 1.0]], [])})
+        with open(path, 'r+b') as handle:
+            handle.seek(-3, os.SEEK_END)
+            handle.write(b"\xff")
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+        with open(path, 'wb') as handle:
+            handle.write(b"\x80\x04 a pickle")
+        with self.assertRaises(ValueError):
+            Snapshot(path)
+
+    def test_key_encoding(self):
+        key = Encryption.key_from_bytes(Encryption.key_to_bytes(self.private_key))
+        self.assertEqual((key.p, key.q, key.public_key.n), (self.private_key.p, self.private_key.q,
+                                                            self.private_key.public_key.n))
+        with self.assertRaises(ValueError):
+            Encryption.key_from_bytes(b"\x80\x04 a pickle")
+
+    def test_checkpoints_hold_only_changes(self):
+        node = Node(7400, peer_id="me", private_key=self.private_key)
+        for i in range(500):
+            node.add_node_to_DHT(6000 + i, i, '127.0.0.1')
+        prefix = self.directory + os.sep
+        node.store_Node("password", path=prefix)
+        base_path = os.path.join(self.directory, config.SNAPSHOT_FILE)
+        node.add_node_to_DHT(7000, "joined", '127.0.0.1')
+        node.DHT.remove_node(7)
+        node.checkpoint(prefix)
+        self.assertLess(os.path.getsize(base_path + ".1"), os.path.getsize(base_path) / 50)
+        node.stop()
+
+        restarted = Node(7401, peer_id="me", private_key=self.private_key)
+        restarted.load_node("password", path=prefix)
+        self.assertEqual(dict(restarted.DHT.get_dht()), dict(node.DHT.get_dht()))
+        self.assertEqual(len(restarted.routingTable), len(node.routingTable))
+        restarted.add_node_to_DHT(7001, "later", '127.0.0.1')
+        restarted.checkpoint(prefix)  # goes on from the last checkpoint loaded
+        self.assertTrue(os.path.exists(base_path + ".2"))
+        restarted.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
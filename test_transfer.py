@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+import config
+from Peer import Peer
+from transfer import (ACK, TRANSFER_HEADER, SegmentReceiver, pack_chunks, pack_segment, pack_sizes, receive_segments,
+                      recv_frame, send_frame, send_segments, transfer_id, unpack_chunks, unpack_sizes)
+
+
+class TestSegmentedTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.peer = Peer(peer_id=1)
+        self.peer.spacePIR.base_directory = self.directory
+
+    def tearDown(self):
+        self.peer.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_segments_round_trip(self):
+        payload = os.urandom(5 * config.SEGMENT_SIZE + 123)
+        sender, receiver_sock = socket.socketpair()
+        receiver = SegmentReceiver(len(payload))
+        thread = threading.Thread(target=receive_segments, args=(receiver_sock, receiver))
+        thread.start()
+        self.assertEqual(send_segments(sender, payload), len(payload))
+        thread.join()
+        self.assertEqual(receiver.get_data(), payload)
+        sender.close()
+        receiver_sock.close()
+
+    def test_segments_from_file_object(self):
+        payload = os.urandom(2 * config.SEGMENT_SIZE + 5)
+        sender, receiver_sock = socket.socketpair()
+        receiver = SegmentReceiver(len(payload))
+        thread = threading.Thread(target=receive_segments, args=(receiver_sock, receiver))
+        thread.start()
+        send_segments(sender, io.BytesIO(payload))
+        thread.join()
+        self.assertEqual(receiver.get_data(), payload)
+        self.assertEqual(transfer_id(io.BytesIO(payload)), transfer_id(payload))
+        sender.close()
+        receiver_sock.close()
+
+    def test_corrupted_segment_is_dropped(self):
+        receiver = SegmentReceiver(8)
+        segment = bytearray(pack_segment(0, 0, b"abcdefgh"))
+        segment[-1] ^= 0xFF
+        self.assertFalse(receiver.accept(bytes(segment)))
+        self.assertFalse(receiver.accept(pack_segment(1, 4, b"efgh")))  # not contiguous
+        self.assertTrue(receiver.accept(pack_segment(0, 0, b"abcd")))
+        self.assertEqual(receiver.offset, 4)
+
+    def test_chunks_round_trip(self):
+        chunks = [b"", b"a", os.urandom(1000)]
+        self.assertEqual(unpack_chunks(pack_chunks(chunks)), chunks)
+        self.assertEqual(unpack_sizes(pack_sizes([0, 5, config.SUBFILE_SIZE])), [0, 5, config.SUBFILE_SIZE])
+
+    def _start_upload(self, payload):
+        client, server = socket.socketpair()
+        thread = threading.Thread(target=self._serve, args=(server,))
+        thread.start()
+        self.assertEqual(recv_frame(client), config.UPLOAD_APPROVED)
+        send_frame(client, TRANSFER_HEADER.pack(len(payload), config.SEGMENT_SIZE) + transfer_id(payload).encode())
+        return client, thread, ACK.unpack(recv_frame(client))[0]
+
+    def _serve(self, sock):
+        try:
+            self.peer.handle_segmented_upload_request(sock)
+        except ConnectionError:
+            pass
+        finally:
+            sock.close()
+
+    def test_upload_resumes_after_drop(self):
+        payload = b"share_part0," + os.urandom(3 * config.SEGMENT_SIZE)
+
+        # First connection sends two segments and drops
+        client, thread, offset = self._start_upload(payload)
+        self.assertEqual(offset, 0)
+        for seq in range(2):
+            position = seq * config.SEGMENT_SIZE
+            send_frame(client, pack_segment(seq, position, payload[position:position + config.SEGMENT_SIZE]))
+            recv_frame(client)
+        client.close()
+        thread.join()
+        self.assertEqual(self.peer._partial_uploads.get(transfer_id(payload)).offset, 2 * config.SEGMENT_SIZE)
+
+        # The reconnecting sender resumes from the acknowledged offset
+        client, thread, offset = self._start_upload(payload)
+        self.assertEqual(offset, 2 * config.SEGMENT_SIZE)
+        self.assertIsNone(self.peer._partial_uploads.get(transfer_id(payload)))  # owned by this connection
+        send_segments(client, payload, offset)
+        self.assertEqual(recv_frame(client), config.UPLOADED_SUCCESS)
+        client.close()
+        thread.join()
+        self.assertEqual(self.peer.spacePIR.get_file_names(), ["share_part0"])
+
+
+    def test_batch_upload(self):
+        payloads = [f"share_part{i},".encode() + os.urandom(config.SEGMENT_SIZE + i) for i in range(3)]
+        client, server = socket.socketpair()
+        thread = threading.Thread(target=self.peer.handle_batch_upload_request, args=(server,))
+        thread.start()
+        self.assertEqual(recv_frame(client), config.UPLOAD_APPROVED)
+        for payload in payloads:
+            send_frame(client, TRANSFER_HEADER.pack(len(payload), config.SEGMENT_SIZE) + transfer_id(payload).encode())
+            self.assertEqual(ACK.unpack(recv_frame(client))[0], 0)
+            send_segments(client, payload)
+            self.assertEqual(recv_frame(client), config.UPLOADED_SUCCESS)
+        send_frame(client, config.BATCH_END)
+        thread.join()
+        client.close()
+        server.close()
+        self.assertEqual(sorted(self.peer.spacePIR.get_file_names()), ["share_part0", "share_part1", "share_part2"])
+
+
+if __name__ == '__main__':
+    unittest.main()
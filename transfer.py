@@ -0,0 +1,246 @@
+import hashlib
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import config
+
+FRAME_HEADER = struct.Struct('!I')  # length of the frame payload
+SEGMENT_HEADER = struct.Struct('!IQII')  # sequence number, offset, length, crc32
+ACK = struct.Struct('!Q')  # offset acknowledged by the receiver
+TRANSFER_HEADER = struct.Struct('!QI')  # total size, segment size
+FILE_SIZE = struct.Struct('!I')  # size of a stored file, as listed next to the file names
+CHUNK_RANGE = struct.Struct('!II')  # first chunk and number of chunks of a ranged PIR response
+
+
+def recv_exact(sock, size):
+    """
+    Receive exactly `size` bytes from the socket.
+
+    Raises:
+        ConnectionError: If the connection closes before all the bytes arrived.
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), config.BUFFER_SIZE))
+        if not chunk:
+            raise ConnectionError(f"connection closed after {len(data)} of {size} bytes")
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, payload):
+    """
+    Send a length-prefixed frame over the socket.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('UTF-8')
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """
+    Receive a length-prefixed frame from the socket.
+    """
+    size = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))[0]
+    if size > config.MAX_FRAME_SIZE:
+        raise ValueError(f"frame of {size} bytes is larger than {config.MAX_FRAME_SIZE}")
+    return recv_exact(sock, size)
+
+
+def pack_segment(seq, offset, data):
+    """
+    Build a segment frame payload: header (seq, offset, length, crc32) followed by the data.
+    """
+    return SEGMENT_HEADER.pack(seq, offset, len(data), zlib.crc32(data)) + data
+
+
+def unpack_segment(payload):
+    """
+    Parse a segment frame payload.
+
+    Returns:
+        Tuple[int, int, bytes]: The sequence number, the offset and the data.
+
+    Raises:
+        ValueError: If the segment is truncated or its checksum does not match.
+    """
+    seq, offset, length, crc = SEGMENT_HEADER.unpack(payload[:SEGMENT_HEADER.size])
+    data = payload[SEGMENT_HEADER.size:]
+    if len(data) != length:
+        raise ValueError(f"segment {seq} is truncated ({len(data)} of {length} bytes)")
+    if zlib.crc32(data) != crc:
+        raise ValueError(f"segment {seq} failed its checksum")
+    return seq, offset, data
+
+
+def transfer_id(payload):
+    """
+    Identify a transfer by the digest of its payload, so a reconnecting sender finds its partial state.
+    The payload is bytes or a seekable binary file object.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        return hashlib.sha256(payload).hexdigest()
+    digest = hashlib.sha256()
+    payload.seek(0)
+    for chunk in iter(lambda: payload.read(config.SEGMENT_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def payload_size(payload):
+    """
+    Size of a payload given as bytes or as a seekable binary file object.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    payload.seek(0, 2)
+    return payload.tell()
+
+
+def read_at(payload, offset, size):
+    """
+    Read `size` bytes at `offset` of a payload given as bytes or as a seekable binary file object.
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        return payload[offset:offset + size]
+    payload.seek(offset)
+    return payload.read(size)
+
+
+def pack_chunks(chunks):
+    """
+    Serialize a list of byte chunks into a single length-prefixed byte stream.
+    """
+    return b"".join(FRAME_HEADER.pack(len(chunk)) + chunk for chunk in chunks)
+
+
+def unpack_chunks(payload):
+    """
+    Split a byte stream built by `pack_chunks` back into its chunks.
+    """
+    chunks = []
+    i = 0
+    while i < len(payload):
+        size = FRAME_HEADER.unpack(payload[i:i + FRAME_HEADER.size])[0]
+        i += FRAME_HEADER.size
+        chunks.append(payload[i:i + size])
+        i += size
+    return chunks
+
+
+def pack_sizes(sizes):
+    """
+    Serialize a list of file sizes.
+    """
+    return b"".join(FILE_SIZE.pack(size) for size in sizes)
+
+
+def unpack_sizes(payload):
+    """
+    Parse a list of file sizes built by `pack_sizes`.
+    """
+    return [size for size, in FILE_SIZE.iter_unpack(payload)]
+
+
+class SegmentReceiver:
+    """
+    Reassemble a segmented transfer, keeping track of the offset that was acknowledged to the sender.
+    """
+
+    def __init__(self, total_size):
+        self.total_size = total_size
+        self.buffer = bytearray()
+
+    @property
+    def offset(self):
+        return len(self.buffer)
+
+    def is_complete(self):
+        return self.offset >= self.total_size
+
+    def accept(self, payload):
+        """
+        Append a segment if it is intact and continues exactly where the buffer ends.
+
+        Returns:
+            bool: True if the segment was appended, False if it was dropped.
+        """
+        try:
+            _, offset, data = unpack_segment(payload)
+        except (ValueError, struct.error) as e:
+            print(f"dropping segment: {e}")
+            return False
+        if offset != self.offset or offset + len(data) > self.total_size:
+            return False
+        self.buffer += data
+        return True
+
+    def get_data(self):
+        return bytes(self.buffer)
+
+
+class PartialTransfers:
+    """
+    Bounded store of unfinished transfers, evicting the oldest one when full. It is shared by the
+    connection handler threads, so every access holds a lock. A handler that resumes a transfer takes
+    it out with `pop`, which gives it sole ownership until it puts the transfer back.
+    """
+
+    def __init__(self, max_transfers=config.MAX_PARTIAL_TRANSFERS):
+        self.max_transfers = max_transfers
+        self._transfers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._transfers.get(key)
+
+    def put(self, key, value):
+        with self._lock:
+            self._transfers[key] = value
+            self._transfers.move_to_end(key)
+            while len(self._transfers) > self.max_transfers:
+                self._transfers.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._transfers.pop(key, None)
+
+
+def send_segments(sock, payload, offset=0, segment_size=config.SEGMENT_SIZE, window=config.TRANSFER_WINDOW):
+    """
+    Send `payload` (bytes or a seekable binary file object, read one segment at a time) from `offset` as
+    checksummed segments, a window at a time, going back to the last acknowledged offset whenever the
+    receiver dropped a segment.
+
+    Returns:
+        int: The offset acknowledged by the receiver, which is the payload size once the transfer is done.
+    """
+    size = payload_size(payload)
+    acked = offset
+    seq = offset // segment_size
+    while acked < size:
+        position = acked
+        sent = 0
+        while sent < window and position < size:
+            data = read_at(payload, position, segment_size)
+            send_frame(sock, pack_segment(seq + sent, position, data))
+            position += len(data)
+            sent += 1
+        for _ in range(sent):
+            acked = ACK.unpack(recv_frame(sock))[0]
+        seq = acked // segment_size
+    return acked
+
+
+def receive_segments(sock, receiver):
+    """
+    Receive segments into `receiver` until it is complete, acknowledging every segment with the
+    contiguous offset received so far.
+    """
+    while not receiver.is_complete():
+        receiver.accept(recv_frame(sock))
+        send_frame(sock, ACK.pack(receiver.offset))
+    return receiver